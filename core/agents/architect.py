@@ -9,6 +9,7 @@ from core.agents.response import AgentResponse
 from core.db.models import Specification
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import SetAction, UpdateState
 from core.telemetry import telemetry
 from core.templates.base import BaseProjectTemplate, NoOptions
 from core.templates.example_project import EXAMPLE_PROJECTS
@@ -108,9 +109,9 @@ class Architect(BaseAgent):
 
         await self.check_system_dependencies(spec)
 
-        self.next_state.specification = spec
+        await self.state_manager.execute(UpdateState("specification", spec))
         telemetry.set("templates", spec.templates)
-        self.next_state.action = ARCHITECTURE_STEP_NAME
+        await self.state_manager.execute(SetAction(ARCHITECTURE_STEP_NAME))
         return AgentResponse.done(self)
 
     async def select_templates(self, spec: Specification) -> tuple[str, dict[ProjectTemplateEnum, Any]]:
@@ -9,6 +9,7 @@ from core.config import CHECK_LOGS_AGENT_NAME, magic_words
 from core.db.models.project_state import IterationStatus
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import CompleteIteration, UpdateBugHuntingCycle, UpdateIteration
 from core.telemetry import telemetry
 
 log = get_logger(__name__)
@@ -73,7 +74,9 @@ class BugHunter(BaseAgent):
             next_solution_to_try=None,
         )
         bug_reproduction_instructions = await llm(convo, temperature=0)
-        self.next_state.current_iteration["bug_reproduction_description"] = bug_reproduction_instructions
+        await self.state_manager.execute(
+            UpdateIteration({"bug_reproduction_description": bug_reproduction_instructions})
+        )
 
     async def check_logs(self, logs_message: str = None):
         llm = self.get_llm(CHECK_LOGS_AGENT_NAME, stream_output=True)
@@ -95,16 +98,15 @@ class BugHunter(BaseAgent):
         num_bug_hunting_cycles = len(bug_hunting_cycles) if bug_hunting_cycles else 0
         if hunt_conclusion.conclusion == magic_words.PROBLEM_IDENTIFIED:
             # if no need for logs, implement iteration same as before
-            self.set_data_for_next_hunting_cycle(human_readable_instructions, IterationStatus.AWAITING_BUG_FIX)
+            await self.set_data_for_next_hunting_cycle(human_readable_instructions, IterationStatus.AWAITING_BUG_FIX)
             await self.send_message("Found the bug. I'm attempting to fix it ...")
             await self.ui.send_bug_hunter_status("fixing_bug", num_bug_hunting_cycles)
         else:
             # if logs are needed, add logging steps
-            self.set_data_for_next_hunting_cycle(human_readable_instructions, IterationStatus.AWAITING_LOGGING)
+            await self.set_data_for_next_hunting_cycle(human_readable_instructions, IterationStatus.AWAITING_LOGGING)
             await self.send_message("Adding more logs to identify the bug ...")
             await self.ui.send_bug_hunter_status("adding_logs", num_bug_hunting_cycles)
 
-        self.next_state.flag_iterations_as_modified()
         return AgentResponse.done(self)
 
     async def ask_user_to_test(self, awaiting_bug_reproduction: bool = False, awaiting_user_test: bool = False):
@@ -126,13 +128,12 @@ class BugHunter(BaseAgent):
                 hint="Instructions for testing:\n\n"
                 + self.current_state.current_iteration["bug_reproduction_description"],
             )
-            self.next_state.current_iteration["bug_hunting_cycles"][-1]["fix_attempted"] = True
+            await self.state_manager.execute(UpdateBugHuntingCycle({"fix_attempted": True}))
 
             if user_feedback.button == "yes":
-                self.next_state.complete_iteration()
+                await self.state_manager.execute(CompleteIteration())
             elif user_feedback.button == "start_pair_programming":
-                self.next_state.current_iteration["status"] = IterationStatus.START_PAIR_PROGRAMMING
-                self.next_state.flag_iterations_as_modified()
+                await self.state_manager.execute(UpdateIteration({"status": IterationStatus.START_PAIR_PROGRAMMING}))
             else:
                 awaiting_bug_reproduction = True
 
@@ -153,10 +154,9 @@ class BugHunter(BaseAgent):
             )
 
             if backend_logs.button == "done":
-                self.next_state.complete_iteration()
+                await self.state_manager.execute(CompleteIteration())
             elif backend_logs.button == "start_pair_programming":
-                self.next_state.current_iteration["status"] = IterationStatus.START_PAIR_PROGRAMMING
-                self.next_state.flag_iterations_as_modified()
+                await self.state_manager.execute(UpdateIteration({"status": IterationStatus.START_PAIR_PROGRAMMING}))
             else:
                 buttons = {
                     "copy_frontend_logs": "Copy Frontend Logs",
@@ -180,10 +180,16 @@ class BugHunter(BaseAgent):
                 )
 
                 # TODO select only the logs that are new (with PYTHAGORA_DEBUGGING_LOG)
-                self.next_state.current_iteration["bug_hunting_cycles"][-1]["backend_logs"] = backend_logs.text
-                self.next_state.current_iteration["bug_hunting_cycles"][-1]["frontend_logs"] = frontend_logs.text
-                self.next_state.current_iteration["bug_hunting_cycles"][-1]["user_feedback"] = user_feedback.text
-                self.next_state.current_iteration["status"] = IterationStatus.HUNTING_FOR_BUG
+                await self.state_manager.execute(
+                    UpdateBugHuntingCycle(
+                        {
+                            "backend_logs": backend_logs.text,
+                            "frontend_logs": frontend_logs.text,
+                            "user_feedback": user_feedback.text,
+                        }
+                    )
+                )
+                await self.state_manager.execute(UpdateIteration({"status": IterationStatus.HUNTING_FOR_BUG}))
 
         return AgentResponse.done(self)
 
@@ -217,7 +223,7 @@ class BugHunter(BaseAgent):
         )
 
         while True:
-            self.next_state.current_iteration["initial_explanation"] = initial_explanation
+            await self.state_manager.execute(UpdateIteration({"initial_explanation": initial_explanation}))
             next_step = await self.ask_question(
                 "What do you want to do?",
                 buttons={
@@ -254,7 +260,7 @@ class BugHunter(BaseAgent):
 
             # TODO: in the future improve with a separate conversation that parses the user info and goes into an appropriate if statement
             if next_step.button == "done":
-                self.next_state.complete_iteration()
+                await self.state_manager.execute(CompleteIteration())
                 break
             elif next_step.button == "question":
                 user_response = await self.ask_question("Oh, cool, what would you like to know?")
@@ -287,10 +293,9 @@ class BugHunter(BaseAgent):
                     )
                     llm = self.get_llm(stream_output=True)
                     if human_approval.button == "yes":
-                        self.set_data_for_next_hunting_cycle(
+                        await self.set_data_for_next_hunting_cycle(
                             human_readable_instructions, IterationStatus.AWAITING_BUG_FIX
                         )
-                        self.next_state.flag_iterations_as_modified()
                         break
                     else:
                         human_hint_label = "Oh, my bad, what did I misunderstand?"
@@ -330,9 +335,8 @@ class BugHunter(BaseAgent):
 
         return convo
 
-    def set_data_for_next_hunting_cycle(self, human_readable_instructions, new_status):
-        self.next_state.current_iteration["description"] = human_readable_instructions
-        self.next_state.current_iteration["bug_hunting_cycles"] += [
+    async def set_data_for_next_hunting_cycle(self, human_readable_instructions, new_status):
+        bug_hunting_cycles = self.next_state.current_iteration["bug_hunting_cycles"] + [
             {
                 "human_readable_instructions": human_readable_instructions,
                 "fix_attempted": any(
@@ -340,8 +344,15 @@ class BugHunter(BaseAgent):
                 ),
             }
         ]
-
-        self.next_state.current_iteration["status"] = new_status
+        await self.state_manager.execute(
+            UpdateIteration(
+                {
+                    "description": human_readable_instructions,
+                    "bug_hunting_cycles": bug_hunting_cycles,
+                    "status": new_status,
+                }
+            )
+        )
 
     async def continue_on(self, convo, button_value, user_response):
         llm = self.get_llm(stream_output=True)
@@ -11,6 +11,7 @@ from core.agents.response import AgentResponse, ResponseType
 from core.config import CODE_MONKEY_AGENT_NAME, CODE_REVIEW_AGENT_NAME, DESCRIBE_FILES_AGENT_NAME
 from core.llm.parser import JSONParser, OptionalCodeBlockParser
 from core.log import get_logger
+from core.state.actor import CompleteStep, SetAction, SetFileMeta
 
 log = get_logger(__name__)
 
@@ -89,7 +90,7 @@ class CodeMonkey(BaseAgent):
                 await self.ui.send_file_status(file_name, "updating" if file_content else "creating")
             else:
                 await self.ui.send_file_status(file_name, "reworking")
-            self.next_state.action = "Updating files"
+            await self.state_manager.execute(SetAction("Updating files"))
             attempt = 1
             feedback = None
 
@@ -134,9 +135,9 @@ class CodeMonkey(BaseAgent):
 
     async def describe_files(self) -> AgentResponse:
         llm = self.get_llm(DESCRIBE_FILES_AGENT_NAME)
-        to_describe = {
-            file.path: file.content.content for file in self.current_state.files if not file.meta.get("description")
-        }
+        undescribed = [file for file in self.current_state.files if not file.meta.get("description")]
+        await self.state_manager.load_file_contents(undescribed)
+        to_describe = {file.path: file.content.content for file in undescribed}
 
         for file in self.next_state.files:
             content = to_describe.get(file.path)
@@ -144,11 +145,12 @@ class CodeMonkey(BaseAgent):
                 continue
 
             if content == "":
-                file.meta = {
+                meta = {
                     **file.meta,
                     "description": "Empty file",
                     "references": [],
                 }
+                await self.state_manager.execute(SetFileMeta(file.path, meta))
                 continue
 
             log.debug(f"Describing file {file.path}")
@@ -163,11 +165,12 @@ class CodeMonkey(BaseAgent):
             )
             llm_response: FileDescription = await llm(convo, parser=JSONParser(spec=FileDescription))
 
-            file.meta = {
+            meta = {
                 **file.meta,
                 "description": llm_response.summary,
                 "references": llm_response.references,
             }
+            await self.state_manager.execute(SetFileMeta(file.path, meta))
         return AgentResponse.done(self)
 
     # ------------------------------
@@ -208,7 +211,7 @@ class CodeMonkey(BaseAgent):
         await self.ui.generate_diff(file_path, old_content, new_content, n_new_lines, n_del_lines)
 
         await self.state_manager.save_file(file_path, new_content)
-        self.next_state.complete_step()
+        await self.state_manager.execute(CompleteStep())
 
         input_required = self.state_manager.get_input_required(new_content)
         if input_required:
@@ -14,6 +14,7 @@ from core.db.models.project_state import IterationStatus, TaskStatus
 from core.db.models.specification import Complexity
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import CompleteIteration, SetAction, SetTaskStatus, UpdateIteration, UpdateState, UpdateTask
 from core.telemetry import telemetry
 
 log = get_logger(__name__)
@@ -149,33 +150,30 @@ class Developer(RelevantFilesMixin, BaseAgent):
         )
         response: TaskSteps = await llm(convo, parser=JSONParser(TaskSteps), temperature=0)
 
-        self.set_next_steps(response, source)
+        await self.set_next_steps(response, source)
 
         if iteration:
             if "status" not in iteration or (
                 iteration["status"] in (IterationStatus.AWAITING_USER_TEST, IterationStatus.AWAITING_BUG_REPRODUCTION)
             ):
                 # This is just a support for old iterations that don't have status
-                self.next_state.complete_iteration()
-                self.next_state.action = f"Troubleshooting #{len(self.current_state.iterations)}"
+                await self.state_manager.execute(CompleteIteration())
+                await self.state_manager.execute(SetAction(f"Troubleshooting #{len(self.current_state.iterations)}"))
             elif iteration["status"] == IterationStatus.IMPLEMENT_SOLUTION:
                 # If the user requested a change, then, we'll implement it and go straight back to testing
-                self.next_state.complete_iteration()
-                self.next_state.action = f"Troubleshooting #{len(self.current_state.iterations)}"
+                await self.state_manager.execute(CompleteIteration())
+                await self.state_manager.execute(SetAction(f"Troubleshooting #{len(self.current_state.iterations)}"))
             elif iteration["status"] == IterationStatus.AWAITING_BUG_FIX:
                 # If bug fixing is done, ask user to test again
-                self.next_state.current_iteration["status"] = IterationStatus.AWAITING_USER_TEST
+                await self.state_manager.execute(UpdateIteration({"status": IterationStatus.AWAITING_USER_TEST}))
             elif iteration["status"] == IterationStatus.AWAITING_LOGGING:
                 # If logging is done, ask user to reproduce the bug
-                self.next_state.current_iteration["status"] = IterationStatus.AWAITING_BUG_REPRODUCTION
+                await self.state_manager.execute(UpdateIteration({"status": IterationStatus.AWAITING_BUG_REPRODUCTION}))
         else:
-            self.next_state.action = "Task review feedback"
+            await self.state_manager.execute(SetAction("Task review feedback"))
 
         current_task_index = self.current_state.tasks.index(current_task)
-        self.next_state.tasks[current_task_index] = {
-            **current_task,
-        }
-        self.next_state.flag_tasks_as_modified()
+        await self.state_manager.execute(UpdateTask({**current_task}, index=current_task_index))
         return AgentResponse.done(self)
 
     async def breakdown_current_task(self) -> AgentResponse:
@@ -214,11 +212,9 @@ class Developer(RelevantFilesMixin, BaseAgent):
 
         await self.get_relevant_files(None, response)
 
-        self.next_state.tasks[current_task_index] = {
-            **current_task,
-            "instructions": response,
-        }
-        self.next_state.flag_tasks_as_modified()
+        await self.state_manager.execute(
+            UpdateTask({**current_task, "instructions": response}, index=current_task_index)
+        )
 
         llm = self.get_llm(PARSE_TASK_AGENT_NAME)
         await self.send_message("Breaking down the task into steps ...")
@@ -226,9 +222,9 @@ class Developer(RelevantFilesMixin, BaseAgent):
         response: TaskSteps = await llm(convo, parser=JSONParser(TaskSteps), temperature=0)
 
         # There might be state leftovers from previous tasks that we need to clean here
-        self.next_state.modified_files = {}
-        self.set_next_steps(response, source)
-        self.next_state.action = f"Task #{current_task_index + 1} start"
+        await self.state_manager.execute(UpdateState("modified_files", {}))
+        await self.set_next_steps(response, source)
+        await self.state_manager.execute(SetAction(f"Task #{current_task_index + 1} start"))
         await telemetry.trace_code_event(
             "task-start",
             {
@@ -239,12 +235,12 @@ class Developer(RelevantFilesMixin, BaseAgent):
         )
         return AgentResponse.done(self)
 
-    def set_next_steps(self, response: TaskSteps, source: str):
+    async def set_next_steps(self, response: TaskSteps, source: str):
         # For logging/debugging purposes, we don't want to remove the finished steps
         # until we're done with the task.
         unique_steps = self.remove_duplicate_steps({**response.model_dump()})
         finished_steps = [step for step in self.current_state.steps if step["completed"]]
-        self.next_state.steps = finished_steps + [
+        next_steps = finished_steps + [
             {
                 "id": uuid4().hex,
                 "completed": False,
@@ -254,6 +250,7 @@ class Developer(RelevantFilesMixin, BaseAgent):
             }
             for step in unique_steps["steps"]
         ]
+        await self.state_manager.execute(UpdateState("steps", next_steps))
         log.debug(f"Next steps: {self.next_state.unfinished_steps}")
 
     def remove_duplicate_steps(self, data):
@@ -303,8 +300,8 @@ class Developer(RelevantFilesMixin, BaseAgent):
 
         if user_response.cancelled or user_response.button == "skip":
             log.info(f"Skipping task: {description}")
-            self.next_state.current_task["instructions"] = "(skipped on user request)"
-            self.next_state.set_current_task_status(TaskStatus.SKIPPED)
+            await self.state_manager.execute(UpdateTask({"instructions": "(skipped on user request)"}))
+            await self.state_manager.execute(SetTaskStatus(TaskStatus.SKIPPED))
             await self.send_message("Skipping task...")
             # We're done here, and will pick up the next task (if any) on the next run
             return False
@@ -323,9 +320,8 @@ class Developer(RelevantFilesMixin, BaseAgent):
             # User hasn't edited the task, so we can execute it immediately as is
             return await self.ask_to_execute_task()
 
-        self.next_state.current_task["description"] = user_response.text
-        self.next_state.current_task["run_always"] = True
-        self.next_state.relevant_files = None
+        await self.state_manager.execute(UpdateTask({"description": user_response.text, "run_always": True}))
+        await self.state_manager.execute(UpdateState("relevant_files", None))
         log.info(f"Task description updated to: {user_response.text}")
         # Orchestrator will rerun us with the new task description
         return False
@@ -5,6 +5,7 @@ from core.agents.convo import AgentConvo
 from core.agents.response import AgentResponse
 from core.db.models.project_state import IterationStatus
 from core.log import get_logger
+from core.state.actor import UpdateState
 
 log = get_logger(__name__)
 
@@ -103,7 +104,7 @@ class ErrorHandler(BaseAgent):
         llm_response: str = await llm(convo)
 
         # TODO: duplicate from Troubleshooter, maybe extract to a ProjectState method?
-        self.next_state.iterations = self.current_state.iterations + [
+        iterations = self.current_state.iterations + [
             {
                 "id": uuid4().hex,
                 "user_feedback": f"Error running command: {cmd}",
@@ -115,7 +116,9 @@ class ErrorHandler(BaseAgent):
                 "bug_hunting_cycles": [],
             }
         ]
+        await self.state_manager.execute(UpdateState("iterations", iterations))
         # TODO: maybe have ProjectState.finished_steps as well? would make the debug/ran_command prompts nicer too
-        self.next_state.steps = [s for s in self.current_state.steps if s.get("completed") is True]
+        steps = [s for s in self.current_state.steps if s.get("completed") is True]
+        await self.state_manager.execute(UpdateState("steps", steps))
         # No need to call complete_step() here as we've just removed the steps so that Developer can break down the iteration
         return AgentResponse.done(self)
@@ -10,6 +10,7 @@ from core.llm.parser import JSONParser
 from core.log import get_logger
 from core.proc.exec_log import ExecLog
 from core.proc.process_manager import ProcessManager
+from core.state.actor import CompleteStep, SetAction
 from core.state.state_manager import StateManager
 from core.ui.base import AgentSource, UIBase, UISource
 
@@ -91,8 +92,8 @@ class Executor(BaseAgent):
         if confirm.button == "no":
             log.info(f"Skipping command execution of `{cmd}` (requested by user)")
             await self.send_message(f"Skipping command {cmd}")
-            self.complete()
-            self.next_state.action = f'Skip "{cmd_name}"'
+            await self.complete()
+            await self.state_manager.execute(SetAction(f'Skip "{cmd_name}"'))
             return AgentResponse.done(self)
 
         started_at = datetime.now(timezone.utc)
@@ -104,8 +105,8 @@ class Executor(BaseAgent):
 
         duration = (datetime.now(timezone.utc) - started_at).total_seconds()
 
-        self.complete()
-        self.next_state.action = f'Run "{cmd_name}"'
+        await self.complete()
+        await self.state_manager.execute(SetAction(f'Run "{cmd_name}"'))
 
         exec_log = ExecLog(
             started_at=started_at,
@@ -160,7 +161,7 @@ class Executor(BaseAgent):
         )
         return await llm(convo, parser=JSONParser(spec=CommandResult), temperature=0)
 
-    def complete(self):
+    async def complete(self):
         """
         Mark the step as complete.
 
@@ -172,4 +173,4 @@ class Executor(BaseAgent):
         information we give it.
         """
         self.step = None
-        self.next_state.complete_step()
+        await self.state_manager.execute(CompleteStep())
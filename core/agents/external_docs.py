@@ -10,6 +10,7 @@ from core.agents.response import AgentResponse
 from core.config import EXTERNAL_DOCUMENTATION_API
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import UpdateState
 from core.telemetry import telemetry
 
 log = get_logger(__name__)
@@ -170,4 +171,4 @@ class ExternalDocumentation(BaseAgent):
         for docset_key, snip in snippets:
             docs.append({"key": docset_key, "desc": docsets_dict[docset_key], "snippets": snip})
 
-        self.next_state.docs = docs
+        await self.state_manager.execute(UpdateState("docs", docs))
@@ -1,5 +1,6 @@
 from core.agents.base import BaseAgent
 from core.agents.response import AgentResponse, ResponseType
+from core.state.actor import CompleteStep
 
 
 class HumanInput(BaseAgent):
@@ -21,7 +22,7 @@ class HumanInput(BaseAgent):
             default="continue",
             buttons_only=True,
         )
-        self.next_state.complete_step()
+        await self.state_manager.execute(CompleteStep())
         return AgentResponse.done(self)
 
     async def input_required(self, files: list[dict]) -> AgentResponse:
@@ -6,6 +6,7 @@ from core.agents.response import AgentResponse, ResponseType
 from core.db.models import Complexity
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import UpdateState
 from core.telemetry import telemetry
 from core.templates.example_project import EXAMPLE_PROJECT_DESCRIPTION
 
@@ -55,6 +56,8 @@ class Importer(BaseAgent):
 
     async def analyze_project(self):
         llm = self.get_llm(stream_output=True)
+        # The whole project is analyzed, so all the file contents are needed
+        await self.state_manager.load_file_contents()
 
         self.send_message("Inspecting most important project files ...")
 
@@ -71,8 +74,8 @@ class Importer(BaseAgent):
 
         spec = self.current_state.specification.clone()
         spec.description = llm_response
-        self.next_state.specification = spec
-        self.next_state.epics = [
+        await self.state_manager.execute(UpdateState("specification", spec))
+        epics = [
             {
                 "id": uuid4().hex,
                 "name": "Import project",
@@ -85,6 +88,7 @@ class Importer(BaseAgent):
                 "complexity": Complexity.HARD if len(self.current_state.files) > 5 else Complexity.SIMPLE,
             }
         ]
+        await self.state_manager.execute(UpdateState("epics", epics))
 
         n_lines = sum(len(f.content.content.splitlines()) for f in self.current_state.files)
         await telemetry.trace_code_event(
@@ -1,5 +1,6 @@
 from core.agents.base import BaseAgent
 from core.agents.response import AgentResponse
+from core.state.actor import CompleteStep
 
 
 class LegacyHandler(BaseAgent):
@@ -8,7 +9,7 @@ class LegacyHandler(BaseAgent):
 
     async def run(self) -> AgentResponse:
         if self.data["type"] == "review_task":
-            self.next_state.complete_step()
+            await self.state_manager.execute(CompleteStep())
             return AgentResponse.done(self)
 
         raise ValueError(f"Unknown reason for calling Legacy Handler with data: {self.data}")
@@ -7,6 +7,7 @@ from core.agents.response import AgentResponse
 from core.config import GET_RELEVANT_FILES_AGENT_NAME, TROUBLESHOOTER_BUG_REPORT
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import UpdateState
 
 log = get_logger(__name__)
 
@@ -111,6 +112,7 @@ class RelevantFilesMixin:
                 relevant_files.difference_update(action.remove_files)
 
             read_files = [file for file in self.current_state.files if file.path in getattr(action, "read_files", [])]
+            await self.state_manager.load_file_contents(read_files)
 
             convo.remove_last_x_messages(1)
             convo.assistant(llm_response.original_response)
@@ -121,6 +123,6 @@ class RelevantFilesMixin:
 
         existing_files = {file.path for file in self.current_state.files}
         relevant_files = [path for path in relevant_files if path in existing_files]
-        self.next_state.relevant_files = relevant_files
+        await self.state_manager.execute(UpdateState("relevant_files", relevant_files))
 
         return AgentResponse.done(self)
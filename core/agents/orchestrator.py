@@ -51,6 +51,8 @@ class Orchestrator(BaseAgent):
 
         self.executor = Executor(self.state_manager, self.ui)
         self.process_manager = self.executor.process_manager
+        # Number of lines per file content ID, for the project stats
+        self.line_counts: dict[str, int] = {}
         # self.chat = Chat() TODO
 
         await self.init_ui()
@@ -60,6 +62,8 @@ class Orchestrator(BaseAgent):
         # and the inner which runs the agents for the current step until they're done. This would simplify
         # handle_done() and let us do other per-step processing (eg. describing files) in between agent runs.
         while True:
+            # Agent prompts include the contents of the relevant files, so make sure they're loaded
+            await self.state_manager.load_relevant_file_contents()
             await self.update_stats()
 
             agent = self.create_agent(response)
@@ -85,6 +89,9 @@ class Orchestrator(BaseAgent):
                 response = await self.handle_done(agent, response)
                 continue
 
+        # Make sure the last committed state is saved before exiting
+        await self.state_manager.wait_for_commit()
+
         # TODO: rollback changes to "next" so they aren't accidentally committed?
         return True
 
@@ -182,7 +189,8 @@ class Orchestrator(BaseAgent):
             f"{n_finished_iterations}/{n_iterations} iterations, "
             f"{n_finished_steps}/{n_steps} dev steps."
         )
-        await self.state_manager.commit()
+        # The next agent can start while the state is being saved; any errors are raised by the next commit
+        await self.state_manager.commit(background=True)
 
         # If there are any new or modified files changed outside Pythagora,
         # this is a good time to add them to the project. If any of them have
@@ -364,11 +372,16 @@ class Orchestrator(BaseAgent):
                 source,
             )
 
-        total_files = 0
-        total_lines = 0
-        for file in self.current_state.files:
-            total_files += 1
-            total_lines += len(file.content.content.splitlines())
+        # Only the contents that weren't counted before need to be loaded
+        files = self.current_state.files
+        uncounted = [file for file in files if file.content.id not in self.line_counts]
+        if uncounted:
+            await self.state_manager.load_file_contents(uncounted)
+            for file in uncounted:
+                self.line_counts[file.content.id] = len(file.content.content.splitlines())
+
+        total_files = len(files)
+        total_lines = sum(self.line_counts[file.content.id] for file in files)
 
         telemetry.set("num_files", total_files)
         telemetry.set("num_lines", total_lines)
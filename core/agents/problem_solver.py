@@ -9,6 +9,7 @@ from core.agents.troubleshooter import IterationPromptMixin
 from core.db.models.project_state import IterationStatus
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import UpdateIteration
 
 log = get_logger(__name__)
 
@@ -30,7 +31,6 @@ class ProblemSolver(IterationPromptMixin, BaseAgent):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.iteration = self.current_state.current_iteration
-        self.next_state_iteration = self.next_state.current_iteration
         self.previous_solutions = [s for s in self.iteration["alternative_solutions"] if s["tried"]]
         self.possible_solutions = [s for s in self.iteration["alternative_solutions"] if not s["tried"]]
 
@@ -62,7 +62,7 @@ class ProblemSolver(IterationPromptMixin, BaseAgent):
             parser=JSONParser(spec=AlternativeSolutions),
             temperature=1,
         )
-        self.next_state_iteration["alternative_solutions"] = self.iteration["alternative_solutions"] + [
+        alternative_solutions = self.iteration["alternative_solutions"] + [
             {
                 "user_feedback": None,
                 "description": solution,
@@ -70,7 +70,7 @@ class ProblemSolver(IterationPromptMixin, BaseAgent):
             }
             for solution in llm_response.alternative_solutions
         ]
-        self.next_state.flag_iterations_as_modified()
+        await self.state_manager.execute(UpdateIteration({"alternative_solutions": alternative_solutions}))
 
     async def try_alternative_solutions(self) -> AgentResponse:
         preferred_solution = await self.ask_for_preferred_solution()
@@ -79,7 +79,7 @@ class ProblemSolver(IterationPromptMixin, BaseAgent):
             # This means the user either needs expert help, or that they need to go back and
             # maybe rephrase the tasks or even the project specs.
             # For now, we'll just mark these as not working and try to regenerate.
-            self.next_state_iteration["alternative_solutions"] = [
+            alternative_solutions = [
                 {
                     **s,
                     "tried": True,
@@ -87,7 +87,7 @@ class ProblemSolver(IterationPromptMixin, BaseAgent):
                 }
                 for s in self.possible_solutions
             ]
-            self.next_state.flag_iterations_as_modified()
+            await self.state_manager.execute(UpdateIteration({"alternative_solutions": alternative_solutions}))
             return AgentResponse.done(self)
 
         index, next_solution_to_try = preferred_solution
@@ -96,11 +96,20 @@ class ProblemSolver(IterationPromptMixin, BaseAgent):
             next_solution_to_try=next_solution_to_try,
         )
 
-        self.next_state_iteration["alternative_solutions"][index]["tried"] = True
-        self.next_state_iteration["description"] = llm_solution
-        self.next_state_iteration["attempts"] = self.iteration["attempts"] + 1
-        self.next_state_iteration["status"] = IterationStatus.PROBLEM_SOLVER
-        self.next_state.flag_iterations_as_modified()
+        alternative_solutions = [
+            {**s, "tried": True} if i == index else s
+            for i, s in enumerate(self.next_state.current_iteration["alternative_solutions"])
+        ]
+        await self.state_manager.execute(
+            UpdateIteration(
+                {
+                    "alternative_solutions": alternative_solutions,
+                    "description": llm_solution,
+                    "attempts": self.iteration["attempts"] + 1,
+                    "status": IterationStatus.PROBLEM_SOLVER,
+                }
+            )
+        )
         return AgentResponse.done(self)
 
     async def ask_for_preferred_solution(self) -> Optional[tuple[int, str]]:
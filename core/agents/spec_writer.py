@@ -6,6 +6,7 @@ from core.db.models import Complexity
 from core.db.models.project_state import IterationStatus
 from core.llm.parser import StringParser
 from core.log import get_logger
+from core.state.actor import SetAction, UpdateEpic, UpdateIteration, UpdateState
 from core.telemetry import telemetry
 from core.templates.example_project import (
     DEFAULT_EXAMPLE_PROJECT,
@@ -71,15 +72,16 @@ class SpecWriter(BaseAgent):
             initial_spec = await self.analyze_spec(user_description)
             reviewed_spec = await self.review_spec(desc=user_description, spec=initial_spec)
 
-        self.next_state.specification = self.current_state.specification.clone()
-        self.next_state.specification.original_description = user_description
-        self.next_state.specification.description = reviewed_spec
-        self.next_state.specification.complexity = complexity
+        spec = self.current_state.specification.clone()
+        spec.original_description = user_description
+        spec.description = reviewed_spec
+        spec.complexity = complexity
+        await self.state_manager.execute(UpdateState("specification", spec))
         telemetry.set("initial_prompt", user_description)
         telemetry.set("updated_prompt", reviewed_spec)
         telemetry.set("is_complex_app", complexity != Complexity.SIMPLE)
 
-        self.next_state.action = SPEC_STEP_NAME
+        await self.state_manager.execute(SetAction(SPEC_STEP_NAME))
         return AgentResponse.done(self)
 
     async def update_spec(self, iteration_mode) -> AgentResponse:
@@ -105,16 +107,16 @@ class SpecWriter(BaseAgent):
         await self.ui.close_diff()
 
         if user_response.button == "yes":
-            self.next_state.specification = self.current_state.specification.clone()
-            self.next_state.specification.description = updated_spec
+            spec = self.current_state.specification.clone()
+            spec.description = updated_spec
+            await self.state_manager.execute(UpdateState("specification", spec))
             telemetry.set("updated_prompt", updated_spec)
 
         if iteration_mode:
-            self.next_state.current_iteration["status"] = IterationStatus.FIND_SOLUTION
-            self.next_state.flag_iterations_as_modified()
+            await self.state_manager.execute(UpdateIteration({"status": IterationStatus.FIND_SOLUTION}))
         else:
             complexity = await self.check_prompt_complexity(user_response.text)
-            self.next_state.current_epic["complexity"] = complexity
+            await self.state_manager.execute(UpdateEpic({"complexity": complexity}))
 
         return AgentResponse.done(self)
 
@@ -135,7 +137,7 @@ class SpecWriter(BaseAgent):
         spec.example_project = example_name
         spec.description = example_description
         spec.complexity = EXAMPLE_PROJECTS[example_name]["complexity"]
-        self.next_state.specification = spec
+        await self.state_manager.execute(UpdateState("specification", spec))
 
         telemetry.set("initial_prompt", spec.description)
         telemetry.set("example_project", example_name)
@@ -1,6 +1,7 @@
 from core.agents.base import BaseAgent
 from core.agents.response import AgentResponse
 from core.log import get_logger
+from core.state.actor import CompleteTask, SetAction
 from core.telemetry import telemetry
 
 log = get_logger(__name__)
@@ -12,8 +13,8 @@ class TaskCompleter(BaseAgent):
 
     async def run(self) -> AgentResponse:
         current_task_index1 = self.current_state.tasks.index(self.current_state.current_task) + 1
-        self.next_state.action = f"Task #{current_task_index1} complete"
-        self.next_state.complete_task()
+        await self.state_manager.execute(SetAction(f"Task #{current_task_index1} complete"))
+        await self.state_manager.execute(CompleteTask())
         await self.state_manager.log_task_completed()
         tasks = self.current_state.tasks
         source = self.current_state.current_epic.get("source", "app")
@@ -9,6 +9,7 @@ from core.config import TECH_LEAD_PLANNING
 from core.db.models.project_state import TaskStatus
 from core.llm.parser import JSONParser
 from core.log import get_logger
+from core.state.actor import SetAction, UpdateEpic, UpdateState
 from core.telemetry import telemetry
 from core.templates.example_project import EXAMPLE_PROJECTS
 from core.templates.registry import PROJECT_TEMPLATES
@@ -41,16 +42,16 @@ class TechLead(BaseAgent):
     async def run(self) -> AgentResponse:
         if len(self.current_state.epics) == 0:
             if self.current_state.specification.example_project:
-                self.plan_example_project()
+                await self.plan_example_project()
             else:
-                self.create_initial_project_epic()
+                await self.create_initial_project_epic()
             return AgentResponse.done(self)
 
         await self.ui.send_project_stage(ProjectStage.CODING)
 
         if self.current_state.specification.templates and not self.current_state.files:
             await self.apply_project_templates()
-            self.next_state.action = "Apply project templates"
+            await self.state_manager.execute(SetAction("Apply project templates"))
             await self.ui.send_epics_and_tasks(
                 self.next_state.current_epic["sub_epics"],
                 self.next_state.tasks,
@@ -68,26 +69,25 @@ class TechLead(BaseAgent):
                 return AgentResponse.done(self)
 
         if self.current_state.current_epic:
-            self.next_state.action = "Create a development plan"
+            await self.state_manager.execute(SetAction("Create a development plan"))
             return await self.plan_epic(self.current_state.current_epic)
         else:
             return await self.ask_for_new_feature()
 
-    def create_initial_project_epic(self):
+    async def create_initial_project_epic(self):
         log.debug("Creating initial project Epic")
-        self.next_state.epics = [
-            {
-                "id": uuid4().hex,
-                "name": "Initial Project",
-                "source": "app",
-                "description": self.current_state.specification.description,
-                "test_instructions": None,
-                "summary": None,
-                "completed": False,
-                "complexity": self.current_state.specification.complexity,
-                "sub_epics": [],
-            }
-        ]
+        epic = {
+            "id": uuid4().hex,
+            "name": "Initial Project",
+            "source": "app",
+            "description": self.current_state.specification.description,
+            "test_instructions": None,
+            "summary": None,
+            "completed": False,
+            "complexity": self.current_state.specification.complexity,
+            "sub_epics": [],
+        }
+        await self.state_manager.execute(UpdateState("epics", [epic]))
 
     async def apply_project_templates(self):
         state = self.current_state
@@ -116,13 +116,13 @@ class TechLead(BaseAgent):
             summaries.append(summary)
 
         # Saving template files will fill this in and we want it clear for the first task.
-        self.next_state.relevant_files = None
+        await self.state_manager.execute(UpdateState("relevant_files", None))
 
         if summaries:
             spec = self.current_state.specification.clone()
             spec.template_summary = "\n\n".join(summaries)
 
-            self.next_state.specification = spec
+            await self.state_manager.execute(UpdateState("specification", spec))
 
     async def ask_for_new_feature(self) -> AgentResponse:
         if len(self.current_state.epics) > 2:
@@ -144,21 +144,20 @@ class TechLead(BaseAgent):
             await self.ui.send_message("Thanks for using Pythagora!")
             return AgentResponse.exit(self)
 
-        self.next_state.epics = self.current_state.epics + [
-            {
-                "id": uuid4().hex,
-                "name": f"Feature #{len(self.current_state.epics)}",
-                "test_instructions": None,
-                "source": "feature",
-                "description": response.text,
-                "summary": None,
-                "completed": False,
-                "complexity": None,  # Determined and defined in SpecWriter
-                "sub_epics": [],
-            }
-        ]
+        epic = {
+            "id": uuid4().hex,
+            "name": f"Feature #{len(self.current_state.epics)}",
+            "test_instructions": None,
+            "source": "feature",
+            "description": response.text,
+            "summary": None,
+            "completed": False,
+            "complexity": None,  # Determined and defined in SpecWriter
+            "sub_epics": [],
+        }
+        await self.state_manager.execute(UpdateState("epics", self.current_state.epics + [epic]))
         # Orchestrator will rerun us to break down the new feature epic
-        self.next_state.action = f"Start of feature #{len(self.current_state.epics)}"
+        await self.state_manager.execute(SetAction(f"Start of feature #{len(self.current_state.epics)}"))
         return AgentResponse.update_specification(self, response.text)
 
     async def plan_epic(self, epic) -> AgentResponse:
@@ -188,14 +187,9 @@ class TechLead(BaseAgent):
 
         if epic.get("source") == "feature" or epic.get("complexity") == "simple":
             await self.send_message(f"Epic 1: {epic['name']}")
-            self.next_state.current_epic["sub_epics"] = [
-                {
-                    "id": 1,
-                    "description": epic["name"],
-                }
-            ]
+            await self.state_manager.execute(UpdateEpic({"sub_epics": [{"id": 1, "description": epic["name"]}]}))
             await self.send_message("Creating tasks for this epic ...")
-            self.next_state.tasks = self.next_state.tasks + [
+            tasks = [
                 {
                     "id": uuid4().hex,
                     "description": task.description,
@@ -206,18 +200,20 @@ class TechLead(BaseAgent):
                 }
                 for task in response.plan
             ]
+            await self.state_manager.execute(UpdateState("tasks", self.next_state.tasks + tasks))
             await self.ui.send_epics_and_tasks(
                 self.next_state.current_epic["sub_epics"],
                 self.next_state.tasks,
             )
         else:
-            self.next_state.current_epic["sub_epics"] = self.next_state.current_epic["sub_epics"] + [
+            sub_epics = self.next_state.current_epic["sub_epics"] + [
                 {
                     "id": sub_epic_number,
                     "description": sub_epic.description,
                 }
                 for sub_epic_number, sub_epic in enumerate(response.plan, start=1)
             ]
+            await self.state_manager.execute(UpdateEpic({"sub_epics": sub_epics}))
             for sub_epic_number, sub_epic in enumerate(response.plan, start=1):
                 await self.send_message(f"Epic {sub_epic_number}: {sub_epic.description}")
                 convo = convo.template(
@@ -225,7 +221,7 @@ class TechLead(BaseAgent):
                 ).require_schema(EpicPlan)
                 await self.send_message("Creating tasks for this epic ...")
                 epic_plan: EpicPlan = await llm(convo, parser=JSONParser(EpicPlan))
-                self.next_state.tasks = self.next_state.tasks + [
+                tasks = [
                     {
                         "id": uuid4().hex,
                         "description": task.description,
@@ -236,6 +232,7 @@ class TechLead(BaseAgent):
                     }
                     for task in epic_plan.plan
                 ]
+                await self.state_manager.execute(UpdateState("tasks", self.next_state.tasks + tasks))
                 convo.remove_last_x_messages(2)
 
             await self.ui.send_epics_and_tasks(
@@ -252,23 +249,22 @@ class TechLead(BaseAgent):
         )
         return AgentResponse.done(self)
 
-    def plan_example_project(self):
+    async def plan_example_project(self):
         example_name = self.current_state.specification.example_project
         log.debug(f"Planning example project: {example_name}")
 
         example = EXAMPLE_PROJECTS[example_name]
-        self.next_state.epics = [
-            {
-                "name": "Initial Project",
-                "description": example["description"],
-                "completed": False,
-                "complexity": example["complexity"],
-                "sub_epics": [
-                    {
-                        "id": 1,
-                        "description": "Single Epic Example",
-                    }
-                ],
-            }
-        ]
-        self.next_state.tasks = example["plan"]
+        epic = {
+            "name": "Initial Project",
+            "description": example["description"],
+            "completed": False,
+            "complexity": example["complexity"],
+            "sub_epics": [
+                {
+                    "id": 1,
+                    "description": "Single Epic Example",
+                }
+            ],
+        }
+        await self.state_manager.execute(UpdateState("epics", [epic]))
+        await self.state_manager.execute(UpdateState("tasks", example["plan"]))
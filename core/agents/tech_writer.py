@@ -3,6 +3,7 @@ from core.agents.convo import AgentConvo
 from core.agents.response import AgentResponse
 from core.db.models.project_state import TaskStatus
 from core.log import get_logger
+from core.state.actor import SetAction, SetTaskStatus
 from core.ui.base import success_source
 
 log = get_logger(__name__)
@@ -23,8 +24,8 @@ class TechnicalWriter(BaseAgent):
             await self.send_congratulations()
             await self.create_readme()
 
-        self.next_state.action = "Create README.md"
-        self.next_state.set_current_task_status(TaskStatus.DOCUMENTED)
+        await self.state_manager.execute(SetAction("Create README.md"))
+        await self.state_manager.execute(SetTaskStatus(TaskStatus.DOCUMENTED))
         return AgentResponse.done(self)
 
     async def send_congratulations(self):
@@ -37,6 +38,7 @@ class TechnicalWriter(BaseAgent):
         n_finished = n_tasks - n_unfinished
         pct_finished = int(n_finished / n_tasks * 100)
         n_files = len(self.current_state.files)
+        await self.state_manager.load_file_contents()
         n_lines = sum(len(f.content.content.splitlines()) for f in self.current_state.files)
         await self.ui.send_message(
             "\n\n".join(
@@ -12,6 +12,7 @@ from core.db.models.file import File
 from core.db.models.project_state import IterationStatus, TaskStatus
 from core.llm.parser import JSONParser, OptionalCodeBlockParser
 from core.log import get_logger
+from core.state.actor import SetAction, SetTaskStatus, UpdateIteration, UpdateState, UpdateTask
 from core.telemetry import telemetry
 
 log = get_logger(__name__)
@@ -51,9 +52,9 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
             user_feedback, user_feedback_qa=user_feedback_qa, bug_hunting_cycles=bug_hunting_cycles
         )
 
-        self.next_state.current_iteration["description"] = llm_solution
-        self.next_state.current_iteration["status"] = IterationStatus.IMPLEMENT_SOLUTION
-        self.next_state.flag_iterations_as_modified()
+        await self.state_manager.execute(
+            UpdateIteration({"description": llm_solution, "status": IterationStatus.IMPLEMENT_SOLUTION})
+        )
 
         return AgentResponse.done(self)
 
@@ -68,8 +69,7 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
                 return await self.complete_task()
 
             # Save the user instructions for future iterations and rerun
-            self.next_state.current_task["test_instructions"] = user_instructions
-            self.next_state.flag_tasks_as_modified()
+            await self.state_manager.execute(UpdateTask({"test_instructions": user_instructions}))
             return AgentResponse.done(self)
         else:
             await self.send_message("Here are instructions on how to test the app:\n\n" + user_instructions)
@@ -96,7 +96,7 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
         if is_loop:
             if last_iteration is not None and last_iteration.get("alternative_solutions"):
                 # If we already have alternative solutions, it means we were already in a loop.
-                return self.try_next_alternative_solution(user_feedback, user_feedback_qa)
+                return await self.try_next_alternative_solution(user_feedback, user_feedback_qa)
             else:
                 # Newly detected loop
                 iteration_status = IterationStatus.PROBLEM_SOLVER
@@ -109,22 +109,27 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
             await self.get_relevant_files(user_feedback)
             iteration_status = IterationStatus.NEW_FEATURE_REQUESTED
 
-        self.next_state.iterations = self.current_state.iterations + [
-            {
-                "id": uuid4().hex,
-                "user_feedback": user_feedback,
-                "user_feedback_qa": user_feedback_qa,
-                "description": None,
-                "alternative_solutions": [],
-                # FIXME - this is incorrect if this is a new problem; otherwise we could
-                # just count the iterations
-                "attempts": 1,
-                "status": iteration_status,
-                "bug_hunting_cycles": [],
-            }
-        ]
-
-        self.next_state.flag_iterations_as_modified()
+        await self.state_manager.execute(
+            UpdateState(
+                "iterations",
+                self.current_state.iterations
+                + [
+                    {
+                        "id": uuid4().hex,
+                        "user_feedback": user_feedback,
+                        "user_feedback_qa": user_feedback_qa,
+                        "description": None,
+                        "alternative_solutions": [],
+                        # FIXME - this is incorrect if this is a new problem; otherwise we could
+                        # just count the iterations
+                        "attempts": 1,
+                        "status": iteration_status,
+                        "bug_hunting_cycles": [],
+                    }
+                ],
+            )
+        )
+
         if len(self.next_state.iterations) == LOOP_THRESHOLD:
             await self.trace_loop("loop-start")
 
@@ -139,8 +144,8 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
             await self.trace_loop("loop-end")
 
         current_task_index1 = self.current_state.tasks.index(self.current_state.current_task) + 1
-        self.next_state.action = f"Task #{current_task_index1} reviewed"
-        self.next_state.set_current_task_status(TaskStatus.REVIEWED)
+        await self.state_manager.execute(SetAction(f"Task #{current_task_index1} reviewed"))
+        await self.state_manager.execute(SetTaskStatus(TaskStatus.REVIEWED))
         return AgentResponse.done(self)
 
     def _get_task_convo(self) -> AgentConvo:
@@ -172,7 +177,7 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
         llm_response: str = await llm(convo, temperature=0, parser=OptionalCodeBlockParser())
         if len(llm_response) < 5:
             llm_response = ""
-        self.next_state.run_command = llm_response
+        await self.state_manager.execute(UpdateState("run_command", llm_response))
         return llm_response
 
     async def get_user_instructions(self) -> Optional[str]:
@@ -202,7 +207,10 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
         route_files: set[str] = set(file_list.files)
 
         # Sometimes LLM can return a non-existent file, let's make sure to filter those out
-        return [f for f in self.current_state.files if f.path in route_files]
+        files = [f for f in self.current_state.files if f.path in route_files]
+        # The route files may not be among the relevant files, whose contents are already loaded
+        await self.state_manager.load_file_contents(files)
+        return files
 
     async def get_user_feedback(
         self,
@@ -266,7 +274,7 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
 
         return should_iterate, is_loop, bug_report, change_description
 
-    def try_next_alternative_solution(self, user_feedback: str, user_feedback_qa: list[str]) -> AgentResponse:
+    async def try_next_alternative_solution(self, user_feedback: str, user_feedback_qa: list[str]) -> AgentResponse:
         """
         Call the ProblemSolver to try an alternative solution.
 
@@ -276,14 +284,20 @@ class Troubleshooter(IterationPromptMixin, RelevantFilesMixin, BaseAgent):
         :param user_feedback_qa: Additional questions/answers about the problem.
         :return: Agent response done.
         """
-        next_state_iteration = self.next_state.iterations[-1]
-        next_state_iteration["description"] = ""
-        next_state_iteration["user_feedback"] = user_feedback
-        next_state_iteration["user_feedback_qa"] = user_feedback_qa
-        next_state_iteration["attempts"] += 1
-        next_state_iteration["status"] = IterationStatus.PROBLEM_SOLVER
-        self.next_state.flag_iterations_as_modified()
-        self.next_state.action = f"Alternative solution (attempt #{next_state_iteration['attempts']})"
+        attempts = self.next_state.iterations[-1]["attempts"] + 1
+        await self.state_manager.execute(
+            UpdateIteration(
+                {
+                    "description": "",
+                    "user_feedback": user_feedback,
+                    "user_feedback_qa": user_feedback_qa,
+                    "attempts": attempts,
+                    "status": IterationStatus.PROBLEM_SOLVER,
+                },
+                index=-1,
+            )
+        )
+        await self.state_manager.execute(SetAction(f"Alternative solution (attempt #{attempts})"))
         return AgentResponse.done(self)
 
     async def generate_bug_report(
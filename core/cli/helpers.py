@@ -3,13 +3,15 @@ import os
 import os.path
 import sys
 from argparse import ArgumentParser, ArgumentTypeError, Namespace
-from typing import Optional
+from typing import AsyncIterator, Optional
 from urllib.parse import urlparse
 from uuid import UUID
 
 from core.config import Config, LLMProvider, LocalIPCConfig, ProviderConfig, UIAdapter, get_config, loader
 from core.config.env_importer import import_from_dotenv
 from core.config.version import get_version
+from core.db.archive import ArchiveError, ProjectExporter, ProjectImporter
+from core.db.models import Project
 from core.db.session import SessionManager
 from core.db.setup import run_migrations
 from core.log import setup
@@ -19,6 +21,9 @@ from core.ui.console import PlainConsoleUI
 from core.ui.ipc_client import IPCClientUI
 from core.ui.virtual import VirtualUI
 
+# Number of projects to fetch from the database at once when listing projects
+LIST_PAGE_SIZE = 100
+
 
 def parse_llm_endpoint(value: str) -> Optional[tuple[LLMProvider, str]]:
     """
@@ -71,6 +76,22 @@ def parse_llm_key(value: str) -> Optional[tuple[LLMProvider, str]]:
     return provider, parts[1]
 
 
+def parse_step_range(value: str) -> tuple[int, int]:
+    """
+    Parse --diff-steps command-line option.
+
+    Option syntax is: --diff-steps <from-step>:<to-step>
+
+    :param value: Argument value.
+    :return: Tuple with the step indices.
+    """
+    parts = value.split(":")
+    if len(parts) != 2 or not all(part.isdigit() for part in parts):
+        raise ArgumentTypeError("Invalid step range format; expected 'from:to'")
+
+    return int(parts[0]), int(parts[1])
+
+
 def parse_arguments() -> Namespace:
     """
     Parse command-line arguments.
@@ -90,6 +111,13 @@ def parse_arguments() -> Namespace:
         --project: Load a specific project
         --branch: Load a specific branch
         --step: Load a specific step in a project/branch
+        --delete: Delete a specific project
+        --compact: Squash old history of a specific project
+        --keep-steps: Number of most recent steps to keep when compacting a project
+        --export: Export a specific project to an archive
+        --archive: Path to the project archive to write when exporting
+        --export-logs: Include LLM requests, user inputs and command logs in the exported archive
+        --import-archive: Import a project from an archive with the given path
         --llm-endpoint: Use specific API endpoint for the given provider
         --llm-key: Use specific LLM key for the given provider
         --import-v0: Import data from a v0 (gpt-pilot) database with the given path
@@ -114,6 +142,27 @@ def parse_arguments() -> Namespace:
     parser.add_argument("--branch", help="Load a specific branch", type=UUID, required=False)
     parser.add_argument("--step", help="Load a specific step in a project/branch", type=int, required=False)
     parser.add_argument("--delete", help="Delete a specific project", type=UUID, required=False)
+    parser.add_argument("--compact", help="Squash old history of a specific project", type=UUID, required=False)
+    parser.add_argument(
+        "--keep-steps",
+        help="Number of most recent steps to keep when compacting a project",
+        type=int,
+        required=False,
+    )
+    parser.add_argument("--export", help="Export a specific project to an archive", type=UUID, required=False)
+    parser.add_argument("--archive", help="Path to the project archive to write when exporting", required=False)
+    parser.add_argument(
+        "--export-logs",
+        help="Include LLM requests, user inputs and command logs in the exported archive",
+        action="store_true",
+    )
+    parser.add_argument("--import-archive", help="Import a project from an archive with the given path", required=False)
+    parser.add_argument(
+        "--diff-steps",
+        help="Show the changes to the project files between two steps (from:to) of a project/branch",
+        type=parse_step_range,
+        required=False,
+    )
     parser.add_argument(
         "--llm-endpoint",
         help="Use specific API endpoint for the given provider",
@@ -188,40 +237,55 @@ def load_config(args: Namespace) -> Optional[Config]:
     return config
 
 
+async def _iter_projects(sm: StateManager) -> AsyncIterator[list[Project]]:
+    """
+    Iterate over all projects, page by page.
+    """
+    after = None
+    while True:
+        projects = await sm.list_projects(after=after, limit=LIST_PAGE_SIZE)
+        if projects:
+            yield projects
+        if len(projects) < LIST_PAGE_SIZE:
+            return
+        after = (projects[-1].name, projects[-1].id)
+
+
 async def list_projects_json(db: SessionManager):
     """
     List all projects in the database in JSON format.
     """
     sm = StateManager(db)
-    projects = await sm.list_projects()
 
     data = []
-    for project in projects:
-        last_updated = None
-        p = {
-            "name": project.name,
-            "id": project.id.hex,
-            "branches": [],
-        }
-        for branch in project.branches:
-            b = {
-                "name": branch.name,
-                "id": branch.id.hex,
-                "steps": [],
+    async for projects in _iter_projects(sm):
+        branch_steps = await sm.list_branch_steps([branch.id for project in projects for branch in project.branches])
+        for project in projects:
+            last_updated = None
+            p = {
+                "name": project.name,
+                "id": project.id.hex,
+                "branches": [],
             }
-            for state in branch.states:
-                if not last_updated or state.created_at > last_updated:
-                    last_updated = state.created_at
-                s = {
-                    "name": state.action or f"Step #{state.step_index}",
-                    "step": state.step_index,
+            for branch in project.branches:
+                b = {
+                    "name": branch.name,
+                    "id": branch.id.hex,
+                    "steps": [],
                 }
-                b["steps"].append(s)
-            if b["steps"]:
-                b["steps"][-1]["name"] = "Latest step"
-            p["branches"].append(b)
-        p["updated_at"] = last_updated.isoformat() if last_updated else None
-        data.append(p)
+                if branch.head and (not last_updated or branch.head.updated_at > last_updated):
+                    last_updated = branch.head.updated_at
+                for step_index, action in branch_steps.get(branch.id, []):
+                    s = {
+                        "name": action or f"Step #{step_index}",
+                        "step": step_index,
+                    }
+                    b["steps"].append(s)
+                if b["steps"]:
+                    b["steps"][-1]["name"] = "Latest step"
+                p["branches"].append(b)
+            p["updated_at"] = last_updated.isoformat() if last_updated else None
+            data.append(p)
 
     print(json.dumps(data, indent=2))
 
@@ -231,13 +295,16 @@ async def list_projects(db: SessionManager):
     List all projects in the database.
     """
     sm = StateManager(db)
-    projects = await sm.list_projects()
+
+    projects = []
+    async for page in _iter_projects(sm):
+        projects.extend(page)
 
     print(f"Available projects ({len(projects)}):")
     for project in projects:
         print(f"* {project.name} ({project.id})")
         for branch in project.branches:
-            last_step = max(state.step_index for state in branch.states)
+            last_step = branch.head.step_index if branch.head else None
             print(f"  - {branch.name} ({branch.id}) - last step: {last_step}")
 
 
@@ -290,6 +357,120 @@ async def delete_project(db: SessionManager, project_id: UUID) -> bool:
     return await sm.delete_project(project_id)
 
 
+async def export_project(
+    db: SessionManager,
+    project_id: UUID,
+    path: Optional[str] = None,
+    include_logs: bool = False,
+) -> bool:
+    """
+    Export a project to an archive.
+
+    :param db: Database session manager.
+    :param project_id: Project ID.
+    :param path: Path to the archive (defaults to `<project-folder>.zip`).
+    :param include_logs: Whether to include LLM requests, user inputs and command logs.
+    :return: True if the project was exported, False otherwise.
+    """
+    async with db as session:
+        project = await Project.get_by_id(session, project_id)
+        if project is None:
+            print(f"Project {project_id} not found; use --list to list all projects", file=sys.stderr)
+            return False
+
+        path = path or f"{project.folder_name}.zip"
+        try:
+            counts = await ProjectExporter(session, project_id, include_logs=include_logs).export(path)
+        except ArchiveError as err:
+            print(f"Error exporting {project_id}: {err}", file=sys.stderr)
+            return False
+
+    print(
+        f"Exported project {project.name} ({project_id}) to {path}: "
+        f"{counts['project_states']} steps, {counts['file_contents']} unique files"
+    )
+    return True
+
+
+async def import_project_archive(db: SessionManager, path: str) -> bool:
+    """
+    Import a project from an archive created with --export.
+
+    :param db: Database session manager.
+    :param path: Path to the archive.
+    :return: True if the project was imported, False otherwise.
+    """
+    if not os.path.isfile(path):
+        print(f"Archive not found: {path}", file=sys.stderr)
+        return False
+
+    async with db as session:
+        try:
+            project_id = await ProjectImporter(session).import_archive(path)
+        except ArchiveError as err:
+            await session.rollback()
+            print(f"Error importing {path}: {err}", file=sys.stderr)
+            return False
+
+    print(f"Imported project {project_id} from {path}")
+    return True
+
+
+async def compact_project(db: SessionManager, project_id: UUID, keep_steps: Optional[int] = None) -> bool:
+    """
+    Squash old history of a project in the database.
+
+    :param db: Database session manager.
+    :param project_id: Project ID.
+    :param keep_steps: Number of most recent steps to keep (defaults to the configured retention policy).
+    :return: True if the project was compacted, False otherwise.
+    """
+    retention = db.config.retention.model_copy()
+    if keep_steps is not None:
+        retention.keep_last_steps = keep_steps
+    if not retention.keep_last_steps:
+        print("Number of steps to keep must be specified with --keep-steps", file=sys.stderr)
+        return False
+
+    sm = StateManager(db)
+    n_squashed = await sm.compact_project(project_id, retention)
+    if n_squashed is None:
+        print(f"Project {project_id} not found; use --list to list all projects", file=sys.stderr)
+        return False
+
+    print(f"Squashed {n_squashed} project states.")
+    return True
+
+
+async def diff_steps(
+    db: SessionManager,
+    steps: tuple[int, int],
+    project_id: Optional[UUID] = None,
+    branch_id: Optional[UUID] = None,
+) -> bool:
+    """
+    Print the changes to the project files between two steps.
+
+    :param db: Database session manager.
+    :param steps: Tuple with the step indices to compare.
+    :param project_id: Project ID (optional, uses the main branch).
+    :param branch_id: Branch ID (optional).
+    :return: True if the steps were found, False otherwise.
+    """
+    if not project_id and not branch_id:
+        print("Project or branch must be specified with --project or --branch", file=sys.stderr)
+        return False
+
+    sm = StateManager(db)
+    diff = await sm.diff_steps(*steps, project_id=project_id, branch_id=branch_id)
+    if diff is None:
+        print(f"Steps {steps[0]} and {steps[1]} not found; use --list to list all projects", file=sys.stderr)
+        return False
+
+    print(diff, end="")
+    return True
+
+
 def show_config():
     """
     Print the current configuration to stdout.
@@ -327,4 +508,14 @@ def init() -> tuple[UIBase, SessionManager, Namespace]:
     return (ui, db, args)
 
 
-__all__ = ["parse_arguments", "load_config", "list_projects_json", "list_projects", "load_project", "init"]
+__all__ = [
+    "parse_arguments",
+    "load_config",
+    "list_projects_json",
+    "list_projects",
+    "load_project",
+    "compact_project",
+    "export_project",
+    "import_project_archive",
+    "init",
+]
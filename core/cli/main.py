@@ -4,7 +4,18 @@ from argparse import Namespace
 from asyncio import run
 
 from core.agents.orchestrator import Orchestrator
-from core.cli.helpers import delete_project, init, list_projects, list_projects_json, load_project, show_config
+from core.cli.helpers import (
+    compact_project,
+    delete_project,
+    diff_steps,
+    export_project,
+    import_project_archive,
+    init,
+    list_projects,
+    list_projects_json,
+    load_project,
+    show_config,
+)
 from core.config import LLMProvider, get_config
 from core.db.session import SessionManager
 from core.db.v0importer import LegacyDatabaseImporter
@@ -211,6 +222,14 @@ async def async_main(
     elif args.delete:
         success = await delete_project(db, args.delete)
         return success
+    elif args.compact:
+        return await compact_project(db, args.compact, args.keep_steps)
+    elif args.export:
+        return await export_project(db, args.export, args.archive, args.export_logs)
+    elif args.import_archive:
+        return await import_project_archive(db, args.import_archive)
+    elif args.diff_steps:
+        return await diff_steps(db, args.diff_steps, args.project, args.branch)
 
     telemetry.set("user_contact", args.email)
     if args.extension_version:
@@ -235,6 +254,7 @@ def run_pythagora():
     if not ui or not db:
         return -1
     success = run(async_main(ui, db, args))
+    db.log_profile()
     return 0 if success else -1
 
 
@@ -218,6 +218,121 @@ class LogConfig(_StrictModel):
     )
 
 
+class RetentionConfig(_StrictModel):
+    """
+    Project history retention policy.
+
+    When `keep_last_steps` is set, older project states are automatically
+    squashed (compacted) whenever a project is loaded.
+    """
+
+    keep_last_steps: Optional[int] = Field(
+        None,
+        description="Number of most recent steps to keep in each branch (if not set, keep the whole history)",
+        ge=1,
+    )
+    keep_task_boundaries: bool = Field(
+        True,
+        description="Always keep the states where a task or an epic was started or finished",
+    )
+    keep_logs: bool = Field(
+        False,
+        description="Keep LLM requests, user inputs and command logs of squashed states",
+    )
+
+
+class ProfilerConfig(_StrictModel):
+    """
+    SQL statement profiler settings.
+
+    The profiler collects execution statistics of SQL statements (grouped
+    by statement, with the parameters stripped) and logs a report of the
+    statements that took the most time.
+    """
+
+    enabled: bool = Field(False, description="Collect SQL statement execution statistics")
+    report: Literal["session", "exit"] = Field(
+        "exit",
+        description="Log the report after each database session, or once on exit",
+    )
+    top: int = Field(20, description="Number of statements to include in the report", ge=1)
+
+
+class SQLiteConfig(_StrictModel):
+    """
+    SQLite performance settings, applied to each new database connection.
+
+    See https://www.sqlite.org/pragma.html for details. These are ignored
+    for other databases.
+    """
+
+    synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = Field(
+        "NORMAL",
+        description="When to fsync; NORMAL is safe from corruption in WAL mode, but may lose the last commits on power loss",
+    )
+    cache_size: int = Field(
+        -65536,
+        description="Page cache size per connection; negative values are in KiB, positive values in pages",
+    )
+    mmap_size: int = Field(
+        256 * 1024 * 1024,
+        description="Maximum number of bytes of the database file to access using memory-mapped I/O (0 to disable)",
+        ge=0,
+    )
+    temp_store: Literal["DEFAULT", "FILE", "MEMORY"] = Field(
+        "MEMORY",
+        description="Where to store temporary tables and indices",
+    )
+    busy_timeout: int = Field(
+        5000,
+        description="How long to wait (in milliseconds) for a lock held by another connection before failing",
+        ge=0,
+    )
+    persistent_connection: bool = Field(
+        True,
+        description="Reuse a single connection for all sessions instead of reconnecting for each one",
+    )
+
+
+class PostgresConfig(_StrictModel):
+    """
+    PostgreSQL connection pool settings.
+
+    See https://docs.sqlalchemy.org/en/20/core/pooling.html for details.
+    These are ignored for other databases.
+    """
+
+    pool_size: int = Field(
+        5,
+        description="Number of connections to keep open in the pool",
+        ge=1,
+    )
+    max_overflow: int = Field(
+        5,
+        description="Number of extra connections that can be opened temporarily when the pool is in use",
+        ge=0,
+    )
+    pool_timeout: float = Field(
+        30,
+        description="How long to wait (in seconds) for a connection from the pool before failing",
+        gt=0,
+    )
+    pool_recycle: int = Field(
+        1800,
+        description="Replace connections older than this (in seconds), before the server or a proxy drops them (-1 to disable)",
+        ge=-1,
+    )
+    pool_pre_ping: bool = Field(
+        False,
+        description="Check that a connection is alive before each use; costs a round trip per transaction",
+    )
+    statement_cache_size: int = Field(
+        100,
+        description="Number of prepared statements to cache per connection (set to 0 when using pgbouncer)",
+        ge=0,
+    )
+
+
 class DBConfig(_StrictModel):
     """
     Configuration for database connections.
@@ -225,6 +340,7 @@ class DBConfig(_StrictModel):
     Supported URL schemes:
 
     * sqlite+aiosqlite: SQLite database using the aiosqlite driver
+    * postgresql+asyncpg: PostgreSQL database using the asyncpg driver
     """
 
     url: str = Field(
@@ -232,6 +348,19 @@ class DBConfig(_StrictModel):
         description="Database connection URL",
     )
     debug_sql: bool = Field(False, description="Log all SQL queries to the console")
+    content_cache_size: int = Field(
+        64 * 1024 * 1024,
+        description="Maximum size (in bytes) of the in-memory cache of file contents loaded from the database",
+        ge=0,
+    )
+    pipelined_commits: bool = Field(
+        True,
+        description="Finish committing each project state in the background, while the next agent is running",
+    )
+    sqlite: SQLiteConfig = SQLiteConfig()
+    postgres: PostgresConfig = PostgresConfig()
+    retention: RetentionConfig = RetentionConfig()
+    profiler: ProfilerConfig = ProfilerConfig()
 
     @field_validator("url")
     @classmethod
@@ -307,6 +436,27 @@ class FileSystemConfig(_StrictModel):
         IGNORE_SIZE_THRESHOLD,
         description="Files larger than this size should be ignored",
     )
+    use_gitignore: bool = Field(
+        False,
+        description="Also ignore the files matched by the project's .gitignore files",
+    )
+    watch: bool = Field(
+        False,
+        description="Watch the workspace for changes (inotify, or polling where not available) instead of scanning it",
+    )
+    mirror_size: int = Field(
+        0,
+        description="Keep up to this many characters of file contents in memory to avoid re-reading unchanged files (0 to disable)",
+        ge=0,
+    )
+    snapshots: bool = Field(
+        False,
+        description="Keep snapshots of the project files next to the project, to restore files without the database",
+    )
+    git_mirror: bool = Field(
+        False,
+        description="Mirror each committed step as a commit in a bare git repository next to the project",
+    )
 
 
 class Config(_StrictModel):
@@ -0,0 +1,311 @@
+import json
+import os
+from contextlib import suppress
+from datetime import datetime
+from io import TextIOWrapper
+from typing import Any, Iterator, Optional
+from uuid import UUID
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from sqlalchemy import DateTime, Select, Table, Uuid, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.db.models import (
+    Branch,
+    BranchHead,
+    ExecLog,
+    File,
+    FileContent,
+    LLMRequest,
+    Project,
+    ProjectState,
+    Specification,
+    UserInput,
+)
+from core.db.models.base import BATCH_SIZE
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+# Version of the archive layout; bump when making incompatible changes
+ARCHIVE_FORMAT = 1
+
+MANIFEST = "manifest.json"
+CONTENTS_DIR = "contents/"
+
+# Tables with autoincrement primary keys; the IDs are reassigned on import
+LOG_TABLES = [LLMRequest.__table__, UserInput.__table__, ExecLog.__table__]
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, UUID):
+        return value.hex
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _decoder(table: Table, columns: list[str]):
+    """
+    Build a function converting a JSON-decoded row back to column values.
+    """
+    for name in columns:
+        if name not in table.columns:
+            raise ArchiveError(f"Column {table.name}.{name} from the archive doesn't exist in the database")
+
+    converters = []
+    for name in columns:
+        column_type = table.columns[name].type
+        if isinstance(column_type, Uuid):
+            converters.append(lambda v: UUID(v) if v is not None else None)
+        elif isinstance(column_type, DateTime):
+            converters.append(lambda v: datetime.fromisoformat(v) if v is not None else None)
+        else:
+            converters.append(None)
+
+    def decode(values: list) -> dict:
+        return {name: convert(value) if convert else value for name, convert, value in zip(columns, converters, values)}
+
+    return decode
+
+
+class ProjectExporter:
+    """
+    Export a project to a compressed archive.
+
+    The archive is a ZIP file containing one JSON-lines file per table
+    (each line is a row, with the column names listed in the manifest),
+    and the file contents stored under `contents/<hash>`, so every
+    distinct content is stored exactly once. The project states are
+    stored as they are in the database (patches and snapshots).
+
+    Rows and contents are streamed from the database in batches and
+    written to the archive as they arrive, so memory use doesn't depend
+    on the size of the project.
+    """
+
+    def __init__(self, session: AsyncSession, project_id: UUID, include_logs: bool = False):
+        self.session = session
+        self.project_id = project_id
+        self.include_logs = include_logs
+
+    async def export(self, path: str) -> dict[str, int]:
+        """
+        Export the project to the archive at `path`.
+
+        :param path: Path to the archive file (overwritten if it exists).
+        :return: Number of exported rows per table.
+        :raises ArchiveError: If the project doesn't exist or the archive can't be written.
+        """
+        branch_ids = select(Branch.id).where(Branch.project_id == self.project_id)
+        state_ids = select(ProjectState.id).where(ProjectState.branch_id.in_(branch_ids))
+
+        tables = [
+            (Project.__table__, select(Project.__table__).where(Project.id == self.project_id)),
+            (Branch.__table__, select(Branch.__table__).where(Branch.project_id == self.project_id)),
+            (
+                Specification.__table__,
+                select(Specification.__table__).where(
+                    Specification.id.in_(select(ProjectState.specification_id).where(ProjectState.id.in_(state_ids)))
+                ),
+            ),
+            (
+                ProjectState.__table__,
+                select(ProjectState.__table__)
+                .where(ProjectState.branch_id.in_(branch_ids))
+                .order_by(ProjectState.branch_id, ProjectState.step_index),
+            ),
+            (
+                File.__table__,
+                select(File.__table__).where(File.project_state_id.in_(state_ids)).order_by(File.id),
+            ),
+            (BranchHead.__table__, select(BranchHead.__table__).where(BranchHead.project_id == self.project_id)),
+        ]
+        if self.include_logs:
+            for table in LOG_TABLES:
+                tables.append((table, select(table).where(table.c.branch_id.in_(branch_ids)).order_by(table.c.id)))
+
+        manifest = {
+            "format": ARCHIVE_FORMAT,
+            "project_id": self.project_id.hex,
+            "exported_at": datetime.now().isoformat(),
+            "tables": {},
+        }
+        counts = {}
+        try:
+            zf = ZipFile(path, "w", compression=ZIP_DEFLATED)
+        except OSError as err:
+            raise ArchiveError(f"Can't create archive {path}: {err}") from err
+
+        try:
+            with zf:
+                for table, query in tables:
+                    columns = [column.name for column in table.columns]
+                    manifest["tables"][table.name] = columns
+                    counts[table.name] = await self._write_rows(zf, table.name, query)
+
+                if counts[Project.__tablename__] == 0:
+                    raise ArchiveError(f"Project {self.project_id} not found")
+
+                counts[FileContent.__tablename__] = await self._write_contents(
+                    zf,
+                    select(File.content_id).where(File.project_state_id.in_(state_ids)).distinct(),
+                )
+                manifest["counts"] = counts
+                zf.writestr(MANIFEST, json.dumps(manifest, indent=2))
+        except BaseException as err:
+            # Don't leave a partial archive behind
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            if isinstance(err, OSError):
+                raise ArchiveError(f"Error writing archive {path}: {err}") from err
+            raise
+
+        log.info(f"Exported project {self.project_id} to {path}: {counts}")
+        return counts
+
+    async def _write_rows(self, zf: ZipFile, name: str, query: Select) -> int:
+        n = 0
+        with zf.open(f"{name}.jsonl", "w") as f:
+            result = await self.session.stream(query.execution_options(yield_per=BATCH_SIZE))
+            async for partition in result.partitions():
+                lines = [json.dumps([_encode(value) for value in row]) + "\n" for row in partition]
+                f.write("".join(lines).encode("utf-8"))
+                n += len(lines)
+        return n
+
+    async def _write_contents(self, zf: ZipFile, content_ids: Select) -> int:
+        n = 0
+        result = await self.session.stream(content_ids.execution_options(yield_per=BATCH_SIZE))
+        async for partition in result.partitions():
+            batch = [row[0] for row in partition]
+            contents = await self.session.execute(
+                select(FileContent.id, FileContent.content).where(FileContent.id.in_(batch))
+            )
+            for hash, content in contents:
+                zf.writestr(f"{CONTENTS_DIR}{hash}", content)
+                n += 1
+        return n
+
+
+class ProjectImporter:
+    """
+    Import a project from an archive created by `ProjectExporter`.
+
+    Rows are read from the archive in batches and bulk-inserted, all in
+    the session's current transaction, which is committed only if the
+    whole import succeeds. The project keeps its original IDs, so a
+    project can't be imported into a database that already contains it.
+    File contents already present in the database are not imported again.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def import_archive(self, path: str) -> UUID:
+        """
+        Import the project from the archive at `path`.
+
+        :param path: Path to the archive file.
+        :return: ID of the imported project.
+        """
+        with ZipFile(path) as zf:
+            try:
+                manifest = json.loads(zf.read(MANIFEST))
+            except KeyError:
+                raise ArchiveError(f"{path} is not a project archive (no manifest)")
+            if manifest.get("format") != ARCHIVE_FORMAT:
+                raise ArchiveError(f"Unsupported archive format: {manifest.get('format')}")
+
+            project_id = UUID(manifest["project_id"])
+            if await Project.get_by_id(self.session, project_id) is not None:
+                raise ArchiveError(f"Project {project_id} already exists in the database")
+
+            tables = manifest["tables"]
+            await self._insert_rows(zf, Project.__table__, tables)
+            await self._insert_branches(zf, tables)
+            spec_ids = await self._insert_specifications(zf, tables)
+            await self._insert_contents(zf)
+            await self._insert_rows(
+                zf,
+                ProjectState.__table__,
+                tables,
+                transform=lambda row: {**row, "specification_id": spec_ids[row["specification_id"]]},
+            )
+            await self._insert_rows(zf, File.__table__, tables, skip=["id"])
+            await self._insert_rows(zf, BranchHead.__table__, tables)
+            for table in LOG_TABLES:
+                if table.name in tables:
+                    await self._insert_rows(zf, table, tables, skip=["id"])
+
+        await self.session.commit()
+        log.info(f"Imported project {project_id} from {path}")
+        return project_id
+
+    def _read_rows(self, zf: ZipFile, table: Table, tables: dict[str, list[str]]) -> Iterator[dict]:
+        decode = _decoder(table, tables[table.name])
+        with zf.open(f"{table.name}.jsonl") as f:
+            for line in TextIOWrapper(f, encoding="utf-8"):
+                yield decode(json.loads(line))
+
+    async def _insert_rows(
+        self,
+        zf: ZipFile,
+        table: Table,
+        tables: dict[str, list[str]],
+        skip: Optional[list[str]] = None,
+        transform=None,
+    ):
+        batch = []
+        for row in self._read_rows(zf, table, tables):
+            for name in skip or []:
+                row.pop(name, None)
+            batch.append(transform(row) if transform else row)
+            if len(batch) >= BATCH_SIZE:
+                await self.session.execute(insert(table), batch)
+                batch = []
+        if batch:
+            await self.session.execute(insert(table), batch)
+
+    async def _insert_branches(self, zf: ZipFile, tables: dict[str, list[str]]):
+        # Forked branches reference their parent branches, so the parents must be inserted first
+        rows = {row["id"]: row for row in self._read_rows(zf, Branch.__table__, tables)}
+        ordered = []
+        while rows:
+            ready = [row for row in rows.values() if row.get("parent_id") not in rows]
+            ordered.extend(ready)
+            for row in ready:
+                del rows[row["id"]]
+        if ordered:
+            await self.session.execute(insert(Branch.__table__), ordered)
+
+    async def _insert_specifications(self, zf: ZipFile, tables: dict[str, list[str]]) -> dict[int, int]:
+        # Specification IDs are autoincrement integers, so they're reassigned
+        table = Specification.__table__
+        spec_ids = {}
+        for row in self._read_rows(zf, table, tables):
+            old_id = row.pop("id")
+            result = await self.session.execute(insert(table).values(**row).returning(table.c.id))
+            spec_ids[old_id] = result.scalar_one()
+        return spec_ids
+
+    async def _insert_contents(self, zf: ZipFile):
+        names = [name for name in zf.namelist() if name.startswith(CONTENTS_DIR)]
+        for i in range(0, len(names), BATCH_SIZE):
+            hashes = [name[len(CONTENTS_DIR) :] for name in names[i : i + BATCH_SIZE]]
+            result = await self.session.execute(select(FileContent.id).where(FileContent.id.in_(hashes)))
+            existing = set(result.scalars().all())
+            rows = [
+                {"id": hash, "content": zf.read(f"{CONTENTS_DIR}{hash}").decode("utf-8")}
+                for hash in hashes
+                if hash not in existing
+            ]
+            if rows:
+                await self.session.execute(insert(FileContent.__table__), rows)
+
+
+__all__ = ["ArchiveError", "ProjectExporter", "ProjectImporter"]
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from typing import Optional
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class ContentCache:
+    """
+    Bounded LRU cache of file contents, keyed by content hash.
+
+    File contents are immutable (the hash is the primary key of the
+    FileContent row), so the cache never needs to be invalidated and
+    can be shared across all project states and sessions. When the
+    total size of the cached contents exceeds `max_size` (in bytes,
+    approximated by string length), the least recently used contents
+    are evicted.
+
+    Usage:
+
+    >>> cache = ContentCache(max_size=1024)
+    >>> cache.put("abc", "hello")
+    >>> cache.get("abc")
+    'hello'
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+        self._items: OrderedDict[str, str] = OrderedDict()
+        self.max_size = max_size
+        self.size = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the hit/miss metrics.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, hash: str) -> bool:
+        return hash in self._items
+
+    def get(self, hash: str) -> Optional[str]:
+        """
+        Get the content from the cache, marking it as recently used.
+
+        :param hash: Content hash.
+        :return: The content, or None if not cached.
+        """
+        content = self._items.get(hash)
+        if content is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._items.move_to_end(hash)
+        return content
+
+    def put(self, hash: str, content: str):
+        """
+        Add the content to the cache, evicting old entries if needed.
+
+        Contents larger than the entire cache are not cached.
+
+        :param hash: Content hash.
+        :param content: The content.
+        """
+        if hash in self._items:
+            self._items.move_to_end(hash)
+            return
+
+        if len(content) > self.max_size:
+            return
+
+        self._items[hash] = content
+        self.size += len(content)
+        self._evict()
+
+    def resize(self, max_size: int):
+        """
+        Change the maximum cache size, evicting old entries if needed.
+
+        :param max_size: New maximum size in bytes.
+        """
+        self.max_size = max_size
+        self._evict()
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        self._items.clear()
+        self.size = 0
+
+    def _evict(self):
+        while self.size > self.max_size:
+            _, content = self._items.popitem(last=False)
+            self.size -= len(content)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        Return the cache metrics.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Process-wide cache shared by all sessions; see FileContent.load()
+content_cache = ContentCache()
+
+
+__all__ = ["ContentCache", "content_cache"]
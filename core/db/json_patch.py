@@ -0,0 +1,104 @@
+from copy import deepcopy
+from typing import Any
+
+
+def _escape(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(key: str) -> str:
+    return key.replace("~1", "/").replace("~0", "~")
+
+
+def _diff(old: Any, new: Any, path: str, ops: list[dict]):
+    if old == new:
+        return
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                _diff(old[key], value, f"{path}/{_escape(key)}", ops)
+        return
+
+    if isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        for i in range(common):
+            _diff(old[i], new[i], f"{path}/{i}", ops)
+        for i in range(common, len(new)):
+            ops.append({"op": "add", "path": f"{path}/{i}", "value": new[i]})
+        # Remove from the end so the indices of the remaining items don't shift
+        for i in range(len(old) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{i}"})
+        return
+
+    ops.append({"op": "replace", "path": path, "value": new})
+
+
+def make_patch(old: Any, new: Any) -> list[dict]:
+    """
+    Create a JSON patch (RFC 6902) transforming `old` into `new`.
+
+    Only the "add", "remove" and "replace" operations are used. Lists are
+    compared item by item, so an item inserted in the middle of a list
+    produces a "replace" for each following item; that's fine for the
+    append-mostly lists used in project states.
+
+    The values in the patch reference (not copy) the values from `new`.
+
+    :param old: Original JSON-serializable document.
+    :param new: Modified JSON-serializable document.
+    :return: List of patch operations (empty if the documents are equal).
+    """
+    ops = []
+    _diff(old, new, "", ops)
+    return ops
+
+
+def apply_patch(doc: Any, patch: list[dict]) -> Any:
+    """
+    Apply a JSON patch created by `make_patch()` to the document.
+
+    The document is modified in place where possible; the (possibly new)
+    document is returned. Values from the patch are copied, so the result
+    doesn't share any mutable structures with the patch.
+
+    :param doc: JSON document to modify.
+    :param patch: List of patch operations.
+    :return: The patched document.
+    """
+    for op in patch:
+        value = deepcopy(op.get("value"))
+        if op["path"] == "":
+            if op["op"] != "replace":
+                raise ValueError(f"Unsupported operation on the document root: {op['op']}")
+            doc = value
+            continue
+
+        *parents, last = [_unescape(part) for part in op["path"].split("/")[1:]]
+        target = doc
+        for part in parents:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+
+        if isinstance(target, list):
+            index = int(last)
+            if op["op"] == "add":
+                target.insert(index, value)
+            elif op["op"] == "remove":
+                del target[index]
+            else:
+                target[index] = value
+        else:
+            if op["op"] == "remove":
+                del target[last]
+            else:
+                target[last] = value
+
+    return doc
+
+
+__all__ = ["make_patch", "apply_patch"]
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+
+class SessionLock:
+    """
+    Async lock serializing access to a shared database session.
+
+    SQLAlchemy's AsyncSession is not safe for concurrent use, so agents
+    running in parallel (eg. multiple CodeMonkeys) must take turns when
+    touching the database. Waiters are woken up in FIFO order as soon as
+    the lock is released, so there's no polling latency.
+
+    The lock also collects contention metrics, available via `stats()`.
+
+    Usage:
+
+    >>> lock = SessionLock()
+    >>> async with lock():
+    ...     # Do something with the session
+    """
+
+    def __init__(self):
+        # Created on first use: before Python 3.10, asyncio.Lock binds to the
+        # event loop current at creation, which may not be the one running it
+        self._lock: Optional[asyncio.Lock] = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the contention metrics.
+        """
+        self.acquisitions = 0
+        self.contended = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def locked(self) -> bool:
+        """
+        Return True if the lock is currently held.
+        """
+        return self._lock is not None and self._lock.locked()
+
+    @asynccontextmanager
+    async def __call__(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        contended = self._lock.locked()
+        start = time.perf_counter()
+
+        if contended:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            await self._lock.acquire()
+        finally:
+            if contended:
+                self.queue_depth -= 1
+
+        wait_time = time.perf_counter() - start
+        self.acquisitions += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        if contended:
+            self.contended += 1
+            log.debug(f"Waited {wait_time:.3f}s for database session lock ({self.queue_depth} still waiting)")
+
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def stats(self) -> dict:
+        """
+        Get the contention metrics.
+
+        :return: Dictionary with the number of acquisitions (total and contended),
+            current and maximum queue depth, and total/average/max wait time in seconds.
+        """
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "total_wait_time": self.total_wait_time,
+            "avg_wait_time": self.total_wait_time / self.acquisitions if self.acquisitions else 0.0,
+            "max_wait_time": self.max_wait_time,
+        }
+
+
+__all__ = ["SessionLock"]
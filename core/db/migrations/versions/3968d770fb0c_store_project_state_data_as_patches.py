@@ -0,0 +1,69 @@
+"""Store project state data as patches
+
+Revision ID: 3968d770fb0c
+Revises: 101d22e8e2e2
+Create Date: 2026-10-19 11:02:14.371520
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from core.db.json_patch import apply_patch
+
+# revision identifiers, used by Alembic.
+revision: str = "3968d770fb0c"
+down_revision: Union[str, None] = "101d22e8e2e2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DATA_FIELDS = ("epics", "tasks", "steps", "iterations", "relevant_files", "modified_files", "docs")
+NOT_NULL_FIELDS = ("epics", "tasks", "steps", "iterations", "modified_files")
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("project_states", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("delta", sa.JSON(), nullable=True))
+        for field in NOT_NULL_FIELDS:
+            batch_op.alter_column(field, existing_type=sa.JSON(), nullable=True)
+
+
+def downgrade() -> None:
+    # Materialize the states stored as patches before dropping the delta column
+    project_states = sa.table(
+        "project_states",
+        sa.column("id"),
+        sa.column("branch_id"),
+        sa.column("step_index"),
+        sa.column("delta", sa.JSON()),
+        *[sa.column(field, sa.JSON()) for field in DATA_FIELDS],
+    )
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(project_states).order_by(project_states.c.branch_id, project_states.c.step_index)
+    ).mappings()
+
+    branch_id = None
+    data = {}
+    for row in rows.all():
+        if row["delta"] is None:
+            branch_id = row["branch_id"]
+            data = {field: row[field] for field in DATA_FIELDS}
+            continue
+        if row["branch_id"] != branch_id:
+            raise ValueError(f"Project state {row['id']} is stored as a patch without a preceding snapshot")
+
+        for field, patch in row["delta"].items():
+            data[field] = apply_patch(data[field], patch)
+        conn.execute(
+            sa.update(project_states)
+            .where(project_states.c.id == row["id"])
+            .values(delta=None, **{field: data[field] for field in DATA_FIELDS})
+        )
+
+    with op.batch_alter_table("project_states", schema=None) as batch_op:
+        for field in NOT_NULL_FIELDS:
+            batch_op.alter_column(field, existing_type=sa.JSON(), nullable=False)
+        batch_op.drop_column("delta")
@@ -5,6 +5,7 @@
 
 from .base import Base
 from .branch import Branch
+from .branch_head import BranchHead
 from .exec_log import ExecLog
 from .file import File
 from .file_content import FileContent
@@ -17,6 +18,7 @@ from .user_input import UserInput
 __all__ = [
     "Base",
     "Branch",
+    "BranchHead",
     "Complexity",
     "ExecLog",
     "File",
@@ -9,6 +9,9 @@ from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.types import JSON
 
+# Maximum number of IDs to put into a single "IN (...)" clause
+BATCH_SIZE = 500
+
 
 class Base(AsyncAttrs, DeclarativeBase):
     """Base class for all SQL database models."""
@@ -1,17 +1,42 @@
+from copy import deepcopy
 from datetime import datetime
-from typing import TYPE_CHECKING, Optional, Union
+from typing import TYPE_CHECKING, Any, AsyncIterator, Optional, Union
 from uuid import UUID, uuid4
 
-from sqlalchemy import ForeignKey, inspect, select
+from sqlalchemy import ForeignKey, delete, distinct, inspect, select, update
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
+from core.db.json_patch import apply_patch
 from core.db.models import Base
+from core.db.models.base import BATCH_SIZE
+from core.log import get_logger
 
 if TYPE_CHECKING:
     from sqlalchemy.ext.asyncio import AsyncSession
 
-    from core.db.models import ExecLog, LLMRequest, Project, ProjectState, UserInput
+    from core.db.models import BranchHead, ExecLog, LLMRequest, Project, ProjectState, UserInput
+
+log = get_logger(__name__)
+
+
+def _progress(epics: list[dict], tasks: list[dict]) -> tuple[int, int, int, int]:
+    """
+    Summarize the epic/task progress of a project state.
+
+    Two consecutive states with different progress summaries mark a task
+    (or epic) boundary.
+    """
+    from core.db.models.project_state import TaskStatus
+
+    epics = epics or []
+    tasks = tasks or []
+    return (
+        len(epics),
+        len([epic for epic in epics if epic.get("completed")]),
+        len(tasks),
+        len([task for task in tasks if task.get("status") == TaskStatus.DONE]),
+    )
 
 
 class Branch(Base):
@@ -21,11 +46,14 @@ class Branch(Base):
 
     # ID and parent FKs
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
-    project_id: Mapped[UUID] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"))
+    project_id: Mapped[UUID] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), index=True)
+    parent_id: Mapped[Optional[UUID]] = mapped_column(ForeignKey("branches.id", ondelete="CASCADE"), index=True)
 
     # Attributes
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
     name: Mapped[str] = mapped_column(default=DEFAULT)
+    # For forked branches, the last step shared with the parent branch
+    fork_step_index: Mapped[Optional[int]] = mapped_column()
 
     # Relationships
     project: Mapped["Project"] = relationship(back_populates="branches", lazy="selectin")
@@ -33,6 +61,7 @@ class Branch(Base):
     llm_requests: Mapped[list["LLMRequest"]] = relationship(back_populates="branch", cascade="all", lazy="raise")
     user_inputs: Mapped[list["UserInput"]] = relationship(back_populates="branch", cascade="all", lazy="raise")
     exec_logs: Mapped[list["ExecLog"]] = relationship(back_populates="branch", cascade="all", lazy="raise")
+    head: Mapped[Optional["BranchHead"]] = relationship(back_populates="branch", viewonly=True, lazy="raise")
 
     @staticmethod
     async def get_by_id(session: "AsyncSession", branch_id: Union[str, UUID]) -> Optional["Branch"]:
@@ -49,6 +78,49 @@ class Branch(Base):
         result = await session.execute(select(Branch).where(Branch.id == branch_id))
         return result.scalar_one_or_none()
 
+    @staticmethod
+    async def get_steps(session: "AsyncSession", branch_ids: list[UUID]) -> dict[UUID, list[tuple[int, Optional[str]]]]:
+        """
+        Get the step indices and actions of all states in the branches.
+
+        This only reads two columns of the project states (using the
+        branch/step index), so it's much faster than loading the states.
+
+        :param session: The SQLAlchemy session.
+        :param branch_ids: IDs of the branches.
+        :return: Dictionary mapping branch IDs to ordered lists of `(step_index, action)` tuples.
+        """
+        from core.db.models import ProjectState
+
+        steps = {branch_id: [] for branch_id in branch_ids}
+        forks = {}
+        for i in range(0, len(branch_ids), BATCH_SIZE):
+            batch = branch_ids[i : i + BATCH_SIZE]
+            result = await session.execute(
+                select(ProjectState.branch_id, ProjectState.step_index, ProjectState.action)
+                .where(ProjectState.branch_id.in_(batch))
+                .order_by(ProjectState.branch_id, ProjectState.step_index)
+            )
+            for branch_id, step_index, action in result.all():
+                steps[branch_id].append((step_index, action))
+
+            result = await session.execute(
+                select(Branch.id, Branch.parent_id, Branch.fork_step_index).where(
+                    Branch.id.in_(batch), Branch.parent_id.is_not(None)
+                )
+            )
+            forks.update({branch_id: (parent_id, fork_step) for branch_id, parent_id, fork_step in result.all()})
+
+        # Forked branches share the steps up to the fork point with their parents
+        if forks:
+            parent_ids = list({parent_id for parent_id, _ in forks.values()})
+            parent_steps = await Branch.get_steps(session, parent_ids)
+            for branch_id, (parent_id, fork_step) in forks.items():
+                shared = [step for step in parent_steps[parent_id] if step[0] <= fork_step]
+                steps[branch_id] = shared + steps[branch_id]
+
+        return steps
+
     async def get_last_state(self) -> Optional["ProjectState"]:
         """
         Get the last project state of the branch.
@@ -68,7 +140,15 @@ class Branch(Base):
             .order_by(ProjectState.step_index.desc())
             .limit(1)
         )
-        return result.scalar_one_or_none()
+        state = result.scalar_one_or_none()
+        if state is None and self.parent_id is not None:
+            # A fork with no states of its own yet
+            parent = await Branch.get_by_id(session, self.parent_id)
+            return await parent.get_state_at_step(self.fork_step_index)
+
+        if state is not None:
+            await state.materialize()
+        return state
 
     async def get_state_at_step(self, step_index: int) -> Optional["ProjectState"]:
         """
@@ -83,7 +163,222 @@ class Branch(Base):
         if session is None:
             raise ValueError("Branch instance not associated with a DB session.")
 
+        if self.parent_id is not None and step_index <= self.fork_step_index:
+            parent = await Branch.get_by_id(session, self.parent_id)
+            return await parent.get_state_at_step(step_index)
+
         result = await session.execute(
             select(ProjectState).where((ProjectState.branch_id == self.id) & (ProjectState.step_index == step_index))
         )
+        state = result.scalar_one_or_none()
+        if state is not None:
+            await state.materialize()
+        return state
+
+    async def get_last_step_index(self) -> Optional[int]:
+        """
+        Get the index of the last step in the branch, without loading the state.
+
+        :return: The last step index, or None if the branch has no steps.
+        """
+        from core.db.models import BranchHead
+
+        session = inspect(self).async_session
+        if session is None:
+            raise ValueError("Branch instance not associated with a DB session.")
+
+        result = await session.execute(select(BranchHead.step_index).where(BranchHead.branch_id == self.id))
         return result.scalar_one_or_none()
+
+    async def fork(self, step_index: int, name: Optional[str] = None) -> "Branch":
+        """
+        Create a new branch continuing from the given step of this branch.
+
+        The new branch shares the states up to (and including) `step_index`
+        with this branch, so nothing is copied: the shared states are read
+        from the parent branch, and the first new state in the fork is
+        stored as a snapshot. Neither branch is modified.
+
+        :param step_index: The last step shared with the new branch.
+        :param name: Name of the new branch (default: `<name>@<step_index>`).
+        :return: The new Branch object.
+        """
+        from core.db.models import BranchHead
+
+        session = inspect(self).async_session
+        if session is None:
+            raise ValueError("Branch instance not associated with a DB session.")
+
+        state = await self.get_state_at_step(step_index)
+        if state is None:
+            raise ValueError(f"Branch {self.id} has no step {step_index}")
+
+        if name is None:
+            result = await session.execute(
+                select(func.count()).where(Branch.parent_id == self.id, Branch.fork_step_index == step_index)
+            )
+            n_forks = result.scalar_one()
+            name = f"{self.name}@{step_index}" + (f".{n_forks + 1}" if n_forks else "")
+
+        branch = Branch(project=self.project, name=name, parent_id=self.id, fork_step_index=step_index)
+        session.add(branch)
+        await session.flush()
+        session.add(
+            BranchHead(
+                branch_id=branch.id,
+                project_id=self.project_id,
+                state_id=state.id,
+                step_index=step_index,
+            )
+        )
+        await session.flush()
+
+        log.debug(f"Forked branch {branch.name} ({branch.id}) from {self.name} ({self.id}) at step {step_index}")
+        return branch
+
+    async def compact(
+        self,
+        keep_last: int,
+        *,
+        keep_task_boundaries: bool = True,
+        keep_logs: bool = False,
+    ) -> int:
+        """
+        Squash old project states in the branch.
+
+        Keeps the first state, the last `keep_last` states, the states other
+        branches were forked from and, optionally, every task boundary (states
+        in which a task or an epic was finished or a new one was planned). Other states are deleted together with
+        their files, and the surviving states are re-linked so each one points
+        to the previous survivor. Step indices of the survivors don't change.
+
+        File contents and specifications that are no longer referenced
+        by any project state are deleted.
+
+        :param keep_last: Number of most recent states to keep.
+        :param keep_task_boundaries: Whether to keep task and epic boundaries.
+        :param keep_logs: Whether to keep LLM requests, user inputs and command logs
+            of squashed states (they're detached from the state but kept in the branch).
+        :return: Number of squashed (deleted) states.
+        """
+        from core.db.models import ExecLog, File, FileContent, LLMRequest, ProjectState, Specification, UserInput
+
+        session = inspect(self).async_session
+        if session is None:
+            raise ValueError("Branch instance not associated with a DB session.")
+        if keep_last < 1:
+            raise ValueError("At least one state must be kept.")
+
+        result = await session.execute(
+            select(
+                ProjectState.id,
+                ProjectState.prev_state_id,
+                ProjectState.specification_id,
+                ProjectState.step_index,
+                ProjectState.delta,
+            )
+            .where(ProjectState.branch_id == self.id)
+            .order_by(ProjectState.step_index)
+        )
+        states = result.all()
+        if len(states) <= keep_last + 1:
+            return 0
+
+        keep = {states[0].id} | {s.id for s in states[-keep_last:]}
+
+        # States shared with forked branches must be kept
+        result = await session.execute(select(Branch.fork_step_index).where(Branch.parent_id == self.id))
+        fork_steps = set(result.scalars().all())
+        keep |= {s.id for s in states if s.step_index in fork_steps}
+        if keep_task_boundaries:
+            progress = [_progress(data["epics"], data["tasks"]) async for _, data in self._iter_state_data(states)]
+            for i in range(1, len(states)):
+                if progress[i - 1] != progress[i]:
+                    keep.add(states[i].id)
+
+        squashed = [s.id for s in states if s.id not in keep]
+        if not squashed:
+            return 0
+
+        log.debug(f"Compacting branch {self.id}: squashing {len(squashed)} of {len(states)} states")
+
+        content_ids = set()
+        for i in range(0, len(squashed), BATCH_SIZE):
+            batch = squashed[i : i + BATCH_SIZE]
+            result = await session.execute(select(distinct(File.content_id)).where(File.project_state_id.in_(batch)))
+            content_ids.update(result.scalars().all())
+
+            # Unlink the squashed states first so the survivors can be re-linked
+            # without violating the unique constraint on prev_state_id.
+            await session.execute(update(ProjectState).where(ProjectState.id.in_(batch)).values(prev_state_id=None))
+
+        prev_survivor = None
+        relinked = set()
+        for state in states:
+            if state.id not in keep:
+                continue
+            if prev_survivor is not None and state.prev_state_id != prev_survivor:
+                await session.execute(
+                    update(ProjectState).where(ProjectState.id == state.id).values(prev_state_id=prev_survivor)
+                )
+                relinked.add(state.id)
+            prev_survivor = state.id
+
+        # Survivors stored as patches against a squashed state must be stored as snapshots
+        async for state, data in self._iter_state_data(states):
+            if state.id in relinked and state.delta is not None:
+                await session.execute(
+                    update(ProjectState).where(ProjectState.id == state.id).values(delta=None, **deepcopy(data))
+                )
+
+        for i in range(0, len(squashed), BATCH_SIZE):
+            batch = squashed[i : i + BATCH_SIZE]
+            for model in (LLMRequest, UserInput, ExecLog):
+                if keep_logs:
+                    await session.execute(
+                        update(model).where(model.project_state_id.in_(batch)).values(project_state_id=None)
+                    )
+                else:
+                    await session.execute(delete(model).where(model.project_state_id.in_(batch)))
+            await session.execute(delete(File).where(File.project_state_id.in_(batch)))
+            await session.execute(delete(ProjectState).where(ProjectState.id.in_(batch)))
+
+        spec_ids = {s.specification_id for s in states if s.id not in keep}
+        await Specification.delete_orphans(session, spec_ids)
+        await FileContent.delete_orphans(session, content_ids)
+
+        return len(squashed)
+
+    async def _iter_state_data(self, states: list) -> AsyncIterator[tuple[Any, dict]]:
+        """
+        Materialize the data fields of the (ordered) branch states, one by one.
+
+        The yielded data is modified in place when moving to the next state,
+        so it must be used (or copied) before continuing the iteration.
+
+        :param states: Rows with `id` and `delta` columns, ordered by step index.
+        :return: Async iterator of (state row, data dict) tuples.
+        """
+        from core.db.models.project_state import DATA_FIELDS, ProjectState
+
+        session = inspect(self).async_session
+        data = None
+        for i in range(0, len(states), BATCH_SIZE):
+            batch = states[i : i + BATCH_SIZE]
+            snapshot_ids = [s.id for s in batch if s.delta is None]
+            result = await session.execute(
+                select(ProjectState.id, *[getattr(ProjectState, f) for f in DATA_FIELDS]).where(
+                    ProjectState.id.in_(snapshot_ids)
+                )
+            )
+            snapshots = {row.id: row for row in result.all()}
+
+            for state in batch:
+                if state.delta is None:
+                    data = {f: getattr(snapshots[state.id], f) for f in DATA_FIELDS}
+                else:
+                    if data is None:
+                        raise ValueError(f"Project state {state.id} is stored as a patch without a preceding snapshot")
+                    for field, patch in state.delta.items():
+                        data[field] = apply_patch(data[field], patch)
+                yield state, data
@@ -0,0 +1,76 @@
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+from uuid import UUID
+
+from sqlalchemy import Connection, ForeignKey, insert, select, update
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql import func
+
+from core.db.models import Base
+
+if TYPE_CHECKING:
+    from core.db.models import Branch, ProjectState
+
+
+class BranchHead(Base):
+    """
+    Summary of the latest state in each branch.
+
+    The table is kept up to date whenever a project state is inserted (see
+    `ProjectState` insert events) or the branch history is truncated with
+    `ProjectState.delete_after()`, so listing projects doesn't need to scan
+    the (potentially huge) project states table.
+    """
+
+    __tablename__ = "branch_heads"
+
+    # ID and parent FKs
+    branch_id: Mapped[UUID] = mapped_column(ForeignKey("branches.id", ondelete="CASCADE"), primary_key=True)
+    project_id: Mapped[UUID] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), index=True)
+    state_id: Mapped[Optional[UUID]] = mapped_column(ForeignKey("project_states.id", ondelete="SET NULL"))
+
+    # Attributes
+    step_index: Mapped[int] = mapped_column()
+    updated_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    # Relationships
+    branch: Mapped["Branch"] = relationship(back_populates="head", lazy="raise")
+
+    def __repr__(self) -> str:
+        return f"<BranchHead(branch_id={self.branch_id}, step_index={self.step_index})>"
+
+    @staticmethod
+    def advance(connection: Connection, state: "ProjectState"):
+        """
+        Move the branch head to the state, unless the branch already has a later state.
+
+        This is called from the ProjectState "after_insert" event, so it
+        runs in the same transaction (and connection) as the insert itself.
+
+        :param connection: The (sync) database connection.
+        :param state: The newly inserted project state.
+        """
+        from core.db.models import Branch
+
+        result = connection.execute(
+            update(BranchHead)
+            .where(BranchHead.branch_id == state.branch_id, BranchHead.step_index <= state.step_index)
+            .values(state_id=state.id, step_index=state.step_index, updated_at=func.now())
+        )
+        if result.rowcount > 0:
+            return
+
+        exists = connection.execute(
+            select(BranchHead.branch_id).where(BranchHead.branch_id == state.branch_id)
+        ).scalar_one_or_none()
+        if exists is not None:
+            return
+
+        connection.execute(
+            insert(BranchHead).values(
+                branch_id=state.branch_id,
+                project_id=select(Branch.project_id).where(Branch.id == state.branch_id).scalar_subquery(),
+                state_id=state.id,
+                step_index=state.step_index,
+            )
+        )
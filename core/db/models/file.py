@@ -17,7 +17,7 @@ class File(Base):
     # ID and parent FKs
     id: Mapped[int] = mapped_column(primary_key=True)
     project_state_id: Mapped[UUID] = mapped_column(ForeignKey("project_states.id", ondelete="CASCADE"))
-    content_id: Mapped[str] = mapped_column(ForeignKey("file_contents.id", ondelete="RESTRICT"))
+    content_id: Mapped[str] = mapped_column(ForeignKey("file_contents.id", ondelete="RESTRICT"), index=True)
 
     # Attributes
     path: Mapped[str] = mapped_column()
@@ -25,16 +25,29 @@ class File(Base):
 
     # Relationships
     project_state: Mapped[Optional["ProjectState"]] = relationship(back_populates="files", lazy="raise")
-    content: Mapped["FileContent"] = relationship(back_populates="files", lazy="selectin")
+    # No backref: FileContent objects are shared by all the project states, so
+    # tracking their (ever-growing) list of files in memory would leak.
+    content: Mapped["FileContent"] = relationship(lazy="selectin")
 
     def clone(self) -> "File":
         """
         Clone the file object, to be used in a new project state.
 
-        The clone references the same file content object as the original.
+        The clone references the same file content object as the original
+        (if it's loaded), so the content relationship doesn't need to be
+        loaded again for the new project state.
 
         :return: The cloned file object.
         """
+        if "content" in self.__dict__:
+            return File(
+                project_state=None,
+                content_id=self.content_id,
+                content=self.content,
+                path=self.path,
+                meta=self.meta,
+            )
+
         return File(
             project_state=None,
             content_id=self.content_id,
@@ -1,10 +1,13 @@
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable, Optional
 
-from sqlalchemy import delete, distinct, select
+from sqlalchemy import delete, exists, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm.attributes import set_committed_value
 
+from core.db.content_cache import content_cache
 from core.db.models import Base
+from core.db.models.base import BATCH_SIZE
 
 if TYPE_CHECKING:
     from core.db.models import File
@@ -17,10 +20,13 @@ class FileContent(Base):
     id: Mapped[str] = mapped_column(primary_key=True)
 
     # Attributes
-    content: Mapped[str] = mapped_column()
+    # The content is not loaded together with the object, as that would load
+    # the contents of all the files in the project for every project state.
+    # Use `FileContent.load()` to (batch) load the contents that are needed.
+    content: Mapped[str] = mapped_column(deferred=True, deferred_raiseload=True)
 
     # Relationships
-    files: Mapped[list["File"]] = relationship(back_populates="content", lazy="raise")
+    files: Mapped[list["File"]] = relationship(viewonly=True, lazy="raise")
 
     @classmethod
     async def store(cls, session: AsyncSession, hash: str, content: str) -> "FileContent":
@@ -36,9 +42,13 @@ class FileContent(Base):
         :param content: The file content as unicode string.
         :return: The file content object.
         """
+        content_cache.put(hash, content)
+
         result = await session.execute(select(FileContent).where(FileContent.id == hash))
         fc = result.scalar_one_or_none()
         if fc is not None:
+            if not fc.is_loaded:
+                set_committed_value(fc, "content", content)
             return fc
 
         fc = cls(id=hash, content=content)
@@ -46,13 +56,84 @@ class FileContent(Base):
 
         return fc
 
+    @property
+    def is_loaded(self) -> bool:
+        """
+        Whether the content is loaded and can be accessed.
+        """
+        return "content" in self.__dict__
+
+    @staticmethod
+    def load_cached(contents: Iterable["FileContent"]) -> list["FileContent"]:
+        """
+        Load the content of the given FileContent objects from the content cache.
+
+        This doesn't access the database.
+
+        :param contents: FileContent objects whose content should be loaded.
+        :return: FileContent objects that are not in the cache and still need to be loaded.
+        """
+        missing = []
+        for fc in contents:
+            if fc.is_loaded:
+                continue
+            content = content_cache.get(fc.id)
+            if content is not None:
+                set_committed_value(fc, "content", content)
+            else:
+                missing.append(fc)
+        return missing
+
     @classmethod
-    async def delete_orphans(cls, session: AsyncSession):
+    async def load(cls, session: AsyncSession, contents: Iterable["FileContent"]):
+        """
+        Load the content of the given FileContent objects.
+
+        Contents are looked up in the shared content cache first, and the
+        remaining ones are fetched from the database in batches.
+
+        :param session: The database session.
+        :param contents: FileContent objects whose content should be loaded.
+        """
+        missing: dict[str, list["FileContent"]] = {}
+        for fc in cls.load_cached(contents):
+            missing.setdefault(fc.id, []).append(fc)
+
+        ids = list(missing)
+        for i in range(0, len(ids), BATCH_SIZE):
+            batch = ids[i : i + BATCH_SIZE]
+            result = await session.execute(select(FileContent.id, FileContent.content).where(FileContent.id.in_(batch)))
+            for id, content in result.all():
+                content_cache.put(id, content)
+                for fc in missing[id]:
+                    set_committed_value(fc, "content", content)
+
+    @classmethod
+    async def delete_orphans(cls, session: AsyncSession, candidates: Optional[Iterable[str]] = None) -> int:
         """
         Delete FileContent objects that are not referenced by any File object.
 
+        If `candidates` are given, only the FileContent objects with those IDs
+        are checked (and deleted if orphaned). This is used after deleting
+        files (eg. deleting or compacting a project) to avoid scanning
+        the entire table.
+
         :param session: The database session.
+        :param candidates: IDs of the FileContent objects that might be orphaned (optional).
+        :return: Number of deleted FileContent objects.
         """
         from core.db.models import File
 
-        await session.execute(delete(FileContent).where(~FileContent.id.in_(select(distinct(File.content_id)))))
+        orphaned = ~exists().where(File.content_id == FileContent.id)
+
+        if candidates is None:
+            result = await session.execute(delete(FileContent).where(orphaned))
+            return result.rowcount
+
+        candidates = list(candidates)
+        n_deleted = 0
+        for i in range(0, len(candidates), BATCH_SIZE):
+            batch = candidates[i : i + BATCH_SIZE]
+            result = await session.execute(delete(FileContent).where(FileContent.id.in_(batch), orphaned))
+            n_deleted += result.rowcount
+        return n_deleted
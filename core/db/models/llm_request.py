@@ -20,8 +20,10 @@ class LLMRequest(Base):
 
     # ID and parent FKs
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    branch_id: Mapped[UUID] = mapped_column(ForeignKey("branches.id", ondelete="CASCADE"))
-    project_state_id: Mapped[Optional[UUID]] = mapped_column(ForeignKey("project_states.id", ondelete="SET NULL"))
+    branch_id: Mapped[UUID] = mapped_column(ForeignKey("branches.id", ondelete="CASCADE"), index=True)
+    project_state_id: Mapped[Optional[UUID]] = mapped_column(
+        ForeignKey("project_states.id", ondelete="SET NULL"), index=True
+    )
 
     # Attributes
     started_at: Mapped[datetime] = mapped_column(server_default=func.now())
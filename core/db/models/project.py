@@ -4,7 +4,7 @@ from typing import TYPE_CHECKING, Optional, Union
 from unicodedata import normalize
 from uuid import UUID, uuid4
 
-from sqlalchemy import and_, delete, inspect, select
+from sqlalchemy import Index, delete, inspect, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column, relationship, selectinload
 from sqlalchemy.sql import func
@@ -17,6 +17,7 @@ if TYPE_CHECKING:
 
 class Project(Base):
     __tablename__ = "projects"
+    __table_args__ = (Index("ix_projects_name_id", "name", "id"),)
 
     # ID and parent FKs
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
@@ -67,41 +68,63 @@ class Project(Base):
         return result.scalar_one_or_none()
 
     @staticmethod
-    async def get_all_projects(session: "AsyncSession") -> list["Project"]:
+    async def get_projects(
+        session: "AsyncSession",
+        *,
+        name: Optional[str] = None,
+        after: Optional[tuple[str, UUID]] = None,
+        limit: Optional[int] = None,
+    ) -> list["Project"]:
         """
-        Get all projects.
+        Get a page of projects, ordered by name, with their branches and branch heads.
 
-        This assumes the projects have at least one branch and one state.
+        Only projects with at least one project state are returned. The
+        branch heads (see `BranchHead`) contain the latest step of each
+        branch, so this never needs to look at the project states.
+
+        The listing uses keyset pagination: to get the next page, pass
+        the name and ID of the last project from the previous page as
+        `after`. Unlike offset pagination, this costs the same for every
+        page, however many projects there are.
 
         :param session: The SQLAlchemy session.
+        :param name: Only return projects whose name contains this text (case-insensitive).
+        :param after: Only return projects after this `(name, id)` key.
+        :param limit: Maximum number of projects to return (default: all).
         :return: List of Project objects.
         """
-        from core.db.models import Branch, ProjectState
-
-        latest_state_query = (
-            select(ProjectState.branch_id, func.max(ProjectState.step_index).label("max_index"))
-            .group_by(ProjectState.branch_id)
-            .subquery()
-        )
+        from core.db.models import Branch, BranchHead
 
         query = (
-            select(Project, Branch, ProjectState)
-            .join(Branch, Project.branches)
-            .join(ProjectState, Branch.states)
-            .join(
-                latest_state_query,
-                and_(
-                    ProjectState.branch_id == latest_state_query.columns.branch_id,
-                    ProjectState.step_index == latest_state_query.columns.max_index,
-                ),
-            )
-            .options(selectinload(Project.branches), selectinload(Branch.states))
-            .order_by(Project.name, Branch.name)
+            select(Project)
+            .where(select(BranchHead.branch_id).where(BranchHead.project_id == Project.id).exists())
+            .options(selectinload(Project.branches).selectinload(Branch.head))
+            .order_by(Project.name, Project.id)
+            # Branch heads are updated behind the ORM's back, so refresh any already loaded ones
+            .execution_options(populate_existing=True)
         )
+        if name:
+            query = query.where(Project.name.ilike(f"%{name}%"))
+        if after is not None:
+            query = query.where(tuple_(Project.name, Project.id) > tuple_(*after))
+        if limit is not None:
+            query = query.limit(limit)
 
         results = await session.execute(query)
         return results.scalars().all()
 
+    @staticmethod
+    async def get_all_projects(session: "AsyncSession") -> list["Project"]:
+        """
+        Get all projects.
+
+        This assumes the projects have at least one branch and one state.
+
+        :param session: The SQLAlchemy session.
+        :return: List of Project objects, with branches and branch heads loaded.
+        """
+        return await Project.get_projects(session)
+
     @staticmethod
     def get_folder_from_project_name(name: str):
         """
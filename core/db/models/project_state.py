@@ -1,15 +1,18 @@
+from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Iterable, Optional
 from uuid import UUID, uuid4
 
-from sqlalchemy import ForeignKey, UniqueConstraint, delete, inspect
+from sqlalchemy import ForeignKey, UniqueConstraint, delete, event, inspect, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
 from sqlalchemy.sql import func
+from sqlalchemy.types import JSON
 
-from core.db.models import Base
+from core.db.json_patch import apply_patch, make_patch
+from core.db.models import Base, BranchHead
 from core.log import get_logger
 
 if TYPE_CHECKING:
@@ -17,6 +20,26 @@ if TYPE_CHECKING:
 
 log = get_logger(__name__)
 
+# JSON fields of the project state that are stored as patches against the previous state,
+# with their default values
+DATA_DEFAULTS = {
+    "epics": list,
+    "tasks": list,
+    "steps": list,
+    "iterations": list,
+    "relevant_files": lambda: None,
+    "modified_files": dict,
+    "docs": lambda: None,
+}
+DATA_FIELDS = tuple(DATA_DEFAULTS)
+
+# Store a full snapshot of the data fields after this many patches
+SNAPSHOT_INTERVAL = 50
+
+# Number of recently materialized states to keep in memory
+MATERIALIZED_CACHE_SIZE = 16
+_materialized: OrderedDict[UUID, dict[str, Any]] = OrderedDict()
+
 
 class TaskStatus:
     """Status of a task."""
@@ -58,18 +81,23 @@ class ProjectState(Base):
     id: Mapped[UUID] = mapped_column(primary_key=True, default=uuid4)
     branch_id: Mapped[UUID] = mapped_column(ForeignKey("branches.id", ondelete="CASCADE"))
     prev_state_id: Mapped[Optional[UUID]] = mapped_column(ForeignKey("project_states.id", ondelete="CASCADE"))
-    specification_id: Mapped[int] = mapped_column(ForeignKey("specifications.id"))
+    specification_id: Mapped[int] = mapped_column(ForeignKey("specifications.id"), index=True)
 
     # Attributes
     created_at: Mapped[datetime] = mapped_column(server_default=func.now())
     step_index: Mapped[int] = mapped_column(default=1, server_default="1")
-    epics: Mapped[list[dict]] = mapped_column(default=list)
-    tasks: Mapped[list[dict]] = mapped_column(default=list)
-    steps: Mapped[list[dict]] = mapped_column(default=list)
-    iterations: Mapped[list[dict]] = mapped_column(default=list)
-    relevant_files: Mapped[Optional[list[str]]] = mapped_column(default=None)
-    modified_files: Mapped[dict] = mapped_column(default=dict)
-    docs: Mapped[Optional[list[dict]]] = mapped_column(default=None)
+    # The data fields (see DATA_FIELDS) are stored either in full (snapshot) or, if
+    # `delta` is set, as JSON patches against the previous state, with empty columns.
+    # In memory, the data fields of a state are always populated once it's been
+    # materialized, see `materialize()`. Defaults are set by `_encode()`.
+    epics: Mapped[list[dict]] = mapped_column(nullable=True)
+    tasks: Mapped[list[dict]] = mapped_column(nullable=True)
+    steps: Mapped[list[dict]] = mapped_column(nullable=True)
+    iterations: Mapped[list[dict]] = mapped_column(nullable=True)
+    relevant_files: Mapped[Optional[list[str]]] = mapped_column()
+    modified_files: Mapped[dict] = mapped_column(nullable=True)
+    docs: Mapped[Optional[list[dict]]] = mapped_column()
+    delta: Mapped[Optional[dict]] = mapped_column(JSON(none_as_null=True))
     run_command: Mapped[Optional[str]] = mapped_column()
     action: Mapped[Optional[str]] = mapped_column()
 
@@ -82,7 +110,9 @@ class ProjectState(Base):
         lazy="raise",
         cascade="delete",
     )
-    next_state: Mapped[Optional["ProjectState"]] = relationship(back_populates="prev_state", lazy="raise")
+    # Next states are always added to the session explicitly. Cascading would re-add the whole
+    # chain of states (and their files) created in the process to each new session.
+    next_state: Mapped[Optional["ProjectState"]] = relationship(back_populates="prev_state", lazy="raise", cascade="")
     files: Mapped[list["File"]] = relationship(
         back_populates="project_state",
         lazy="selectin",
@@ -93,6 +123,16 @@ class ProjectState(Base):
     user_inputs: Mapped[list["UserInput"]] = relationship(back_populates="project_state", cascade="all", lazy="raise")
     exec_logs: Mapped[list["ExecLog"]] = relationship(back_populates="project_state", cascade="all", lazy="raise")
 
+    # Number of patches since the last snapshot (None if the state is not materialized)
+    _snapshot_distance = None
+    # In-memory values of the data fields while the state is being inserted
+    _pending_data = None
+    # Values of the data fields as stored in the database (the base for the next state's patches),
+    # or None if not known
+    _persisted_data = None
+    # Index of files by path, see `get_file_by_path()`
+    _files_by_path = None
+
     @property
     def unfinished_steps(self) -> list[dict]:
         """
@@ -213,27 +253,41 @@ class ProjectState(Base):
             step_index=1,
         )
 
-    async def create_next_state(self) -> "ProjectState":
+    async def create_next_state(self, branch: Optional["Branch"] = None, detached: bool = False) -> "ProjectState":
         """
         Create the next project state for the branch.
 
         This does NOT insert the new state and the associated objects (spec,
         files, ...) to the database.
 
-        :param session: The SQLAlchemy session.
+        If `branch` is a branch forked from this state's branch (see
+        `Branch.fork()`), the new state is the first state in the fork. It
+        is not linked to this state (which stays in the parent branch) and
+        is stored as a full snapshot.
+
+        If `detached` is True, the new state is not added to the session, so
+        it's not inserted if the session is committed before the new state is
+        complete (see `StateManager.commit()`).
+
+        :param branch: The branch for the new state (default: this state's branch).
+        :param detached: Don't add the new state to the session.
         :return: The new ProjectState object.
         """
         if not self.id:
             raise ValueError("Cannot create next state for unsaved state.")
 
-        if "next_state" in self.__dict__:
-            raise ValueError(f"Next state already exists for state with id={self.id}.")
+        if branch is None or branch.id == self.branch_id:
+            branch = self.branch
+            if "next_state" in self.__dict__:
+                raise ValueError(f"Next state already exists for state with id={self.id}.")
 
+        linked = branch.id == self.branch_id
         new_state = ProjectState(
-            branch=self.branch,
-            prev_state=self,
+            branch_id=branch.id,
+            prev_state=self if linked and not detached else None,
+            prev_state_id=self.id if linked else None,
             step_index=self.step_index + 1,
-            specification=self.specification,
+            specification_id=self.specification_id,
             epics=deepcopy(self.epics),
             tasks=deepcopy(self.tasks),
             steps=deepcopy(self.steps),
@@ -244,9 +298,21 @@ class ProjectState(Base):
             docs=deepcopy(self.docs),
             run_command=self.run_command,
         )
-
-        session: AsyncSession = inspect(self).async_session
-        session.add(new_state)
+        # Set the relationships without the backrefs: otherwise every new state is appended
+        # to the in-memory `Branch.states` and `Specification.project_states` lists, making
+        # each later `session.add()` cascade through all the states created so far.
+        set_committed_value(new_state, "branch", branch)
+        set_committed_value(new_state, "specification", self.specification)
+
+        if detached:
+            # Link the states without the unit of work noticing, so the new state is
+            # ignored when flushing this one. The link is still there for `_encode()`.
+            if linked:
+                set_committed_value(new_state, "prev_state", self)
+                set_committed_value(self, "next_state", new_state)
+        else:
+            session: AsyncSession = inspect(self).async_session
+            session.add(new_state)
 
         # NOTE: we only need the await here because of the tests, in live, the
         # load_project() and commit() methods on StateManager make sure that
@@ -257,6 +323,132 @@ class ProjectState(Base):
 
         return new_state
 
+    async def materialize(self):
+        """
+        Populate the data fields of a state stored as a patch.
+
+        States whose data fields are stored as patches (see `delta`) are
+        loaded with the data fields set to None. This reconstructs them by
+        applying the patches since the last snapshot (or since the nearest
+        recently materialized state). Does nothing if the state is already
+        materialized.
+
+        Branch.get_last_state() and Branch.get_state_at_step() return
+        materialized states.
+        """
+        if self._snapshot_distance is not None:
+            return
+        if self.delta is None:
+            self._snapshot_distance = 0
+            return
+
+        session: AsyncSession = inspect(self).async_session
+        last_snapshot = (
+            select(func.max(ProjectState.step_index))
+            .where(
+                ProjectState.branch_id == self.branch_id,
+                ProjectState.step_index < self.step_index,
+                ProjectState.delta.is_(None),
+            )
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            select(ProjectState.id, ProjectState.delta)
+            .where(
+                ProjectState.branch_id == self.branch_id,
+                ProjectState.step_index >= last_snapshot,
+                ProjectState.step_index < self.step_index,
+            )
+            .order_by(ProjectState.step_index)
+        )
+        chain = result.all()
+        if not chain:
+            raise ValueError(f"No snapshot found for project state {self.id}")
+
+        for start in range(len(chain) - 1, -1, -1):
+            if chain[start].id in _materialized:
+                _materialized.move_to_end(chain[start].id)
+                data = deepcopy(_materialized[chain[start].id])
+                break
+        else:
+            start = 0
+            result = await session.execute(
+                select(*[getattr(ProjectState, field) for field in DATA_FIELDS]).where(ProjectState.id == chain[0].id)
+            )
+            data = dict(zip(DATA_FIELDS, result.one()))
+
+        for row in chain[start + 1 :]:
+            for field, patch in row.delta.items():
+                data[field] = apply_patch(data[field], patch)
+        for field, patch in self.delta.items():
+            data[field] = apply_patch(data[field], patch)
+
+        _materialized[self.id] = deepcopy(data)
+        while len(_materialized) > MATERIALIZED_CACHE_SIZE:
+            _materialized.popitem(last=False)
+
+        for field, value in data.items():
+            set_committed_value(self, field, value)
+        self._persisted_data = deepcopy(data)
+        self._snapshot_distance = len(chain)
+
+    def _encode(self):
+        """
+        Prepare the data fields for storing the state to the database.
+
+        If the previous state is materialized, the data fields are stored as
+        patches against its stored values (see `_persisted_data`), so the size
+        of the stored state depends on the size of the change. Every
+        SNAPSHOT_INTERVAL states (or if the previous state is not available)
+        a full snapshot is stored instead.
+
+        The in-memory values are restored by `_restore()` after the insert
+        or update.
+        """
+        data = {}
+        for field, default in DATA_DEFAULTS.items():
+            value = getattr(self, field)
+            data[field] = default() if value is None else value
+
+        prev = self.__dict__.get("prev_state")
+        distance = None
+        if prev is not None and prev._persisted_data is not None:
+            distance = prev._snapshot_distance
+
+        if distance is None or distance + 1 >= SNAPSHOT_INTERVAL:
+            self.delta = None
+            for field, value in data.items():
+                setattr(self, field, value)
+                # Make sure all the fields are written when updating a state that was stored as a patch
+                flag_modified(self, field)
+            self._snapshot_distance = 0
+        else:
+            delta = {}
+            for field, value in data.items():
+                # The in-memory values of the previous state may have been changed in place
+                # after it was stored, so the patch is made against the stored ones
+                patch = make_patch(prev._persisted_data[field], value)
+                if patch:
+                    delta[field] = patch
+                setattr(self, field, None)
+            self.delta = delta
+            self._snapshot_distance = distance + 1
+
+        self._pending_data = data
+
+    def _restore(self):
+        """
+        Restore the in-memory values of the data fields after the insert or update.
+
+        A copy of the stored values is kept for making the next state's patches.
+        """
+        if self._pending_data is None:
+            return
+        for field, value in self._pending_data.items():
+            set_committed_value(self, field, value)
+        self._persisted_data = deepcopy(self._pending_data)
+        self._pending_data = None
+
     def complete_step(self):
         if not self.unfinished_steps:
             raise ValueError("There are no unfinished steps to complete")
@@ -327,6 +519,16 @@ class ProjectState(Base):
         """
         flag_modified(self, "tasks")
 
+    def flag_epics_as_modified(self):
+        """
+        Flag the epics field as having been modified
+
+        Used by Agents that perform modifications within the mutable epics field,
+        to tell the database that it was modified and should get saved (as SQLalchemy
+        can't detect changes in mutable fields by itself).
+        """
+        flag_modified(self, "epics")
+
     def set_current_task_status(self, status: str):
         """
         Set the status of the current task.
@@ -345,14 +547,45 @@ class ProjectState(Base):
         """
         Get a file from the current project state, by the file path.
 
+        Uses a path index that's built on first use and kept up to
+        date as files are added to or removed from the state.
+
         :param path: The file path.
         :return: The file object, or None if not found.
         """
-        for file in self.files:
-            if file.path == path:
-                return file
+        if self._files_by_path is None:
+            self._files_by_path = {}
+            # Iterate in reverse so the first file wins in the (invalid) case of duplicate paths
+            for file in reversed(self.files):
+                self._files_by_path[file.path] = file
 
-        return None
+        return self._files_by_path.get(path)
+
+    async def load_file_contents(self, files: Optional[Iterable["File"]] = None):
+        """
+        Load the contents of the files in this project state.
+
+        File contents are not loaded with the files, so this must be called
+        before accessing `file.content.content`. Contents are served from the
+        shared content cache when possible, and fetched from the database
+        in batches otherwise.
+
+        :param files: Files to load the contents for (default: all files in the state).
+        """
+        from core.db.models import FileContent
+
+        session: AsyncSession = inspect(self).async_session
+
+        if files is None:
+            files = await self.awaitable_attrs.files
+
+        contents = []
+        for file in files:
+            if "content" not in file.__dict__:
+                await file.awaitable_attrs.content
+            contents.append(file.content)
+
+        await FileContent.load(session, contents)
 
     def save_file(self, path: str, content: "FileContent", external: bool = False) -> "File":
         """
@@ -377,20 +610,22 @@ class ProjectState(Base):
             raise ValueError("Current state is read-only (already has a next state).")
 
         file = self.get_file_by_path(path)
+        if path not in self.modified_files and not external:
+            # The original content is only needed (and loaded) the first time a file is modified
+            self.modified_files[path] = file.content.content if file else ""
+
         if file:
-            original_content = file.content.content
             file.content = content
         else:
-            original_content = ""
             file = File(path=path, content=content)
             self.files.append(file)
 
-        if path not in self.modified_files and not external:
-            self.modified_files[path] = original_content
-
         self.relevant_files = self.relevant_files or []
         if path not in self.relevant_files:
             self.relevant_files.append(path)
+        # The fields are changed in place, so the change must be flagged for the next flush
+        flag_modified(self, "modified_files")
+        flag_modified(self, "relevant_files")
 
         return file
 
@@ -408,6 +643,11 @@ class ProjectState(Base):
                 ProjectState.step_index > self.step_index,
             )
         )
+        await session.execute(
+            update(BranchHead)
+            .where(BranchHead.branch_id == self.branch_id)
+            .values(state_id=self.id, step_index=self.step_index, updated_at=func.now())
+        )
 
     def get_last_iteration_steps(self) -> list:
         """
@@ -443,3 +683,47 @@ class ProjectState(Base):
         """
         li = self.unfinished_steps
         return [step for step in li if step.get("type") == step_type] if li else []
+
+
+def _on_load(state: ProjectState, _context):
+    if state.delta is None:
+        state._snapshot_distance = 0
+        state._persisted_data = {field: deepcopy(getattr(state, field)) for field in DATA_FIELDS}
+
+
+def _before_update(_mapper, _connection, state: ProjectState):
+    # The next state is usually inserted by an autoflush early in the step,
+    # and updated as the agents modify it
+    attrs = inspect(state).attrs
+    if any(attrs[field].history.has_changes() for field in DATA_FIELDS):
+        _materialized.pop(state.id, None)
+        state._encode()
+
+
+def _on_file_append(state: ProjectState, file: "File", _initiator):
+    if state._files_by_path is not None:
+        state._files_by_path.setdefault(file.path, file)
+
+
+def _on_file_remove(state: ProjectState, file: "File", _initiator):
+    if state._files_by_path is not None and state._files_by_path.get(file.path) is file:
+        del state._files_by_path[file.path]
+
+
+def _reset_files_index(state: Optional[ProjectState], *_args, **_kw):
+    # The "expire" event can fire for an object that was already garbage-collected
+    if state is not None:
+        state._files_by_path = None
+
+
+event.listen(ProjectState, "load", _on_load)
+event.listen(ProjectState, "refresh", _reset_files_index)
+event.listen(ProjectState, "expire", _reset_files_index)
+event.listen(ProjectState.files, "append", _on_file_append)
+event.listen(ProjectState.files, "remove", _on_file_remove)
+event.listen(ProjectState.files, "bulk_replace", _reset_files_index)
+event.listen(ProjectState, "before_insert", lambda _mapper, _connection, state: state._encode())
+event.listen(ProjectState, "after_insert", lambda _mapper, _connection, state: state._restore())
+event.listen(ProjectState, "after_insert", lambda _mapper, connection, state: BranchHead.advance(connection, state))
+event.listen(ProjectState, "before_update", _before_update)
+event.listen(ProjectState, "after_update", lambda _mapper, _connection, state: state._restore())
@@ -1,11 +1,12 @@
 from copy import deepcopy
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Iterable, Optional
 
-from sqlalchemy import delete, distinct, select
+from sqlalchemy import delete, exists
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from core.db.models import Base
+from core.db.models.base import BATCH_SIZE
 
 if TYPE_CHECKING:
     from core.db.models import ProjectState
@@ -58,14 +59,29 @@ class Specification(Base):
         return clone
 
     @classmethod
-    async def delete_orphans(cls, session: AsyncSession):
+    async def delete_orphans(cls, session: AsyncSession, candidates: Optional[Iterable[int]] = None) -> int:
         """
         Delete Specification objects that are not referenced by any ProjectState object.
 
+        If `candidates` are given, only the Specification objects with those IDs
+        are checked (and deleted if orphaned), avoiding a full table scan.
+
         :param session: The database session.
+        :param candidates: IDs of the Specification objects that might be orphaned (optional).
+        :return: Number of deleted Specification objects.
         """
         from core.db.models import ProjectState
 
-        await session.execute(
-            delete(Specification).where(~Specification.id.in_(select(distinct(ProjectState.specification_id))))
-        )
+        orphaned = ~exists().where(ProjectState.specification_id == Specification.id)
+
+        if candidates is None:
+            result = await session.execute(delete(Specification).where(orphaned))
+            return result.rowcount
+
+        candidates = list(candidates)
+        n_deleted = 0
+        for i in range(0, len(candidates), BATCH_SIZE):
+            batch = candidates[i : i + BATCH_SIZE]
+            result = await session.execute(delete(Specification).where(Specification.id.in_(batch), orphaned))
+            n_deleted += result.rowcount
+        return n_deleted
@@ -0,0 +1,99 @@
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+# Log a warning if getting a connection from the pool takes longer than this (in seconds)
+SLOW_CHECKOUT_THRESHOLD = 1.0
+
+
+class PoolMetrics:
+    """
+    Connection pool checkout metrics.
+
+    Tracks how many connections were checked out from the pool, and how
+    long the callers had to wait for them (including the time needed to
+    open a new connection if the pool wasn't full yet). Long or frequent
+    waits mean the pool is too small for the workload; timeouts mean
+    it's exhausted.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the metrics.
+        """
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float, timed_out: bool = False):
+        """
+        Record a single checkout attempt.
+
+        :param wait: Time spent waiting for the connection, in seconds.
+        :param timed_out: Whether the attempt failed because the pool was exhausted.
+        """
+        if timed_out:
+            self.timeouts += 1
+        else:
+            self.checkouts += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> dict:
+        """
+        Return the pool metrics.
+        """
+        attempts = self.checkouts + self.timeouts
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "total_wait": self.total_wait,
+            "max_wait": self.max_wait,
+            "avg_wait": self.total_wait / attempts if attempts else 0.0,
+        }
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that records checkout wait times in `metrics`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        start = time.monotonic()
+        try:
+            conn = super().connect()
+        except exc.TimeoutError as err:
+            self.metrics.record(time.monotonic() - start, timed_out=True)
+            log.warning(f"Timed out waiting for a database connection: {err}")
+            raise
+
+        wait = time.monotonic() - start
+        self.metrics.record(wait)
+        if wait > SLOW_CHECKOUT_THRESHOLD:
+            log.warning(
+                f"Waited {wait:.3f}s for a database connection "
+                f"(pool size {self.size()}, overflow {self.overflow()}, checked out {self.checkedout()})"
+            )
+        return conn
+
+    def recreate(self) -> "MeteredQueuePool":
+        # Keep the metrics when the pool is recreated (eg. on engine dispose)
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+__all__ = ["PoolMetrics", "MeteredQueuePool"]
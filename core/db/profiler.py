@@ -0,0 +1,177 @@
+import random
+import re
+from functools import lru_cache
+from typing import Optional
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+# Number of execution times kept per statement for computing the percentiles
+MAX_SAMPLES = 1000
+
+# Maximum length of the statement shown in the report
+MAX_STATEMENT_LENGTH = 200
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"\$\d+")
+_IN_LIST_RE = re.compile(r"\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LIST_RE = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """
+    Normalize an SQL statement so that the statements differing only in
+    parameters (literal values, number of items in IN lists, number of rows
+    in multi-row inserts) map to the same string.
+
+    :param statement: SQL statement as sent to the database.
+    :return: Statement fingerprint.
+    """
+    statement = _WHITESPACE_RE.sub(" ", statement).strip()
+    statement = _STRING_RE.sub("?", statement)
+    statement = _PARAM_RE.sub("?", statement)
+    statement = _NUMBER_RE.sub("?", statement)
+    statement = _IN_LIST_RE.sub("IN (?, ...)", statement)
+    statement = _VALUES_LIST_RE.sub(r"\1, ...", statement)
+    return statement
+
+
+class StatementStats:
+    """
+    Execution statistics of a single statement fingerprint.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.samples = []
+
+    def record(self, elapsed: float, rows: int):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.rows += rows
+
+        # Reservoir sampling keeps the percentiles representative without storing every execution
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            i = random.randrange(self.count)
+            if i < MAX_SAMPLES:
+                self.samples[i] = elapsed
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+class QueryProfiler:
+    """
+    Aggregating SQL statement profiler.
+
+    When enabled, records the execution time and the number of rows of
+    every SQL statement, grouped by the statement fingerprint (see
+    `fingerprint()`), so it's easy to see which queries dominate the
+    database time. The profiler can be enabled and disabled at any time.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """
+        Clear the collected statistics.
+        """
+        self.statements: dict[str, StatementStats] = {}
+
+    def record(self, statement: str, elapsed: float, rows: int = 0):
+        """
+        Record a statement execution.
+
+        :param statement: SQL statement as sent to the database.
+        :param elapsed: Execution time, in seconds.
+        :param rows: Number of rows returned or affected.
+        """
+        key = fingerprint(statement)
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = self.statements[key] = StatementStats()
+        stats.record(elapsed, rows)
+
+    def stats(self, top: Optional[int] = None) -> list[dict]:
+        """
+        Return the statement statistics, ordered by total execution time.
+
+        :param top: Only return this many statements (default: all).
+        :return: List of per-statement statistics (times are in seconds).
+        """
+        result = [
+            {
+                "statement": statement,
+                "count": s.count,
+                "total_time": s.total_time,
+                "p50": s.percentile(0.5),
+                "p95": s.percentile(0.95),
+                "max_time": s.max_time,
+                "rows": s.rows,
+            }
+            for statement, s in self.statements.items()
+        ]
+        result.sort(key=lambda s: s["total_time"], reverse=True)
+        return result[:top] if top else result
+
+    def report(self, top: int = 20) -> str:
+        """
+        Format the statistics of the `top` statements as a table.
+
+        :param top: Number of statements to include.
+        :return: The report.
+        """
+        stats = self.stats()
+        total_time = sum(s["total_time"] for s in stats)
+        total_count = sum(s["count"] for s in stats)
+        lines = [
+            f"{total_count} SQL statements ({len(stats)} distinct) in {total_time * 1000:.1f}ms",
+            f"{'count':>7} {'total ms':>10} {'%':>5} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'rows':>8}  statement",
+        ]
+        for s in stats[:top]:
+            statement = s["statement"]
+            if len(statement) > MAX_STATEMENT_LENGTH:
+                statement = statement[: MAX_STATEMENT_LENGTH - 3] + "..."
+            share = 100 * s["total_time"] / total_time if total_time else 0.0
+            lines.append(
+                f"{s['count']:>7} {s['total_time'] * 1000:>10.1f} {share:>5.1f} {s['p50'] * 1000:>8.2f} "
+                f"{s['p95'] * 1000:>8.2f} {s['max_time'] * 1000:>8.2f} {s['rows']:>8}  {statement}"
+            )
+        return "\n".join(lines)
+
+    def log_report(self, top: int = 20, reset: bool = False):
+        """
+        Log the report, if any statements were recorded.
+
+        :param top: Number of statements to include.
+        :param reset: Clear the statistics after logging them.
+        """
+        if not self.statements:
+            return
+        log.info(f"SQL profile:\n{self.report(top)}")
+        if reset:
+            self.reset()
+
+
+__all__ = ["QueryProfiler", "fingerprint"]
@@ -1,13 +1,24 @@
 import time
+from typing import Optional
 
 from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
 
 from core.config import DBConfig
+from core.db.content_cache import content_cache
+from core.db.pool import MeteredQueuePool
+from core.db.profiler import QueryProfiler
 from core.log import get_logger
 
 log = get_logger(__name__)
 
+# DB-API `rowcount` is -1 for SELECTs (and INSERTs with RETURNING), so the profiler
+# counts the rows in the buffer the SQLAlchemy async driver adapters (aiosqlite and
+# asyncpg cursors) fetch the results into. This is a private attribute of the
+# adapters; the tests check that it's still there after upgrading SQLAlchemy.
+ADAPTER_ROWS_ATTR = "_rows"
+
 
 class SessionManager:
     """
@@ -27,37 +38,96 @@ class SessionManager:
         :param config: Database configuration.
         """
         self.config = config
+
+        engine_args = {}
+        if config.url.startswith("sqlite"):
+            if config.sqlite.persistent_connection:
+                # With a single connection, the PRAGMAs are set only once, and there's no reconnect
+                # after each commit. The session manager only uses one session at a time anyway.
+                engine_args["poolclass"] = StaticPool
+        elif config.url.startswith("postgresql"):
+            pg = config.postgres
+            engine_args.update(
+                poolclass=MeteredQueuePool,
+                pool_size=pg.pool_size,
+                max_overflow=pg.max_overflow,
+                pool_timeout=pg.pool_timeout,
+                pool_recycle=pg.pool_recycle,
+                pool_pre_ping=pg.pool_pre_ping,
+                connect_args={
+                    # asyncpg's own statement cache and SQLAlchemy's prepared statement cache
+                    # both need to be disabled when connecting through pgbouncer
+                    "statement_cache_size": pg.statement_cache_size,
+                    "prepared_statement_cache_size": pg.statement_cache_size,
+                },
+            )
+
         self.engine = create_async_engine(
-            self.config.url, echo=config.debug_sql, echo_pool="debug" if config.debug_sql else None
+            self.config.url,
+            echo=config.debug_sql,
+            echo_pool="debug" if config.debug_sql else None,
+            **engine_args,
         )
         self.SessionClass = async_sessionmaker(self.engine, expire_on_commit=False)
         self.session = None
         self.recursion_depth = 0
+        self.profiler = QueryProfiler(enabled=config.profiler.enabled)
+        content_cache.resize(config.content_cache_size)
 
         event.listen(self.engine.sync_engine, "connect", self._on_connect)
         event.listen(self.engine.sync_engine, "before_cursor_execute", self.before_cursor_execute)
         event.listen(self.engine.sync_engine, "after_cursor_execute", self.after_cursor_execute)
 
     def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
-        conn.info.setdefault("query_start_time", []).append(time.time())
-        log.debug(f"Executing SQL: {statement}")
+        if self.profiler.enabled:
+            conn.info.setdefault("query_start_time", []).append(time.perf_counter())
 
     def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
-        total = time.time() - conn.info["query_start_time"].pop(-1)
-        log.debug(f"SQL execution time: {total:.3f} seconds")
+        start_times = conn.info.get("query_start_time")
+        if not start_times:
+            # The profiler was not enabled when the statement was started
+            return
+        elapsed = time.perf_counter() - start_times.pop()
+        if not self.profiler.enabled:
+            return
+
+        rows = cursor.rowcount
+        if rows < 0:
+            rows = len(getattr(cursor, ADAPTER_ROWS_ATTR, None) or ())
+        self.profiler.record(statement, elapsed, rows)
 
     def _on_connect(self, dbapi_connection, _):
         """Connection event handler"""
         log.debug(f"Connected to database {self.config.url}")
 
         if self.config.url.startswith("sqlite"):
-            # Note that SQLite uses NullPool by default, meaning every session creates a
-            # database "connection". This is fine and preferred for SQLite because
-            # it's a local file. PostgreSQL or other database use a real connection pool
-            # by default.
             dbapi_connection.execute("pragma foreign_keys=on")
             dbapi_connection.execute("PRAGMA journal_mode=WAL;")
 
+            sqlite = self.config.sqlite
+            dbapi_connection.execute(f"PRAGMA synchronous={sqlite.synchronous}")
+            dbapi_connection.execute(f"PRAGMA cache_size={sqlite.cache_size}")
+            dbapi_connection.execute(f"PRAGMA mmap_size={sqlite.mmap_size}")
+            dbapi_connection.execute(f"PRAGMA temp_store={sqlite.temp_store}")
+            dbapi_connection.execute(f"PRAGMA busy_timeout={sqlite.busy_timeout}")
+
+    def pool_stats(self) -> Optional[dict]:
+        """
+        Return the connection pool checkout metrics, if available.
+
+        Only the PostgreSQL connection pool is metered.
+        """
+        pool = self.engine.pool
+        if not isinstance(pool, MeteredQueuePool):
+            return None
+
+        return {
+            **pool.metrics.stats(),
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+
     async def start(self) -> AsyncSession:
         if self.session is not None:
             self.recursion_depth += 1
@@ -78,6 +148,16 @@ class SessionManager:
         await self.session.close()
         self.session = None
 
+        if self.profiler.enabled and self.config.profiler.report == "session":
+            self.profiler.log_report(self.config.profiler.top, reset=True)
+
+    def log_profile(self):
+        """
+        Log the SQL profiler report, if the profiler is enabled.
+        """
+        if self.profiler.enabled:
+            self.profiler.log_report(self.config.profiler.top)
+
     async def __aenter__(self) -> AsyncSession:
         return await self.start()
 
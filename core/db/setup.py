@@ -1,13 +1,21 @@
-from os.path import dirname, join
+import sqlite3
+from contextlib import closing
+from os.path import dirname, isfile, join
+from pathlib import Path
+from typing import Optional
 
-from alembic import command
-from alembic.config import Config
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.pool import NullPool
 
 from core.config import DBConfig
 from core.log import get_logger
 
 log = get_logger(__name__)
 
+# Latest Alembic revision in core/db/migrations/versions. Update this when adding
+# a migration (the test suite checks that it matches the migration scripts).
+HEAD_REVISION = "bbd799d9fe64"
+
 
 def _async_to_sync_db_scheme(url: str) -> str:
     """
@@ -26,6 +34,41 @@ def _async_to_sync_db_scheme(url: str) -> str:
     return url
 
 
+def get_schema_revision(url: str) -> Optional[str]:
+    """
+    Get the Alembic revision the database schema is at.
+
+    This reads the revision stored by Alembic with a single query,
+    without loading Alembic itself.
+
+    :param url: Synchronous database URL.
+    :return: The revision, or None if the database doesn't exist or isn't initialized.
+    """
+    db_url = make_url(url)
+    try:
+        if db_url.get_backend_name() == "sqlite":
+            path = db_url.database
+            if not path or path == ":memory:" or not isfile(path):
+                return None
+            # The path must be quoted, as it may contain characters like "#" or "%"
+            uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+            # The connection context manager only ends the transaction, it doesn't close the connection
+            with closing(sqlite3.connect(uri, uri=True)) as conn:
+                row = conn.execute("SELECT version_num FROM alembic_version").fetchone()
+        else:
+            engine = create_engine(db_url, poolclass=NullPool)
+            try:
+                with engine.connect() as conn:
+                    row = conn.execute(text("SELECT version_num FROM alembic_version")).fetchone()
+            finally:
+                engine.dispose()
+    except Exception as err:  # noqa
+        log.debug(f"Unable to read database schema revision: {err}")
+        return None
+
+    return row[0] if row else None
+
+
 def run_migrations(config: DBConfig):
     """
     Run database migrations using Alembic.
@@ -33,9 +76,20 @@ def run_migrations(config: DBConfig):
     This needs to happen synchronously, before the asyncio
     mainloop is started, and before any database access.
 
+    If the database schema is already up to date, Alembic isn't
+    loaded at all, which makes startup noticeably faster.
+
     :param config: Database configuration.
     """
     url = _async_to_sync_db_scheme(config.url)
+
+    if get_schema_revision(url) == HEAD_REVISION:
+        log.debug(f"Database schema is up to date (revision {HEAD_REVISION})")
+        return
+
+    from alembic import command
+    from alembic.config import Config
+
     ini_location = join(dirname(__file__), "alembic.ini")
 
     log.debug(f"Running database migrations for {url} (config: {ini_location})")
@@ -46,4 +100,4 @@ def run_migrations(config: DBConfig):
     command.upgrade(alembic_cfg, "head")
 
 
-__all__ = ["run_migrations"]
+__all__ = ["get_schema_revision", "run_migrations"]
@@ -1,6 +1,165 @@
 import os.path
-from fnmatch import fnmatch
-from typing import Optional
+import re
+import stat
+import time
+from fnmatch import translate
+from functools import partial
+from typing import Callable, Optional
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+# Windows file names are case insensitive
+_FLAGS = re.IGNORECASE if os.name == "nt" else 0
+
+# How often (in seconds) to check whether the .gitignore files were changed
+GITIGNORE_CHECK_INTERVAL = 1.0
+
+# How many bytes to read from the start of a file to check whether it's binary
+BINARY_CHECK_SIZE = 8 * 1024
+
+
+def _normalize(path: str) -> str:
+    # We use "/" internally on all platforms, including win32
+    return path.replace(os.sep, "/") if os.sep != "/" else path
+
+
+def _compile(regexes: list[str]) -> Optional[re.Pattern]:
+    if not regexes:
+        return None
+    return re.compile("|".join(f"(?:{r})" for r in regexes), _FLAGS)
+
+
+def _translate_gitignore_glob(pattern: str) -> str:
+    """
+    Translate a gitignore-style glob to a regular expression.
+
+    In contrast to `fnmatch`, "*" and "?" don't match "/", and "**"
+    matches any number of directories.
+    """
+    result = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            result.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            result.append(".*")
+            i += 2
+        elif c == "*":
+            result.append("[^/]*")
+            i += 1
+        elif c == "?":
+            result.append("[^/]")
+            i += 1
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end < 0:
+                result.append(re.escape(c))
+                i += 1
+                continue
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            result.append(f"[{body}]")
+            i = end + 1
+        elif c == "\\" and i + 1 < n:
+            result.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            result.append(re.escape(c))
+            i += 1
+    return "".join(result)
+
+
+class GitignoreRules:
+    """
+    Compiled rules from a single `.gitignore` file.
+
+    The rules are applied to paths relative to the directory containing
+    the `.gitignore` file, with the usual semantics: patterns containing
+    a "/" (other than at the end) are anchored to that directory, patterns
+    ending with "/" only match directories, "**" matches any number of
+    directories, and "!" re-includes previously ignored paths. As in git,
+    the last matching pattern wins. Runs of consecutive patterns of the
+    same kind are compiled into a single regular expression.
+    """
+
+    def __init__(self, lines: list[str], base: str = ""):
+        """
+        Compile the rules.
+
+        :param lines: Lines of the `.gitignore` file.
+        :param base: Directory containing the `.gitignore` file, relative to project root ("" for the root).
+        """
+        prefix = re.escape(base + "/") if base else ""
+        # List of (negated, regex matching any path, regex matching directories only)
+        self.blocks: list[tuple[bool, Optional[re.Pattern], Optional[re.Pattern]]] = []
+
+        negated_block = None
+        any_regexes, dir_regexes = [], []
+        for line in lines:
+            parsed = self._parse(line)
+            if parsed is None:
+                continue
+            negated, dir_only, regex = parsed
+            if negated != negated_block and (any_regexes or dir_regexes):
+                self.blocks.append((negated_block, _compile(any_regexes), _compile(dir_regexes)))
+                any_regexes, dir_regexes = [], []
+            negated_block = negated
+
+            # Paths inside an ignored directory are ignored as well
+            if dir_only:
+                dir_regexes.append(f"{prefix}{regex}\\Z")
+                any_regexes.append(f"{prefix}{regex}/")
+            else:
+                any_regexes.append(f"{prefix}{regex}(?:/|\\Z)")
+
+        if any_regexes or dir_regexes:
+            self.blocks.append((negated_block, _compile(any_regexes), _compile(dir_regexes)))
+
+    @staticmethod
+    def _parse(line: str) -> Optional[tuple[bool, bool, str]]:
+        line = line.rstrip("\n\r")
+        # Trailing spaces are ignored unless escaped
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        line = stripped
+        if not line or line.startswith("#"):
+            return None
+
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+
+        if "/" in line:
+            regex = _translate_gitignore_glob(line.lstrip("/"))
+        else:
+            regex = "(?:.*/)?" + _translate_gitignore_glob(line)
+        return negated, dir_only, regex
+
+    def match(self, path: str, is_dir: Callable[[], bool]) -> Optional[bool]:
+        """
+        Match the path against the rules.
+
+        :param path: Path relative to project root, using "/" as separator.
+        :param is_dir: Function returning whether the path is a directory.
+        :return: True if ignored, False if explicitly re-included, None if no rule matches.
+        """
+        for negated, any_regex, dir_regex in reversed(self.blocks):
+            if (any_regex and any_regex.match(path)) or (dir_regex and dir_regex.match(path) and is_dir()):
+                return not negated
+        return None
 
 
 class IgnoreMatcher:
@@ -15,6 +174,7 @@ class IgnoreMatcher:
         ignore_paths: list[str],
         *,
         ignore_size_threshold: Optional[int] = None,
+        use_gitignore: bool = False,
     ):
         """
         Initialize the IgnoreMatcher object.
@@ -22,26 +182,65 @@ class IgnoreMatcher:
         Ignore paths are matched agains the file name and the full path,
         and may include shell-like wildcards ("*" for any number of characters,
         "?" for a single character). Paths are normalized, so "/" works on both
-        Unix and Windows, and Windows matching is case insensitive.
+        Unix and Windows, and Windows matching is case insensitive. Patterns
+        starting with "/" only match the full path (relative to the root), and
+        patterns ending with "/" only match directories.
+
+        All the patterns are compiled into a single regular expression.
 
         :param root_path: Root path to use when checking files on disk.
         :param ignore_paths: List of patterns to ignore.
         :param ignore_size_threshold: Files larger than this size will be ignored.
+        :param use_gitignore: Also ignore files matched by the `.gitignore` files in the project.
         """
         self.root_path = root_path
         self.ignore_paths = ignore_paths
         self.ignore_size_threshold = ignore_size_threshold
+        self.use_gitignore = use_gitignore
+        # Directory (relative to root) -> (last checked, .gitignore mtime and size, rules)
+        self.gitignores: dict[str, tuple[float, Optional[tuple[int, int]], Optional[GitignoreRules]]] = {}
+        # File path (relative to root) -> (mtime and size, whether the file is binary)
+        self.binary_files: dict[str, tuple[tuple[int, int], bool]] = {}
+
+        name_regexes, path_regexes, dir_name_regexes, dir_path_regexes = [], [], [], []
+        for pattern in ignore_paths:
+            pattern = _normalize(pattern)
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            if pattern.startswith("/"):
+                regex = translate(pattern.lstrip("/"))
+                (dir_path_regexes if dir_only else path_regexes).append(regex)
+            else:
+                regex = translate(pattern)
+                (dir_name_regexes if dir_only else name_regexes).append(regex)
+                (dir_path_regexes if dir_only else path_regexes).append(regex)
 
-    def ignore(self, path: str) -> bool:
+        self._name_re = _compile(name_regexes)
+        self._path_re = _compile(path_regexes)
+        self._dir_name_re = _compile(dir_name_regexes)
+        self._dir_path_re = _compile(dir_path_regexes)
+
+    def ignore(self, path: str, st: Optional[os.stat_result] = None) -> bool:
         """
         Check if the given path matches any of the ignore patterns.
 
+        If the stat information of the path is already known (eg. from
+        `os.scandir()`), it's used instead of querying the file system,
+        and the binary check result is cached until the file modification
+        time or size changes.
+
         :param path: (Relative) path to the file or directory to check
+        :param st: Stat information of the path (following symlinks), if known.
         :return: True if the path matches any of the ignore patterns, False otherwise
         """
 
         full_path = os.path.normpath(os.path.join(self.root_path, path))
 
+        if st is not None:
+            return self._ignore_with_stat(path, full_path, st)
+
         if self._is_in_ignore_list(path):
             return True
 
@@ -54,21 +253,126 @@ class IgnoreMatcher:
 
         return False
 
-    def _is_in_ignore_list(self, path: str) -> bool:
+    def _ignore_with_stat(self, path: str, full_path: str, st: os.stat_result) -> bool:
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if self._is_in_ignore_list(path, lambda: is_dir):
+            return True
+
+        # We don't handle directories here
+        if is_dir:
+            return False
+
+        # Same as in `_is_large_file()` and `_is_binary()`
+        if not stat.S_ISREG(st.st_mode):
+            return True
+
+        if self.ignore_size_threshold is not None and st.st_size > self.ignore_size_threshold:
+            return True
+
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self.binary_files.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        binary = self._is_binary(full_path, check_type=False)
+        self.binary_files[path] = (key, binary)
+        return binary
+
+    def mark_binary(self, path: str):
+        """
+        Mark the file as binary, so it's ignored until it changes.
+
+        Only the start of the file is checked in `ignore()`, so this is
+        used for files found to be binary when they're actually read.
+
+        :param path: (Relative) path to the file.
+        """
+        try:
+            st = os.stat(os.path.join(self.root_path, path))
+        except OSError:
+            return
+        self.binary_files[path] = ((st.st_mtime_ns, st.st_size), True)
+
+    def _is_in_ignore_list(self, path: str, is_dir: Optional[Callable[[], bool]] = None) -> bool:
         """
         Check if the given path matches any of the ignore patterns.
 
         Both the (relative) file path and the file (base) name are matched.
 
         :param path: The path to the file or directory to check
+        :param is_dir: Function returning whether the path is a directory (default: check on disk).
         :return: True if the path matches any of the ignore patterns, False otherwise.
         """
-        name = os.path.basename(path)
-        for pattern in self.ignore_paths:
-            if fnmatch(name, pattern) or fnmatch(path, pattern):
+        path = _normalize(path)
+        name = path.rpartition("/")[2]
+        if (self._name_re and self._name_re.match(name)) or (self._path_re and self._path_re.match(path)):
+            return True
+
+        if is_dir is None:
+            is_dir = partial(os.path.isdir, os.path.join(self.root_path, path))
+
+        if self._dir_name_re or self._dir_path_re:
+            if (
+                (self._dir_name_re and self._dir_name_re.match(name))
+                or (self._dir_path_re and self._dir_path_re.match(path))
+            ) and is_dir():
                 return True
+
+        if self.use_gitignore:
+            return self._is_ignored_by_gitignore(path, is_dir)
+
         return False
 
+    def _is_ignored_by_gitignore(self, path: str, is_dir: Callable[[], bool]) -> bool:
+        """
+        Check the path against the `.gitignore` files in its parent directories.
+
+        The rules in deeper directories take precedence.
+        """
+        parts = path.split("/")
+        for depth in range(len(parts) - 1, -1, -1):
+            base = "/".join(parts[:depth])
+            rules = self._get_gitignore_rules(base)
+            if rules is None:
+                continue
+            result = rules.match(path, is_dir)
+            if result is not None:
+                return result
+        return False
+
+    def _get_gitignore_rules(self, base: str) -> Optional[GitignoreRules]:
+        """
+        Get the (cached) rules from the `.gitignore` file in the directory.
+
+        The file is reloaded if it was changed since it was last read (this is
+        checked at most every `GITIGNORE_CHECK_INTERVAL` seconds).
+        """
+        now = time.monotonic()
+        cached = self.gitignores.get(base)
+        if cached and now - cached[0] < GITIGNORE_CHECK_INTERVAL:
+            return cached[2]
+
+        gitignore_path = os.path.join(self.root_path, base, ".gitignore")
+        try:
+            st = os.stat(gitignore_path)
+            key = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = None
+
+        if cached and cached[1] == key:
+            self.gitignores[base] = (now, key, cached[2])
+            return cached[2]
+
+        rules = None
+        if key is not None:
+            try:
+                with open(gitignore_path, "r", encoding="utf-8") as f:
+                    rules = GitignoreRules(f.readlines(), base)
+            except (OSError, UnicodeDecodeError) as err:
+                log.warning(f"Can't read {gitignore_path}: {err}")
+        self.gitignores[base] = (now, key, rules)
+        return rules
+
     def _is_large_file(self, full_path: str) -> bool:
         """
         Check if the given file is larger than the threshold.
@@ -94,27 +398,40 @@ class IgnoreMatcher:
         except:  # noqa
             return True
 
-    def _is_binary(self, full_path: str) -> bool:
+    def _is_binary(self, full_path: str, check_type: bool = True) -> bool:
         """
         Check if the given file is binary and should be ignored.
 
+        Like git, only the first `BINARY_CHECK_SIZE` bytes are checked: the
+        file is binary if they contain a null byte or are not valid UTF-8.
+
         This also returns True if the file doesn't or is not a regular file (eg.
         it's a symlink), or can't be opened, since we want to ignore those too.
 
         :param path: Full path to the file to check.
+        :param check_type: Check that the file is a regular file (skip if already known).
         :return: True if the file should be ignored, False otherwise.
         """
 
-        # We don't handle directories here
-        if os.path.isdir(full_path):
-            return False
+        if check_type:
+            # We don't handle directories here
+            if os.path.isdir(full_path):
+                return False
 
-        if not os.path.isfile(full_path):
-            return True
+            if not os.path.isfile(full_path):
+                return True
 
         try:
-            with open(full_path, "r", encoding="utf-8") as f:
-                f.read(128 * 1024)
+            with open(full_path, "rb") as f:
+                data = f.read(BINARY_CHECK_SIZE)
+            if b"\0" in data:
+                return True
+            try:
+                data.decode("utf-8")
+            except UnicodeDecodeError as err:
+                # The check size may cut a multi-byte character in half
+                if len(data) < BINARY_CHECK_SIZE or err.start < len(data) - 3 or err.reason != "unexpected end of data":
+                    return True
             return False
         except:  # noqa
             # If we can't open the file for any reason (eg. PermissionError), it's
@@ -122,4 +439,4 @@ class IgnoreMatcher:
             return True
 
 
-__all__ = ["IgnoreMatcher"]
+__all__ = ["GitignoreRules", "IgnoreMatcher"]
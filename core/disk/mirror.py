@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from core.disk.stat_cache import RACY_INTERVAL_NS
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+
+class MemoryMirror:
+    """
+    In-memory cache of file contents, keyed by path and validated by the file stat information.
+
+    A cached content is returned only if the file modification and change
+    times, size and inode are the same as when it was cached, so changes
+    made outside Pythagora are picked up. Files saved through the VFS are
+    cached as they are written (write-through). Like in `StatCache`, files
+    modified too recently are not cached, as another change within the
+    same timestamp tick wouldn't change the stat information.
+
+    The total size of the cached contents (in characters) is capped at
+    `max_size`: the least recently used files are evicted first, and
+    files larger than `max_file_size` are not cached at all.
+
+    The cache is thread-safe, as it's used from the I/O thread pool by
+    the async VFS methods.
+
+    Usage:
+
+    >>> mirror = MemoryMirror(max_size=64 * 1024 * 1024)
+    >>> st = os.stat("/path/to/project/file.txt")
+    >>> mirror.get("file.txt", st)  # None if not cached or changed
+    >>> mirror.put("file.txt", st, "content")
+    """
+
+    def __init__(self, max_size: int, max_file_size: Optional[int] = None):
+        """
+        Create the mirror.
+
+        :param max_size: Maximum total size of the cached contents, in characters.
+        :param max_file_size: Maximum size of a single cached file (default: 1/8 of `max_size`).
+        """
+        self.max_size = max_size
+        self.max_file_size = max_file_size if max_file_size is not None else max_size // 8
+        self.entries: OrderedDict[str, tuple[tuple[int, int, int, int], str]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the hit/miss metrics.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Fraction of the lookups served from memory (0 if there were no lookups).
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.entries)} files, {self.size} chars, {self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate:.0%} hit rate), {self.evictions} evictions"
+        )
+
+    @staticmethod
+    def _key(st: os.stat_result) -> tuple[int, int, int, int]:
+        return st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino
+
+    def get(self, path: str, st: os.stat_result) -> Optional[str]:
+        """
+        Get the cached content of the file, if the file hasn't changed.
+
+        :param path: Path to the file, relative to project root.
+        :param st: Current stat information of the file.
+        :return: The file content, or None if not cached or the file changed.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != self._key(st):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path: str, st: os.stat_result, content: str):
+        """
+        Cache the file content.
+
+        :param path: Path to the file, relative to project root.
+        :param st: Stat information of the file, taken before it was read (or after it was written).
+        :param content: File content.
+        """
+        with self.lock:
+            self._remove(path)
+            if len(content) > self.max_file_size or time.time_ns() - st.st_mtime_ns < RACY_INTERVAL_NS:
+                return
+
+            self.entries[path] = (self._key(st), content)
+            self.size += len(content)
+            while self.size > self.max_size:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def _remove(self, path: str):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def remove(self, path: str):
+        """
+        Remove the file from the cache.
+
+        :param path: Path to the file, relative to project root.
+        """
+        with self.lock:
+            self._remove(path)
+
+    def retain(self, paths: list[str]):
+        """
+        Remove the files not in `paths` from the cache.
+
+        :param paths: Paths of the existing files.
+        """
+        with self.lock:
+            for path in self.entries.keys() - set(paths):
+                self._remove(path)
+
+
+__all__ = ["MemoryMirror"]
@@ -0,0 +1,206 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+import sys
+from typing import Iterable, Optional
+from uuid import uuid4
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+# ioctl request for cloning a file (reflink), from <linux/fs.h>
+FICLONE = 0x40049409
+
+# Errors meaning the file system (or the pair of file systems) doesn't support reflinks
+_NO_REFLINK_ERRORS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+
+
+def _stat_key(st: os.stat_result) -> tuple[int, int, int, int]:
+    return st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino
+
+
+def reflink(src: str, dst: str) -> bool:
+    """
+    Create `dst` as a copy-on-write clone (reflink) of `src`.
+
+    Cloning doesn't copy the file data, so it's instant regardless of
+    the file size. Supported on Linux (Btrfs, XFS, ...) and macOS (APFS).
+
+    :param src: Path to the existing file.
+    :param dst: Path to the new file (must not exist).
+    :return: True if cloned, False if reflinks are not supported.
+    :raises OSError: On other errors (eg. `src` doesn't exist).
+    """
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        with open(src, "rb") as src_file:
+            fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            try:
+                fcntl.ioctl(fd, FICLONE, src_file.fileno())
+                return True
+            except OSError as err:
+                os.close(fd)
+                fd = -1
+                os.remove(dst)
+                if err.errno not in _NO_REFLINK_ERRORS:
+                    raise
+                return False
+            finally:
+                if fd >= 0:
+                    os.close(fd)
+
+    if sys.platform == "darwin":
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "clonefile"):
+            return False
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+            return True
+        err = ctypes.get_errno()
+        if err in _NO_REFLINK_ERRORS:
+            return False
+        raise OSError(err, os.strerror(err), src)
+
+    return False
+
+
+class SnapshotStore:
+    """
+    Content-addressed store of the workspace files in the committed project states.
+
+    Each file content is stored once, under its content hash (the same as
+    `FileContent.id`), so a project state can be restored from the store
+    by its list of files and hashes, without reading the contents from
+    the database.
+
+    Files are added to and checked out of the store as reflinks where the
+    file system supports it, so neither takes extra space or copies data;
+    elsewhere, they're copied. Hard links are not used: files edited in
+    place (as many editors do) would change the stored content too.
+    """
+
+    def __init__(self, path: str):
+        """
+        Create the store.
+
+        :param path: Directory to keep the stored files in (created if needed).
+        """
+        self.path = path
+        self.use_reflinks = True
+        self._hashes: Optional[set[str]] = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the clone/copy metrics.
+        """
+        self.cloned = 0
+        self.copied = 0
+
+    def _get_path(self, hash: str) -> str:
+        return os.path.join(self.path, hash[:2], hash[2:])
+
+    @property
+    def hashes(self) -> set[str]:
+        """
+        Hashes of the stored contents (loaded from disk on first use).
+        """
+        if self._hashes is None:
+            hashes = set()
+            if os.path.isdir(self.path):
+                for prefix in os.scandir(self.path):
+                    if not prefix.is_dir() or len(prefix.name) != 2:
+                        continue
+                    for entry in os.scandir(prefix.path):
+                        # Skip the temporary files of interrupted writes
+                        if "." not in entry.name:
+                            hashes.add(prefix.name + entry.name)
+            self._hashes = hashes
+        return self._hashes
+
+    def __contains__(self, hash: str) -> bool:
+        return hash in self.hashes
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def _copy(self, src: str, dst: str):
+        if self.use_reflinks:
+            if reflink(src, dst):
+                self.cloned += 1
+                return
+            log.debug(f"Reflinks not supported for {self.path}, copying files instead")
+            self.use_reflinks = False
+        shutil.copyfile(src, dst)
+        self.copied += 1
+
+    def add(self, hash: str, src: str, st: os.stat_result) -> bool:
+        """
+        Store the file content.
+
+        The file must not change while it's being stored: if its stat
+        information differs from `st` afterwards, it's not stored.
+
+        :param hash: Content hash of the file.
+        :param src: Full path to the file.
+        :param st: Stat information of the file when its hash was computed.
+        :return: True if the content is stored (now or already before), False otherwise.
+        """
+        if hash in self.hashes:
+            return True
+
+        obj_path = self._get_path(hash)
+        tmp_path = f"{obj_path}.{uuid4().hex[:8]}.tmp"
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        try:
+            self._copy(src, tmp_path)
+            if _stat_key(os.stat(src)) != _stat_key(st):
+                log.debug(f"File {src} changed while being stored, skipping")
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, obj_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self.hashes.add(hash)
+        return True
+
+    def checkout(self, hash: str, dst: str):
+        """
+        Create a file with the stored content.
+
+        :param hash: Content hash.
+        :param dst: Full path to the new file (must not exist).
+        :raises KeyError: If the content is not stored.
+        """
+        if hash not in self.hashes:
+            raise KeyError(hash)
+        self._copy(self._get_path(hash), dst)
+
+    def prune(self, keep: Iterable[str]) -> int:
+        """
+        Remove the stored contents that are no longer needed.
+
+        :param keep: Hashes of the contents to keep.
+        :return: Number of removed contents.
+        """
+        stale = self.hashes - set(keep)
+        for hash in stale:
+            try:
+                os.remove(self._get_path(hash))
+            except FileNotFoundError:
+                pass
+            self.hashes.discard(hash)
+        if stale:
+            log.debug(f"Removed {len(stale)} unused files from the snapshot store {self.path}")
+        return len(stale)
+
+
+__all__ = ["SnapshotStore", "reflink"]
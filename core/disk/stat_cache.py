@@ -0,0 +1,149 @@
+import json
+import os
+import time
+from typing import Optional
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+# Version of the cache file format; files with a different version are ignored
+CACHE_FORMAT = 1
+
+# Files modified this recently (in nanoseconds) are not cached: on file systems with
+# coarse timestamps, another change within the same tick would go unnoticed
+RACY_INTERVAL_NS = 2_000_000_000
+
+
+class StatCache:
+    """
+    Cache of file content hashes, keyed by the file stat information.
+
+    A file whose modification time, size and inode haven't changed since
+    it was last hashed is assumed to have the same content, so it doesn't
+    need to be read again to tell whether it changed.
+
+    The cache is kept in memory and (if `path` is set) persisted to a JSON
+    file with `save()`, so it survives restarts.
+
+    Usage:
+
+    >>> cache = StatCache("/path/to/cache.json")
+    >>> st = os.stat("/path/to/project/file.txt")
+    >>> cache.get("file.txt", st)  # None if unknown or changed
+    >>> cache.put("file.txt", st, "hash")
+    >>> cache.save()
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: dict[str, tuple[int, int, int, str]] = {}
+        self.dirty = False
+        self.reset_stats()
+        if path:
+            self.load()
+
+    def reset_stats(self):
+        """
+        Reset the hit/miss metrics.
+        """
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _key(st: os.stat_result) -> tuple[int, int, int]:
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def get(self, path: str, st: os.stat_result) -> Optional[str]:
+        """
+        Get the cached hash of the file, if the file hasn't changed.
+
+        :param path: Path to the file, relative to project root.
+        :param st: Current stat information of the file.
+        :return: The content hash, or None if not cached or the file changed.
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry[:3] != self._key(st):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[3]
+
+    def put(self, path: str, st: os.stat_result, hash: str):
+        """
+        Cache the hash of the file content.
+
+        :param path: Path to the file, relative to project root.
+        :param st: Stat information of the file, taken before it was read.
+        :param hash: Content hash.
+        """
+        if time.time_ns() - st.st_mtime_ns < RACY_INTERVAL_NS:
+            self.remove(path)
+            return
+        entry = (*self._key(st), hash)
+        if self.entries.get(path) != entry:
+            self.entries[path] = entry
+            self.dirty = True
+
+    def remove(self, path: str):
+        """
+        Remove the file from the cache.
+
+        :param path: Path to the file, relative to project root.
+        """
+        if self.entries.pop(path, None) is not None:
+            self.dirty = True
+
+    def retain(self, paths: list[str]):
+        """
+        Remove the files not in `paths` from the cache.
+
+        :param paths: Paths of the existing files.
+        """
+        stale = self.entries.keys() - set(paths)
+        for path in stale:
+            del self.entries[path]
+        if stale:
+            self.dirty = True
+
+    def load(self):
+        """
+        Load the cache from the cache file, if it exists.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("format") != CACHE_FORMAT:
+                raise ValueError(f"unsupported format {data.get('format')}")
+            self.entries = {path: tuple(entry) for path, entry in data["files"].items()}
+        except FileNotFoundError:
+            pass
+        except Exception as err:  # noqa
+            log.warning(f"Ignoring invalid file stat cache {self.path}: {err}")
+        self.dirty = False
+
+    def save(self):
+        """
+        Save the cache to the cache file, if it was changed.
+
+        The file is replaced atomically, so it's never left half-written.
+        """
+        if not self.path or not self.dirty:
+            return
+
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"format": CACHE_FORMAT, "files": self.entries}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            log.warning(f"Failed to save file stat cache {self.path}: {err}")
+            return
+        self.dirty = False
+        log.debug(f"Saved file stat cache ({len(self.entries)} files) to {self.path}")
+
+
+__all__ = ["StatCache"]
@@ -1,13 +1,46 @@
+import asyncio
 import os
 import os.path
+import posixpath
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from hashlib import sha1
-from pathlib import Path
+from typing import Any, Callable, Iterable, Optional, TypeVar, Union
+from uuid import uuid4
 
 from core.disk.ignore import IgnoreMatcher
+from core.disk.mirror import MemoryMirror
+from core.disk.snapshots import SnapshotStore
+from core.disk.stat_cache import StatCache
+from core.disk.watcher import WorkspaceWatcher, create_watcher
 from core.log import get_logger
 
 log = get_logger(__name__)
 
+T = TypeVar("T")
+
+# Maximum number of threads doing file I/O for the async methods
+IO_THREADS = 4
+
+# Number of files handled in a single thread pool task by the bulk async methods
+IO_CHUNK_SIZE = 32
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+
+# Suffix of the temporary files used to save files atomically (these are never listed)
+TEMP_SUFFIX = ".pythagora-tmp"
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """
+    Get the (shared) thread pool used for file I/O by the async VFS methods.
+    """
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="vfs-io")
+    return _io_executor
+
 
 class VirtualFileSystem:
     def save(self, path: str, content: str):
@@ -28,6 +61,15 @@ class VirtualFileSystem:
         """
         raise NotImplementedError()
 
+    def exists(self, path: str) -> bool:
+        """
+        Check whether the file exists (and is not ignored).
+
+        :param path: Path to the file, relative to project root.
+        :return: True if the file exists, False otherwise.
+        """
+        raise NotImplementedError()
+
     def remove(self, path: str):
         """
         Remove a file.
@@ -53,6 +95,107 @@ class VirtualFileSystem:
         """
         raise NotImplementedError()
 
+    def capture_snapshot(self, files: Iterable[tuple[str, str]]) -> int:
+        """
+        Store the files of a committed project state, if the file system keeps snapshots.
+
+        :param files: Pairs of path (relative to project root) and content hash.
+        :return: Number of newly stored files.
+        """
+        return 0
+
+    def restore_snapshot(self, files: Iterable[tuple[str, str]]) -> list[str]:
+        """
+        Restore the files from the snapshots, if the file system keeps them.
+
+        :param files: Pairs of path (relative to project root) and content hash.
+        :return: Paths of the files that were not restored (not in the snapshots).
+        """
+        return [path for path, _ in files]
+
+    async def run_io(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Run a blocking file system call without blocking the event loop.
+
+        The call is run in the shared I/O thread pool (see `get_io_executor()`).
+
+        :param func: Function to call.
+        :param args: Arguments to pass to the function.
+        :return: The function result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_io_executor(), partial(func, *args))
+
+    async def _run_io_many(self, func: Callable[..., Any], args_list: list[tuple], return_exceptions: bool) -> list:
+        def run_chunk(chunk: list[tuple]) -> list:
+            results = []
+            for args in chunk:
+                try:
+                    results.append(func(*args))
+                except Exception as err:  # noqa
+                    if not return_exceptions:
+                        raise
+                    results.append(err)
+            return results
+
+        chunks = [args_list[i : i + IO_CHUNK_SIZE] for i in range(0, len(args_list), IO_CHUNK_SIZE)]
+        results = await asyncio.gather(*(self.run_io(run_chunk, chunk) for chunk in chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    async def aread(self, path: str) -> str:
+        """
+        Read file contents without blocking the event loop (see `read()`).
+        """
+        return await self.run_io(self.read, path)
+
+    async def asave(self, path: str, content: str):
+        """
+        Save content to a file without blocking the event loop (see `save()`).
+        """
+        await self.run_io(self.save, path, content)
+
+    async def alist(self, prefix: str = None) -> list[str]:
+        """
+        List the files in the project without blocking the event loop (see `list()`).
+        """
+        return await self.run_io(self.list, prefix)
+
+    async def aread_many(self, paths: Iterable[str], return_exceptions: bool = False) -> list[Union[str, Exception]]:
+        """
+        Read the contents of multiple files, in parallel.
+
+        :param paths: Paths to the files, relative to project root.
+        :param return_exceptions: Return the errors (eg. `ValueError` for missing files)
+            in place of the file contents, instead of raising the first one.
+        :return: List of file contents, in the same order as the paths.
+        """
+        return await self._run_io_many(self.read, [(path,) for path in paths], return_exceptions)
+
+    async def asave_many(self, files: Iterable[tuple[str, str]]):
+        """
+        Save multiple files, in parallel.
+
+        :param files: Pairs of path (relative to project root) and content to save.
+        """
+        await self._run_io_many(self.save, list(files), False)
+
+    async def arestore_snapshot(self, files: Iterable[tuple[str, str]]) -> list[str]:
+        """
+        Restore the files from the snapshots, in parallel (see `restore_snapshot()`).
+        """
+        results = await self._run_io_many(lambda *file: self.restore_snapshot([file]), list(files), False)
+        return [path for not_restored in results for path in not_restored]
+
+    async def ahash_many(self, paths: Iterable[str], return_exceptions: bool = False) -> list[Union[str, Exception]]:
+        """
+        Get the content hashes of multiple files, in parallel (see `hash()`).
+
+        :param paths: Paths to the files, relative to project root.
+        :param return_exceptions: Return the errors in place of the hashes, instead of raising the first one.
+        :return: List of content hashes, in the same order as the paths.
+        """
+        return await self._run_io_many(self.hash, [(path,) for path in paths], return_exceptions)
+
     def _filter_by_prefix(self, file_list: list[str], prefix: str) -> list[str]:
         # We use "/" internally on all platforms, including win32
         if not prefix.endswith("/"):
@@ -77,9 +220,49 @@ class VirtualFileSystem:
         return retval
 
     def hash(self, path: str) -> str:
+        """
+        Get the hash of the file contents (see `hash_string()`).
+
+        Implementations may avoid reading the files that haven't changed
+        since they were last hashed.
+
+        :param path: Path to the file, relative to project root.
+        :return: Content hash.
+        """
         content = self.read(path)
         return self.hash_string(content)
 
+    def save_cache(self):
+        """
+        Persist the file hash cache, if the file system has one.
+        """
+        pass
+
+    def get_changed_paths(self) -> Optional[set[str]]:
+        """
+        Get the paths changed outside Pythagora since the last `mark_synced()`.
+
+        The paths may include removed files and directories, and ignored
+        files, so they should be checked with `exists()`.
+
+        :return: Set of changed paths, or None if unknown (the whole file system must be scanned).
+        """
+        return None
+
+    def mark_synced(self, paths: Optional[Iterable[str]] = None):
+        """
+        Mark the paths as synchronized with the project state.
+
+        :param paths: Paths returned by `get_changed_paths()`, or None if all files were synchronized.
+        """
+        pass
+
+    def close(self):
+        """
+        Release the resources held by the file system (eg. the watcher).
+        """
+        pass
+
     @staticmethod
     def hash_string(content: str) -> str:
         return sha1(content.encode("utf-8")).hexdigest()
@@ -100,6 +283,9 @@ class MemoryVFS(VirtualFileSystem):
         except KeyError:
             raise ValueError(f"File not found: {path}")
 
+    def exists(self, path: str) -> bool:
+        return path in self.files
+
     def remove(self, path: str):
         if path in self.files:
             del self.files[path]
@@ -108,6 +294,10 @@ class MemoryVFS(VirtualFileSystem):
         # We use "/" internally on all platforms, including win32
         return "/" + path
 
+    async def run_io(self, func: Callable[..., T], *args: Any) -> T:
+        # Nothing to wait for in memory
+        return func(*args)
+
     def _get_file_list(self) -> list[str]:
         return self.files.keys()
 
@@ -119,7 +309,27 @@ class LocalDiskVFS(VirtualFileSystem):
         create: bool = True,
         allow_existing: bool = True,
         ignore_matcher: IgnoreMatcher = None,
+        stat_cache_path: Optional[str] = None,
+        watch: bool = False,
+        mirror_size: int = 0,
+        snapshot_path: Optional[str] = None,
     ):
+        """
+        Create the local disk file system.
+
+        :param root: Project root directory.
+        :param create: Create the root directory if it doesn't exist.
+        :param allow_existing: Allow using an already-existing root directory.
+        :param ignore_matcher: Matcher for the files to ignore.
+        :param stat_cache_path: File to persist the file hashes to (see `StatCache`);
+            if not set, the hashes are only cached in memory.
+        :param watch: Watch the files for changes (see `WorkspaceWatcher`), so
+            `get_changed_paths()` can tell what changed without scanning all files.
+        :param mirror_size: Keep up to this many characters of file contents in memory
+            (see `MemoryMirror`), so unchanged files aren't read from disk again (0 to disable).
+        :param snapshot_path: Directory for the snapshots of the saved files (see `SnapshotStore`),
+            used to restore files without reading them from the database; if not set, snapshots are disabled.
+        """
         if not os.path.isdir(root):
             if create:
                 os.makedirs(root)
@@ -134,25 +344,215 @@ class LocalDiskVFS(VirtualFileSystem):
 
         self.root = root
         self.ignore_matcher = ignore_matcher
+        self.stat_cache = StatCache(stat_cache_path)
+        self.mirror = MemoryMirror(mirror_size) if mirror_size > 0 else None
+        self.snapshots = SnapshotStore(snapshot_path) if snapshot_path else None
+        self.watcher: Optional[WorkspaceWatcher] = None
+        if watch:
+            self.watcher = create_watcher(root, ignore_matcher, self._get_file_list)
 
     def get_full_path(self, path: str) -> str:
         return os.path.abspath(os.path.normpath(os.path.join(self.root, path)))
 
-    def save(self, path: str, content: str):
+    def _replace_file(self, path: str, create: Callable[[str], None]) -> tuple[str, os.stat_result]:
+        """
+        Atomically replace (or create) the file.
+
+        The new file is created at a temporary path that then replaces the
+        file, so the file is never left half-written (eg. if Pythagora is
+        killed during a restore). The file permissions are kept, and if the
+        file is a symlink, the link target is replaced.
+
+        :param path: Path to the file, relative to project root.
+        :param create: Function creating the new file at the given (full) temporary path.
+        :return: Tuple with the full path to the file and its new stat information.
+        """
         full_path = self.get_full_path(path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        if os.path.islink(full_path):
+            full_path = os.path.realpath(full_path)
+        dir_path, name = os.path.split(full_path)
+        os.makedirs(dir_path, exist_ok=True)
+        try:
+            mode = stat.S_IMODE(os.stat(full_path).st_mode)
+        except FileNotFoundError:
+            mode = None
+
+        tmp_path = os.path.join(dir_path, f".{name}.{uuid4().hex[:8]}{TEMP_SUFFIX}")
+        try:
+            create(tmp_path)
+            if mode is not None:
+                os.chmod(tmp_path, mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return full_path, os.stat(full_path)
+
+    def save(self, path: str, content: str):
+        """
+        Save content to a file.
+
+        The file is replaced atomically (see `_replace_file()`).
+
+        :param path: Path to the file, relative to project root.
+        :param content: Content to save.
+        """
+
+        def write(tmp_path: str):
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+            with open(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+
+        full_path, st = self._replace_file(path, write)
+        hash = self.hash_string(content)
+        self.stat_cache.put(path, st, hash)
+        if self.mirror is not None:
+            self.mirror.put(path, st, content)
+        if self.snapshots is not None:
+            self._add_to_snapshots(path, full_path, st, hash)
+        if self.watcher:
+            self.watcher.record_write(path)
         log.debug(f"Saved file {path} ({len(content)} bytes) to {full_path}")
 
     def read(self, path: str) -> str:
         full_path = self.get_full_path(path)
-        if not os.path.isfile(full_path):
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            raise ValueError(f"File not found: {path}")
+
+        if self.mirror is not None:
+            content = self.mirror.get(path, st)
+            if content is not None:
+                return content
+
+        try:
+            with open(full_path, "r", encoding="utf-8") as f:
+                content = f.read()
+        except UnicodeDecodeError as err:
+            # Only the start of the file is checked when listing, so make sure
+            # a binary file found here isn't listed again until it changes
+            self.ignore_matcher.mark_binary(path)
+            raise ValueError(f"File is not a valid UTF-8 text file: {path} ({err})")
+
+        if self.mirror is not None:
+            self.mirror.put(path, st, content)
+        return content
+
+    def hash(self, path: str) -> str:
+        """
+        Get the hash of the file contents.
+
+        If the file modification time, size and inode are the same as when
+        the file was last hashed, the cached hash is returned without
+        reading the file.
+
+        :param path: Path to the file, relative to project root.
+        :return: Content hash.
+        """
+        full_path = self.get_full_path(path)
+        try:
+            st = os.stat(full_path)
+        except OSError:
             raise ValueError(f"File not found: {path}")
 
-        # TODO: do we want error handling here?
-        with open(full_path, "r", encoding="utf-8") as f:
-            return f.read()
+        hash = self.stat_cache.get(path, st)
+        if hash is None:
+            hash = self.hash_string(self.read(path))
+            self.stat_cache.put(path, st, hash)
+        return hash
+
+    def save_cache(self):
+        self.stat_cache.save()
+
+    def _add_to_snapshots(self, path: str, full_path: str, st: os.stat_result, hash: str):
+        try:
+            self.snapshots.add(hash, full_path, st)
+        except OSError as err:
+            log.warning(f"Failed to add {path} to the snapshot store: {err}")
+
+    def capture_snapshot(self, files: Iterable[tuple[str, str]]) -> int:
+        # Files saved by Pythagora are stored as they're written, so this only
+        # stores the other ones (eg. imported files), if they haven't changed
+        if self.snapshots is None:
+            return 0
+
+        n_stored = 0
+        for path, hash in files:
+            if hash in self.snapshots:
+                continue
+            full_path = self.get_full_path(path)
+            try:
+                st = os.stat(full_path)
+                if self.hash(path) != hash:
+                    continue
+            except ValueError:
+                continue
+            self._add_to_snapshots(path, full_path, st, hash)
+            n_stored += hash in self.snapshots
+        return n_stored
+
+    def restore_snapshot(self, files: Iterable[tuple[str, str]]) -> list[str]:
+        # Files are replaced atomically, as with `save()`
+        if self.snapshots is None:
+            return [path for path, _ in files]
+
+        missing = []
+        for path, hash in files:
+            if hash not in self.snapshots:
+                missing.append(path)
+                continue
+            try:
+                _, st = self._replace_file(path, partial(self.snapshots.checkout, hash))
+            except (OSError, KeyError) as err:
+                log.warning(f"Failed to restore {path} from the snapshot store: {err}")
+                missing.append(path)
+                continue
+            self.stat_cache.put(path, st, hash)
+            if self.mirror is not None:
+                self.mirror.remove(path)
+            if self.watcher:
+                self.watcher.record_write(path)
+        return missing
+
+    def exists(self, path: str) -> bool:
+        if not os.path.isfile(self.get_full_path(path)):
+            return False
+
+        # Files in ignored directories are not listed either
+        parent = posixpath.dirname(path)
+        while parent:
+            if self.ignore_matcher.ignore(parent):
+                return False
+            parent = posixpath.dirname(parent)
+        return not self.ignore_matcher.ignore(path)
+
+    def get_changed_paths(self) -> Optional[set[str]]:
+        if self.watcher is None:
+            return None
+        changed = self.watcher.get_changed_paths()
+        if changed is None:
+            return None
+        # Temporary files created by `save()` are already gone
+        temp_paths = {path for path in changed if path.endswith(TEMP_SUFFIX)}
+        self.watcher.mark_synced(temp_paths)
+        return changed - temp_paths
+
+    def mark_synced(self, paths: Optional[Iterable[str]] = None):
+        if self.watcher:
+            self.watcher.mark_synced(paths)
+
+    def close(self):
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+        if self.mirror is not None:
+            log.debug(f"File content mirror for {self.root}: {self.mirror}")
 
     def remove(self, path: str):
         if self.ignore_matcher.ignore(path):
@@ -162,27 +562,194 @@ class LocalDiskVFS(VirtualFileSystem):
         if os.path.isfile(full_path):
             try:
                 os.remove(full_path)
+                self.stat_cache.remove(path)
+                if self.mirror is not None:
+                    self.mirror.remove(path)
+                if self.watcher:
+                    self.watcher.record_write(path)
                 log.debug(f"Removed file {path} from {full_path}")
             except Exception as err:  # noqa
                 log.error(f"Failed to remove file {path}: {err}", exc_info=True)
 
     def _get_file_list(self) -> list[str]:
+        # The stat info from os.scandir() is passed to the ignore matcher, which
+        # (on most platforms) saves a few system calls per file, and lets it
+        # cache the binary file check
         files = []
-        for dpath, dirnames, filenames in os.walk(self.root):
-            # Modify in place to prevent recursing into ignored directories
-            dirnames[:] = [
-                d
-                for d in dirnames
-                if not self.ignore_matcher.ignore(os.path.relpath(os.path.join(dpath, d), self.root))
-            ]
-
-            for filename in filenames:
-                path = os.path.relpath(os.path.join(dpath, filename), self.root)
-                if not self.ignore_matcher.ignore(path):
+        dirs = [""]
+        while dirs:
+            rel_dir = dirs.pop()
+            try:
+                entries = os.scandir(os.path.join(self.root, rel_dir))
+            except OSError as err:
+                log.warning(f"Can't list directory {rel_dir or self.root}: {err}")
+                continue
+
+            with entries:
+                for entry in entries:
                     # We use "/" internally on all platforms, including win32
-                    files.append(Path(path).as_posix())
+                    if entry.name.endswith(TEMP_SUFFIX):
+                        # File being saved (see `save()`)
+                        continue
+                    path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        # Don't recurse into symlinked directories
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self.ignore_matcher.ignore(path, entry.stat(follow_symlinks=False)):
+                                dirs.append(path)
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        # Broken symlink, or the file was removed in the meantime
+                        continue
+                    if stat.S_ISREG(st.st_mode) and not self.ignore_matcher.ignore(path, st):
+                        files.append(path)
+
+        # Forget the files that were removed
+        self.stat_cache.retain(files)
+        if self.mirror is not None:
+            self.mirror.retain(files)
+        return files
+
+
+class OverlayVFS(VirtualFileSystem):
+    """
+    Copy-on-write layer over another file system, keeping the changes in memory.
+
+    Files saved to or removed from the overlay are only staged: reads,
+    listings and hashes see the staged changes, while the base file system
+    (eg. `LocalDiskVFS`) is left untouched until `flush()`. An agent can
+    make speculative edits in its own overlay and review them from memory,
+    and a rejected attempt is dropped with `discard()` without any disk I/O.
+
+    Overlays are isolated from each other, and can be stacked (see
+    `overlay()`): flushing a nested overlay stages its changes in the parent.
+
+    Usage:
 
+    >>> overlay = OverlayVFS(file_system)
+    >>> overlay.save("main.py", "print('hello')")
+    >>> overlay.read("main.py")  # from memory
+    >>> overlay.flush()  # or overlay.discard()
+    """
+
+    def __init__(self, base: VirtualFileSystem):
+        """
+        Create the overlay.
+
+        :param base: File system to stage the changes over.
+        """
+        self.base = base
+        # Staged changes: path -> content, or None if removed
+        self.changes: dict[str, Optional[str]] = {}
+
+    def save(self, path: str, content: str):
+        self.changes[path] = content
+
+    def read(self, path: str) -> str:
+        if path not in self.changes:
+            return self.base.read(path)
+        content = self.changes[path]
+        if content is None:
+            raise ValueError(f"File not found: {path}")
+        return content
+
+    def exists(self, path: str) -> bool:
+        if path in self.changes:
+            return self.changes[path] is not None
+        return self.base.exists(path)
+
+    def remove(self, path: str):
+        if self.base.exists(path):
+            self.changes[path] = None
+        else:
+            self.changes.pop(path, None)
+
+    def get_full_path(self, path: str) -> str:
+        # Note that staged changes are not visible at this path until flushed
+        return self.base.get_full_path(path)
+
+    def hash(self, path: str) -> str:
+        if path in self.changes:
+            return self.hash_string(self.read(path))
+        return self.base.hash(path)
+
+    async def run_io(self, func: Callable[..., T], *args: Any) -> T:
+        # Staged files are in memory, the rest is up to the base file system
+        return await self.base.run_io(func, *args)
+
+    def _get_file_list(self) -> list[str]:
+        files = set(self.base.list())
+        for path, content in self.changes.items():
+            if content is None:
+                files.discard(path)
+            else:
+                files.add(path)
         return files
 
+    def overlay(self) -> "OverlayVFS":
+        """
+        Create a nested overlay, staging its changes over this one.
+
+        :return: The new overlay.
+        """
+        return OverlayVFS(self)
+
+    def discard(self):
+        """
+        Drop all the staged changes.
+        """
+        self.changes = {}
+
+    def flush(self) -> list[str]:
+        """
+        Apply the staged changes to the base file system.
+
+        Each file is replaced atomically if the base file system supports it
+        (see `LocalDiskVFS.save()`). The original contents are read before
+        anything is written, and if applying a change fails, the files
+        already changed are restored, so the base file system doesn't end up
+        with only some of the changes.
+
+        The overlay must not be changed while it's being flushed.
+
+        :return: Paths of the changed files.
+        :raises ValueError: If an original file can't be read (nothing is changed then).
+        """
+        changes = sorted(self.changes.items())
+        originals = {path: self.base.read(path) if self.base.exists(path) else None for path, _ in changes}
+
+        applied = []
+        try:
+            for path, content in changes:
+                applied.append(path)
+                if content is None:
+                    self.base.remove(path)
+                else:
+                    self.base.save(path, content)
+        except BaseException:
+            log.warning(f"Failed to apply staged changes to {applied[-1]}, restoring {len(applied) - 1} changed files")
+            for path in reversed(applied):
+                try:
+                    if originals[path] is None:
+                        self.base.remove(path)
+                    else:
+                        self.base.save(path, originals[path])
+                except Exception as err:  # noqa
+                    log.error(f"Failed to restore {path}: {err}", exc_info=True)
+            raise
+
+        self.changes = {}
+        return [path for path, _ in changes]
+
+    async def aflush(self) -> list[str]:
+        """
+        Apply the staged changes without blocking the event loop (see `flush()`).
+        """
+        return await self.run_io(self.flush)
+
+    def close(self):
+        self.discard()
+
 
-__all__ = ["VirtualFileSystem", "MemoryVFS", "LocalDiskVFS"]
+__all__ = ["VirtualFileSystem", "MemoryVFS", "LocalDiskVFS", "OverlayVFS", "get_io_executor"]
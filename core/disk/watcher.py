@@ -0,0 +1,287 @@
+import ctypes
+import ctypes.util
+import os
+import posixpath
+import struct
+import sys
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from core.disk.ignore import IgnoreMatcher
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+# struct inotify_event header: wd, mask, cookie, len (followed by the name)
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+def _stat_key(full_path: str) -> Optional[tuple[int, int, int]]:
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class WorkspaceWatcher:
+    """
+    Track the files changed in the workspace.
+
+    The watcher keeps the set of paths that changed since the workspace
+    was last synchronized with the project state (see `mark_synced()`),
+    so the workspace doesn't need to be scanned to find them. Until the
+    first synchronization (or if the watcher loses track of the changes),
+    the changes are unknown and the whole workspace must be scanned.
+
+    Changes made by Pythagora itself are reported with `record_write()`,
+    and are not included in the changed paths (unless the file was
+    changed again afterwards).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        # Changed path -> sequence number of its last change. The changes are
+        # collected even while they're unknown, so the changes made while
+        # the workspace is being scanned aren't lost.
+        self.changed: dict[str, int] = {}
+        self.seq = 0
+        # Sequence number of the last change seen by `get_changed_paths()`
+        self.reported_seq = 0
+        # Whether all the changes since the last full synchronization are known
+        self.complete = False
+        self.own_writes: dict[str, Optional[tuple[int, int, int]]] = {}
+
+    def _poll(self):
+        """
+        Collect the changes since the last poll.
+        """
+        raise NotImplementedError()
+
+    def _add(self, path: str):
+        self.seq += 1
+        self.changed[path] = self.seq
+
+    def record_write(self, path: str):
+        """
+        Record a change made by Pythagora, so it isn't reported as changed.
+
+        :param path: Path to the written or removed file, relative to project root.
+        """
+        self.own_writes[path] = _stat_key(os.path.join(self.root, path))
+
+    def get_changed_paths(self) -> Optional[set[str]]:
+        """
+        Get the paths changed since the last synchronization.
+
+        The paths may include files that were removed, files that are
+        ignored, and removed or moved directories.
+
+        :return: Set of changed paths (relative to project root), or None if unknown.
+        """
+        self._poll()
+        self.reported_seq = self.seq
+        own_writes, self.own_writes = self.own_writes, {}
+        for path, key in own_writes.items():
+            if path in self.changed and _stat_key(os.path.join(self.root, path)) == key:
+                del self.changed[path]
+
+        if not self.complete:
+            return None
+        return set(self.changed)
+
+    def mark_synced(self, paths: Optional[Iterable[str]] = None):
+        """
+        Mark the paths as synchronized with the project state.
+
+        Paths changed again after they were reported by `get_changed_paths()`
+        are kept, as the synchronization may have missed the new changes.
+
+        :param paths: Paths returned by `get_changed_paths()`, or None if the whole workspace was synchronized.
+        """
+        for path in list(self.changed if paths is None else paths):
+            seq = self.changed.get(path)
+            if seq is not None and seq <= self.reported_seq:
+                del self.changed[path]
+        if paths is None:
+            self.complete = True
+
+    def close(self):
+        """
+        Stop watching the workspace.
+        """
+        pass
+
+
+class InotifyWatcher(WorkspaceWatcher):
+    """
+    Workspace watcher using Linux inotify.
+
+    Every (non-ignored) directory in the workspace is watched. The events
+    are queued by the kernel and read without blocking when the changes
+    are requested, so no background thread is needed. If the event queue
+    overflows, the changes are unknown until the next synchronization.
+    """
+
+    def __init__(self, root: str, ignore_matcher: IgnoreMatcher):
+        super().__init__(root)
+        self.ignore_matcher = ignore_matcher
+        self.watches: dict[int, str] = {}
+
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        try:
+            self._watch_tree("", report_files=False)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, path: str, report_files: bool):
+        """
+        Watch the directory and all its (non-ignored) subdirectories.
+
+        :param path: Directory path, relative to project root ("" for the root).
+        :param report_files: Report the files in the directories as changed (for new directories).
+        """
+        for dpath, dirnames, filenames in os.walk(os.path.join(self.root, path)):
+            rel_dir = Path(os.path.relpath(dpath, self.root)).as_posix()
+            if rel_dir == ".":
+                rel_dir = ""
+            dirnames[:] = [d for d in dirnames if not self.ignore_matcher.ignore(posixpath.join(rel_dir, d))]
+
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dpath), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, f"Can't watch {dpath}: {os.strerror(err)}")
+            self.watches[wd] = rel_dir
+
+            if report_files:
+                for filename in filenames:
+                    self._add(posixpath.join(rel_dir, filename))
+
+    def _unwatch_tree(self, path: str):
+        prefix = path + "/"
+        for wd, watched in list(self.watches.items()):
+            if watched == path or watched.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def _poll(self):
+        while self.fd >= 0:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            log.warning("Too many changes in the workspace, will rescan it")
+            self.complete = False
+            # Directories created in the meantime may not be watched
+            self._unwatch_tree("")
+            self._watch_tree("", report_files=False)
+            return
+
+        if mask & IN_IGNORED:
+            # The directory was removed
+            self.watches.pop(wd, None)
+            return
+
+        parent = self.watches.get(wd)
+        if parent is None or not name:
+            return
+        path = posixpath.join(parent, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if not self.ignore_matcher.ignore(path):
+                    self._watch_tree(path, report_files=True)
+            elif mask & IN_MOVED_FROM:
+                # The watches would follow the directory outside the workspace
+                self._unwatch_tree(path)
+                self._add(path)
+            else:
+                self._add(path)
+            return
+
+        self._add(path)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.watches = {}
+
+
+class PollingWatcher(WorkspaceWatcher):
+    """
+    Workspace watcher comparing the file stat information between polls.
+
+    Used where inotify isn't available. This still lists the workspace on
+    each poll, but doesn't need to hash (or read) the files to find the
+    changed ones.
+    """
+
+    def __init__(self, root: str, list_files: Callable[[], list[str]]):
+        super().__init__(root)
+        self.list_files = list_files
+        self.snapshot: Optional[dict[str, Optional[tuple[int, int, int]]]] = None
+
+    def _poll(self):
+        snapshot = {path: _stat_key(os.path.join(self.root, path)) for path in self.list_files()}
+        if self.snapshot is not None:
+            for path, key in snapshot.items():
+                if self.snapshot.get(path) != key:
+                    self._add(path)
+            for path in self.snapshot.keys() - snapshot.keys():
+                self._add(path)
+        self.snapshot = snapshot
+
+
+def create_watcher(root: str, ignore_matcher: IgnoreMatcher, list_files: Callable[[], list[str]]) -> WorkspaceWatcher:
+    """
+    Create the best available watcher for the workspace.
+
+    :param root: Project root directory.
+    :param ignore_matcher: Matcher for the ignored files and directories.
+    :param list_files: Function listing the (non-ignored) files in the workspace, for polling.
+    :return: The watcher.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, ignore_matcher)
+        except (OSError, AttributeError) as err:
+            log.warning(f"Can't use inotify to watch {root}, falling back to polling: {err}")
+    return PollingWatcher(root, list_files)
+
+
+__all__ = ["WorkspaceWatcher", "InotifyWatcher", "PollingWatcher", "create_watcher"]
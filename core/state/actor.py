@@ -0,0 +1,386 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Optional
+
+from core.db.models import ExecLog, File, FileContent, LLMRequest, UserInput
+from core.db.models.project_state import DATA_FIELDS
+from core.disk.vfs import OverlayVFS
+from core.llm.request_log import LLMRequestLog, LLMRequestStatus
+from core.log import get_logger
+from core.proc.exec_log import ExecLog as ExecLogData
+from core.telemetry import telemetry
+from core.ui.base import UserInput as UserInputData
+
+if TYPE_CHECKING:
+    from core.agents.base import BaseAgent
+    from core.state.state_manager import StateManager
+
+log = get_logger(__name__)
+
+# Fields of the project state that can be replaced with `UpdateState`
+UPDATABLE_FIELDS = DATA_FIELDS + ("specification", "run_command")
+
+
+class StateCommand:
+    """
+    A change to the project state, applied by the `StateActor`.
+
+    Commands are applied one at a time, in the order they were
+    submitted, with exclusive access to the database session and
+    the next project state.
+    """
+
+    async def apply(self, sm: "StateManager") -> Any:
+        raise NotImplementedError()
+
+
+@dataclass(frozen=True)
+class SaveFile(StateCommand):
+    """
+    Save a file to the file system and to the next state.
+
+    Returns the saved `File` and the original file content ("" for new files).
+    """
+
+    path: str
+    content: str
+    metadata: Optional[dict] = None
+
+    async def apply(self, sm: "StateManager") -> tuple[File, str]:
+        try:
+            original_content = await sm.file_system.aread(self.path)
+        except ValueError:
+            original_content = ""
+
+        await sm.file_system.asave(self.path, self.content)
+
+        hash = sm.file_system.hash_string(self.content)
+        file_content = await FileContent.store(sm.current_session, hash, self.content)
+        existing_file = sm.next_state.get_file_by_path(self.path)
+        if existing_file:
+            # Needed to record the original content of the modified file
+            await sm.next_state.load_file_contents([existing_file])
+
+        file = sm.next_state.save_file(self.path, file_content)
+        if self.metadata:
+            file.meta = self.metadata
+        return file, original_content
+
+
+@dataclass(frozen=True)
+class ApplyOverlay(StateCommand):
+    """
+    Flush the changes staged in an overlay (see `OverlayVFS`) to the file system, and save them to the next state.
+
+    Returns the paths of the changed files.
+    """
+
+    overlay: OverlayVFS
+
+    async def apply(self, sm: "StateManager") -> list[str]:
+        if self.overlay.base is not sm.file_system:
+            raise ValueError("The overlay is not over the project file system")
+
+        changes = dict(self.overlay.changes)
+        await self.overlay.aflush()
+
+        for path, content in sorted(changes.items()):
+            existing_file = sm.next_state.get_file_by_path(path)
+            if content is None:
+                if existing_file:
+                    sm.next_state.files.remove(existing_file)
+                continue
+
+            hash = sm.file_system.hash_string(content)
+            file_content = await FileContent.store(sm.current_session, hash, content)
+            if existing_file:
+                # Needed to record the original content of the modified file
+                await sm.next_state.load_file_contents([existing_file])
+            sm.next_state.save_file(path, file_content)
+        return sorted(changes)
+
+
+@dataclass(frozen=True)
+class CompleteStep(StateCommand):
+    """
+    Mark the first unfinished step in the next state as completed.
+    """
+
+    async def apply(self, sm: "StateManager"):
+        sm.next_state.complete_step()
+
+
+@dataclass(frozen=True)
+class SetAction(StateCommand):
+    """
+    Set the action (short description of the step) of the next state.
+    """
+
+    action: str
+
+    async def apply(self, sm: "StateManager"):
+        sm.next_state.action = self.action
+
+
+@dataclass(frozen=True)
+class UpdateState(StateCommand):
+    """
+    Replace the value of a field of the next state.
+
+    The value must not be (or contain) an object the next state already
+    holds, changed in place: build a new list or dict instead, or use the
+    commands updating a single task, iteration or epic.
+    """
+
+    field: str
+    value: Any
+
+    async def apply(self, sm: "StateManager"):
+        if self.field not in UPDATABLE_FIELDS:
+            raise ValueError(f"Project state field {self.field} can't be updated")
+        setattr(sm.next_state, self.field, self.value)
+
+
+@dataclass(frozen=True)
+class UpdateTask(StateCommand):
+    """
+    Update the current task of the next state (or the task at `index`) with the given values.
+    """
+
+    values: dict
+    index: Optional[int] = None
+
+    async def apply(self, sm: "StateManager"):
+        task = sm.next_state.current_task if self.index is None else sm.next_state.tasks[self.index]
+        if task is None:
+            raise ValueError("There is no current task to update")
+        task.update(self.values)
+        sm.next_state.flag_tasks_as_modified()
+
+
+@dataclass(frozen=True)
+class UpdateIteration(StateCommand):
+    """
+    Update the current iteration of the next state (or the iteration at `index`) with the given values.
+    """
+
+    values: dict
+    index: Optional[int] = None
+
+    async def apply(self, sm: "StateManager"):
+        iteration = sm.next_state.current_iteration if self.index is None else sm.next_state.iterations[self.index]
+        if iteration is None:
+            raise ValueError("There is no current iteration to update")
+        iteration.update(self.values)
+        sm.next_state.flag_iterations_as_modified()
+
+
+@dataclass(frozen=True)
+class UpdateBugHuntingCycle(StateCommand):
+    """
+    Update the last bug hunting cycle of the current iteration of the next state with the given values.
+    """
+
+    values: dict
+
+    async def apply(self, sm: "StateManager"):
+        iteration = sm.next_state.current_iteration
+        if iteration is None or not iteration.get("bug_hunting_cycles"):
+            raise ValueError("There is no bug hunting cycle to update")
+        iteration["bug_hunting_cycles"][-1].update(self.values)
+        sm.next_state.flag_iterations_as_modified()
+
+
+@dataclass(frozen=True)
+class UpdateEpic(StateCommand):
+    """
+    Update the current epic of the next state with the given values.
+    """
+
+    values: dict
+
+    async def apply(self, sm: "StateManager"):
+        epic = sm.next_state.current_epic
+        if epic is None:
+            raise ValueError("There is no current epic to update")
+        epic.update(self.values)
+        sm.next_state.flag_epics_as_modified()
+
+
+@dataclass(frozen=True)
+class SetTaskStatus(StateCommand):
+    """
+    Set the status of the current task of the next state.
+    """
+
+    status: str
+
+    async def apply(self, sm: "StateManager"):
+        sm.next_state.set_current_task_status(self.status)
+
+
+@dataclass(frozen=True)
+class CompleteTask(StateCommand):
+    """
+    Mark the current task of the next state as done (see `ProjectState.complete_task()`).
+    """
+
+    async def apply(self, sm: "StateManager"):
+        sm.next_state.complete_task()
+
+
+@dataclass(frozen=True)
+class CompleteIteration(StateCommand):
+    """
+    Mark the current iteration of the next state as done (see `ProjectState.complete_iteration()`).
+    """
+
+    async def apply(self, sm: "StateManager"):
+        sm.next_state.complete_iteration()
+
+
+@dataclass(frozen=True)
+class SetFileMeta(StateCommand):
+    """
+    Set the metadata (eg. description) of a file in the next state.
+    """
+
+    path: str
+    meta: dict
+
+    async def apply(self, sm: "StateManager"):
+        file = sm.next_state.get_file_by_path(self.path)
+        if file is None:
+            raise ValueError(f"File not found: {self.path}")
+        file.meta = self.meta
+
+
+@dataclass(frozen=True)
+class LogLLMRequest(StateCommand):
+    """
+    Log the LLM request to the current state.
+    """
+
+    request_log: LLMRequestLog
+    agent: Optional["BaseAgent"] = None
+
+    async def apply(self, sm: "StateManager"):
+        telemetry.record_llm_request(
+            self.request_log.prompt_tokens + self.request_log.completion_tokens,
+            self.request_log.duration,
+            self.request_log.status != LLMRequestStatus.SUCCESS,
+        )
+        LLMRequest.from_request_log(sm.current_state, self.agent, self.request_log)
+
+
+@dataclass(frozen=True)
+class LogUserInput(StateCommand):
+    """
+    Log the user input to the current state.
+    """
+
+    question: str
+    response: UserInputData
+
+    async def apply(self, sm: "StateManager"):
+        UserInput.from_user_input(sm.current_state, self.question, self.response)
+
+
+@dataclass(frozen=True)
+class LogCommandRun(StateCommand):
+    """
+    Log the command execution to the current state.
+    """
+
+    exec_log: ExecLogData
+
+    async def apply(self, sm: "StateManager"):
+        ExecLog.from_exec_log(sm.current_state, self.exec_log)
+
+
+class StateActor:
+    """
+    Single owner of the project state changes.
+
+    Agents (including the ones running in parallel) submit commands with
+    `execute()` instead of changing the next state or using the database
+    session directly. The commands are queued and applied in submission
+    order by a single worker task, each holding the state manager's
+    database session lock, so a command never observes a half-applied
+    change from another one, and never overlaps a (background) commit.
+
+    The worker is only running while there are queued commands. A command
+    whose caller is cancelled before it's started is dropped; once started,
+    the command is always applied completely.
+
+    Usage:
+
+    >>> file, original_content = await actor.execute(SaveFile("README.md", "Hello"))
+    """
+
+    def __init__(self, state_manager: "StateManager"):
+        self.state_manager = state_manager
+        self.queue: deque[tuple[StateCommand, asyncio.Future]] = deque()
+        self.worker: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of commands waiting to be applied.
+        """
+        return len(self.queue)
+
+    async def execute(self, command: StateCommand) -> Any:
+        """
+        Apply the command and return its result.
+
+        :param command: The command to apply.
+        :return: Result of the command.
+        :raises Exception: The error raised while applying the command.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((command, future))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while self.queue:
+            command, future = self.queue.popleft()
+            if future.done():
+                # The caller was cancelled while waiting
+                continue
+
+            try:
+                async with self.state_manager.db_blocker():
+                    result = await command.apply(self.state_manager)
+            except Exception as err:  # noqa
+                log.debug(f"Error applying {command.__class__.__name__}: {err}")
+                if not future.done():
+                    future.set_exception(err)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+
+__all__ = [
+    "StateActor",
+    "StateCommand",
+    "SaveFile",
+    "ApplyOverlay",
+    "CompleteStep",
+    "SetAction",
+    "UpdateState",
+    "UpdateTask",
+    "UpdateIteration",
+    "UpdateBugHuntingCycle",
+    "UpdateEpic",
+    "SetTaskStatus",
+    "CompleteTask",
+    "CompleteIteration",
+    "SetFileMeta",
+    "LogLLMRequest",
+    "LogUserInput",
+    "LogCommandRun",
+]
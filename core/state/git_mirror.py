@@ -0,0 +1,207 @@
+import os
+import shutil
+import subprocess
+import time
+from typing import Optional
+
+from core.log import get_logger
+
+log = get_logger(__name__)
+
+COMMITTER = "Pythagora <pythagora@localhost>"
+
+# Commit message trailer with the ID of the mirrored project state
+STATE_ID_TRAILER = "State-Id"
+
+
+class GitMirrorError(Exception):
+    pass
+
+
+def _quote_path(path: str) -> str:
+    # fast-import reads unquoted paths to the end of the line
+    if "\n" in path or path.startswith('"'):
+        escaped = path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return f'"{escaped}"'
+    return path
+
+
+def _data(content: bytes) -> bytes:
+    return b"data %d\n%s\n" % (len(content), content)
+
+
+class GitMirror:
+    """
+    Mirror of the committed project states in a bare git repository.
+
+    Each committed state is a commit on the branch named after the project
+    branch ID, with the step index and action in the message, and a
+    `refs/states/<state ID>` ref pointing to it. The history is stored
+    compactly (as git packs), and the files of any two states can be
+    compared with git, without loading them from the database.
+
+    The commits are written with `git fast-import`, sending only the files
+    changed since the previous state (if the branch tip is the previous
+    state), so mirroring a step takes a single git process.
+
+    Usage:
+
+    >>> mirror = GitMirror("/path/to/project.git")
+    >>> mirror.commit_state(branch_id, state_id, parent_id, "Step 1: Do it", {"file.txt": "content"})
+    >>> mirror.changed_files(parent_id, state_id)
+    [('A', 'file.txt')]
+    """
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the repository.
+
+        :param path: Path to the bare repository.
+        :raises GitMirrorError: If git is not available or the repository can't be created.
+        """
+        self.git = shutil.which("git")
+        if self.git is None:
+            raise GitMirrorError("git is not installed")
+
+        self.path = path
+        # Branch -> ID of the state at the branch tip (None if the branch doesn't exist)
+        self.tips: dict[str, Optional[str]] = {}
+        if not os.path.isdir(path):
+            self._run("init", "--bare", "--quiet", path, git_dir=False)
+
+    def _run(self, *args: str, input: Optional[bytes] = None, git_dir: bool = True) -> str:
+        cmd = [self.git, "--git-dir", self.path, *args] if git_dir else [self.git, *args]
+        try:
+            result = subprocess.run(cmd, input=input, capture_output=True, check=True)
+        except subprocess.CalledProcessError as err:
+            stderr = err.stderr.decode("utf-8", errors="replace").strip()
+            raise GitMirrorError(f"git {args[0]} failed: {stderr}") from err
+        except OSError as err:
+            raise GitMirrorError(f"Can't run git: {err}") from err
+        return result.stdout.decode("utf-8", errors="replace")
+
+    def get_tip(self, branch: str) -> Optional[str]:
+        """
+        Get the ID of the state at the tip of the branch.
+
+        :param branch: Branch name (project branch ID).
+        :return: The state ID, or None if the branch doesn't exist.
+        """
+        if branch not in self.tips:
+            try:
+                message = self._run("log", "-1", "--format=%B", f"refs/heads/{branch}", "--")
+            except GitMirrorError:
+                message = ""
+            tip = None
+            for line in message.splitlines():
+                if line.startswith(f"{STATE_ID_TRAILER}: "):
+                    tip = line.split(": ", 1)[1].strip()
+            self.tips[branch] = tip
+        return self.tips[branch]
+
+    def commit_state(
+        self,
+        branch: str,
+        state_id: str,
+        parent_id: Optional[str],
+        message: str,
+        files: dict[str, Optional[str]],
+        full: bool = False,
+    ):
+        """
+        Mirror a committed project state.
+
+        :param branch: Branch name (project branch ID).
+        :param state_id: ID of the state.
+        :param parent_id: ID of the previous state; if it's not at the branch tip, `files` must have all the files.
+        :param message: Commit message (the state ID trailer is added to it).
+        :param files: Files changed since the previous state (path -> content, or None if removed),
+            or all files if `full` is set.
+        :param full: `files` contains all the files in the state.
+        """
+        tip = self.get_tip(branch)
+        if not full and (tip is None or tip != parent_id):
+            raise GitMirrorError(f"Branch {branch} is not at state {parent_id}, all files are needed")
+
+        message = f"{message}\n\n{STATE_ID_TRAILER}: {state_id}\n"
+        stream = [
+            f"commit refs/heads/{branch}\n".encode("utf-8"),
+            b"mark :1\n",
+            f"committer {COMMITTER} {int(time.time())} +0000\n".encode("utf-8"),
+            _data(message.encode("utf-8")),
+        ]
+        if tip is not None:
+            stream.append(f"from refs/heads/{branch}^0\n".encode("utf-8"))
+        if full:
+            stream.append(b"deleteall\n")
+        for path, content in sorted(files.items()):
+            if content is None:
+                stream.append(f"D {_quote_path(path)}\n".encode("utf-8"))
+            else:
+                stream.append(f"M 100644 inline {_quote_path(path)}\n".encode("utf-8"))
+                stream.append(_data(content.encode("utf-8")))
+        stream.append(f"reset refs/states/{state_id}\nfrom :1\n\n".encode("utf-8"))
+
+        self.tips.pop(branch, None)
+        self._run("fast-import", "--quiet", "--force", input=b"".join(stream))
+        self.tips[branch] = state_id
+
+    def has_state(self, state_id: str) -> bool:
+        """
+        Check whether the state is mirrored.
+
+        :param state_id: ID of the state.
+        :return: True if the state is in the repository.
+        """
+        try:
+            self._run("rev-parse", "--verify", "--quiet", f"refs/states/{state_id}")
+            return True
+        except GitMirrorError:
+            return False
+
+    def changed_files(self, from_state_id: str, to_state_id: str) -> list[tuple[str, str]]:
+        """
+        Get the files changed between two mirrored states.
+
+        :param from_state_id: ID of the older state.
+        :param to_state_id: ID of the newer state.
+        :return: List of (status, path) tuples, with status "A" (added), "M" (modified) or "D" (deleted).
+        """
+        output = self._run(
+            "-c",
+            "core.quotePath=false",
+            "diff-tree",
+            "-r",
+            "-z",
+            "--no-renames",
+            "--name-status",
+            f"refs/states/{from_state_id}",
+            f"refs/states/{to_state_id}",
+            "--",
+        )
+        fields = output.split("\0")
+        return [(fields[i], fields[i + 1]) for i in range(0, len(fields) - 1, 2)]
+
+    def diff(self, from_state_id: str, to_state_id: str, paths: Optional[list[str]] = None, context: int = 3) -> str:
+        """
+        Get the unified diff between two mirrored states.
+
+        :param from_state_id: ID of the older state.
+        :param to_state_id: ID of the newer state.
+        :param paths: Only include these files (default: all changed files).
+        :param context: Number of context lines around the changes.
+        :return: The diff, in git format.
+        """
+        return self._run(
+            "diff",
+            "--no-color",
+            "--no-renames",
+            f"-U{context}",
+            f"refs/states/{from_state_id}",
+            f"refs/states/{to_state_id}",
+            "--",
+            *(paths or []),
+        )
+
+
+__all__ = ["GitMirror", "GitMirrorError"]
@@ -2,20 +2,37 @@ import asyncio
 import os.path
 import traceback
 from contextlib import asynccontextmanager
-from typing import TYPE_CHECKING, Optional
+from dataclasses import dataclass, field
+from difflib import unified_diff
+from functools import partial
+from typing import TYPE_CHECKING, Any, Iterable, Optional
 from uuid import UUID, uuid4
 
+from sqlalchemy import distinct, select
 from tenacity import retry, stop_after_attempt, wait_fixed
 
-from core.config import FileSystemType, get_config
-from core.db.models import Branch, ExecLog, File, FileContent, LLMRequest, Project, ProjectState, UserInput
+from core.config import FileSystemType, RetentionConfig, get_config
+from core.db.content_cache import content_cache
+from core.db.lock import SessionLock
+from core.db.models import Branch, File, FileContent, Project, ProjectState
 from core.db.models.specification import Specification
 from core.db.session import SessionManager
 from core.disk.ignore import IgnoreMatcher
-from core.disk.vfs import LocalDiskVFS, MemoryVFS, VirtualFileSystem
-from core.llm.request_log import LLMRequestLog, LLMRequestStatus
+from core.disk.snapshots import SnapshotStore
+from core.disk.vfs import LocalDiskVFS, MemoryVFS, OverlayVFS, VirtualFileSystem, get_io_executor
+from core.llm.request_log import LLMRequestLog
 from core.log import get_logger
 from core.proc.exec_log import ExecLog as ExecLogData
+from core.state.actor import (
+    ApplyOverlay,
+    LogCommandRun,
+    LogLLMRequest,
+    LogUserInput,
+    SaveFile,
+    StateActor,
+    StateCommand,
+)
+from core.state.git_mirror import GitMirror, GitMirrorError
 from core.telemetry import telemetry
 from core.ui.base import UIBase
 from core.ui.base import UserInput as UserInputData
@@ -26,6 +43,26 @@ if TYPE_CHECKING:
 log = get_logger(__name__)
 
 
+@dataclass
+class RestoreReport:
+    """
+    Changes to the workspace made (or, in a dry run, needed) to restore the project files.
+    """
+
+    #: Files missing from the workspace
+    created: list[str] = field(default_factory=list)
+    #: Files with content different from the project state
+    modified: list[str] = field(default_factory=list)
+    #: Files not in the project state
+    removed: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.created or self.modified or self.removed)
+
+    def __str__(self) -> str:
+        return f"{len(self.created)} created, {len(self.modified)} modified, {len(self.removed)} removed"
+
+
 class StateManager:
     """
     Manages loading, updating and saving project states.
@@ -34,6 +71,10 @@ class StateManager:
     should use `StateManager.current` attribute. All changes
     to the state should be done through the `StateManager.next`
     attribute.
+
+    Agents running in parallel must not change the next state
+    directly: they submit commands (see `core.state.actor`) with
+    `StateManager.execute()`, which applies them one at a time.
     """
 
     current_state: Optional[ProjectState]
@@ -43,32 +84,67 @@ class StateManager:
         self.session_manager = session_manager
         self.ui = ui
         self.file_system = None
+        self.git_mirror: Optional[GitMirror] = None
         self.project = None
         self.branch = None
         self.current_state = None
         self.next_state = None
         self.current_session = None
-        self.blockDb = False
+        self.db_lock = SessionLock()
+        self.pending_commit: Optional[asyncio.Task] = None
+        self.actor = StateActor(self)
 
     @asynccontextmanager
     async def db_blocker(self):
-        while self.blockDb:
-            await asyncio.sleep(0.1)  # Wait if blocked
+        """
+        Serialize access to the shared database session.
 
-        try:
-            self.blockDb = True  # Set the block
+        Agents running in parallel must wrap their database access in
+        this context manager (state changes should be submitted as commands
+        with `execute()` instead, which takes care of this). See `SessionLock`
+        for contention metrics.
+        """
+        async with self.db_lock():
             yield
-        finally:
-            self.blockDb = False  # Unset the block
 
-    async def list_projects(self) -> list[Project]:
+    async def execute(self, command: StateCommand) -> Any:
+        """
+        Apply a state change command.
+
+        The commands from all agents are applied one at a time, in the
+        order they were submitted. See `StateActor` for details.
+
+        :param command: The command to apply.
+        :return: Result of the command.
+        """
+        return await self.actor.execute(command)
+
+    async def list_projects(
+        self,
+        *,
+        name: Optional[str] = None,
+        after: Optional[tuple[str, UUID]] = None,
+        limit: Optional[int] = None,
+    ) -> list[Project]:
         """
         List projects with branches
 
-        :return: List of projects with all their branches.
+        See `Project.get_projects()` for the filtering and pagination options.
+
+        :return: List of projects with all their branches and branch heads.
+        """
+        async with self.session_manager as session:
+            return await Project.get_projects(session, name=name, after=after, limit=limit)
+
+    async def list_branch_steps(self, branch_ids: list[UUID]) -> dict[UUID, list[tuple[int, Optional[str]]]]:
+        """
+        List the steps in the branches, without loading the project states.
+
+        :param branch_ids: IDs of the branches.
+        :return: Dictionary mapping branch IDs to ordered lists of `(step_index, action)` tuples.
         """
         async with self.session_manager as session:
-            return await Project.get_all_projects(session)
+            return await Branch.get_steps(session, branch_ids)
 
     async def create_project(self, name: str, folder_name: Optional[str] = None) -> Project:
         """
@@ -102,21 +178,87 @@ class StateManager:
         self.project = project
         self.branch = branch
         self.file_system = await self.init_file_system(load_existing=False)
+        self.git_mirror = self.init_git_mirror()
         return project
 
     async def delete_project(self, project_id: UUID) -> bool:
         session = await self.session_manager.start()
+
+        # Only the contents and specifications used by this project can become orphaned
+        result = await session.execute(
+            select(distinct(File.content_id))
+            .join(ProjectState, File.project_state_id == ProjectState.id)
+            .join(Branch, ProjectState.branch_id == Branch.id)
+            .where(Branch.project_id == project_id)
+        )
+        content_ids = result.scalars().all()
+        result = await session.execute(
+            select(distinct(ProjectState.specification_id))
+            .join(Branch, ProjectState.branch_id == Branch.id)
+            .where(Branch.project_id == project_id)
+        )
+        spec_ids = result.scalars().all()
+
         rows = await Project.delete_by_id(session, project_id)
         if rows > 0:
-            await Specification.delete_orphans(session)
-            await FileContent.delete_orphans(session)
+            await Specification.delete_orphans(session, spec_ids)
+            await FileContent.delete_orphans(session, content_ids)
 
         await session.commit()
+        await self.session_manager.close()
 
         if rows > 0:
             log.info(f"Deleted project {project_id}.")
         return bool(rows)
 
+    async def compact_project(self, project_id: UUID, retention: Optional[RetentionConfig] = None) -> Optional[int]:
+        """
+        Squash old project states in all branches of the project.
+
+        See `Branch.compact()` for details.
+
+        :param project_id: Project ID.
+        :param retention: Retention policy (defaults to the configured one).
+        :return: Number of squashed states, or None if the project doesn't exist.
+        """
+        if retention is None:
+            retention = self.session_manager.config.retention
+        if not retention.keep_last_steps:
+            raise ValueError("Number of steps to keep must be specified.")
+
+        session = await self.session_manager.start()
+        try:
+            project = await Project.get_by_id(session, project_id)
+            if project is None:
+                return None
+
+            n_squashed = 0
+            result = await session.execute(select(Branch).where(Branch.project_id == project.id))
+            for branch in result.scalars().all():
+                n_squashed += await branch.compact(
+                    retention.keep_last_steps,
+                    keep_task_boundaries=retention.keep_task_boundaries,
+                    keep_logs=retention.keep_logs,
+                )
+            await session.commit()
+
+            if get_config().fs.snapshots:
+                # Drop the file contents only used by the squashed states from the snapshots
+                result = await session.execute(
+                    select(distinct(File.content_id))
+                    .join(ProjectState, File.project_state_id == ProjectState.id)
+                    .join(Branch, ProjectState.branch_id == Branch.id)
+                    .where(Branch.project_id == project.id)
+                )
+                store = self.get_snapshot_store(project.folder_name)
+                ids = result.scalars().all()
+                await asyncio.get_running_loop().run_in_executor(get_io_executor(), store.prune, ids)
+        finally:
+            await self.session_manager.close()
+
+        log.info(f"Compacted project {project_id}: squashed {n_squashed} states.")
+        return n_squashed
+
     async def load_project(
         self,
         *,
@@ -132,7 +274,10 @@ class StateManager:
         the `main` branch in the project.
 
         If `step_index' is provided, load the state at the given step
-        of the branch instead of the last one.
+        of the branch instead of the last one. If there are later steps in
+        the branch, a new branch is forked from that step (see
+        `Branch.fork()`) and the project continues in the new branch,
+        leaving the original branch intact.
 
         The returned ProjectState will have branch and branch.project
         relationships preloaded. All other relationships must be
@@ -179,16 +324,28 @@ class StateManager:
             )
             return None
 
-        # TODO: in the future, we might want to create a new branch here?
-        await state.delete_after()
+        if step_index and step_index < await branch.get_last_step_index():
+            parent = branch
+            branch = await parent.fork(step_index)
+            log.info(f"Forked branch {branch.name} ({branch.id}) from {parent.name} at step {step_index}")
+
+        retention = self.session_manager.config.retention
+        if retention.keep_last_steps:
+            await branch.compact(
+                retention.keep_last_steps,
+                keep_task_boundaries=retention.keep_task_boundaries,
+                keep_logs=retention.keep_logs,
+            )
+
         await session.commit()
 
         self.current_session = session
         self.current_state = state
-        self.branch = state.branch
-        self.project = state.branch.project
-        self.next_state = await state.create_next_state()
+        self.branch = branch
+        self.project = branch.project
+        self.next_state = await state.create_next_state(branch=branch)
         self.file_system = await self.init_file_system(load_existing=True)
+        self.git_mirror = self.init_git_mirror()
         log.debug(
             f"Loaded project {self.project} ({self.project.id}) "
             f"branch {self.branch} ({self.branch.id}"
@@ -217,52 +374,175 @@ class StateManager:
     async def commit_with_retry(self):
         await self.current_session.commit()
 
-    async def commit(self) -> ProjectState:
+    async def commit(self, background: bool = False) -> ProjectState:
         """
         Commit the new project state to the database.
 
         This commits `next_state` to the database, making the changes
         permanent, then creates a new state for further changes.
 
+        If `background` is True (and `db.pipelined_commits` is enabled), the
+        state is flushed to the database, and the transaction commit and the
+        session renewal run in the background, so the caller can continue
+        working on the new state right away. The StateManager methods
+        accessing the database wait for the commit to finish, and if it
+        fails, the error is raised from the next `commit()` or
+        `wait_for_commit()`.
+
+        :param background: Finish the commit in the background.
         :return: The committed state.
         """
         try:
+            await self.wait_for_commit()
+
             if self.next_state is None:
                 raise ValueError("No state to commit.")
             if self.current_session is None:
                 raise ValueError("No database session open.")
 
-            log.debug("Committing session")
-            await self.commit_with_retry()
-            log.debug("Session committed successfully")
+            state = self.next_state
+            log.debug(f"Flushing step {state.step_index}")
+            async with self.db_blocker():
+                await self.current_session.flush()
+
+            # The next state is not added to the session until this one is committed
+            next_state = await state.create_next_state(detached=True)
+
+            # Collect the changes for the git mirror while the file contents are still loaded
+            mirror_commit = await self._get_mirror_commit(state) if self.git_mirror is not None else None
+
+            # The cloned files in the next state share the FileContent objects with the
+            # current state, so no reloading is needed. The contents themselves are
+            # unloaded, so memory use doesn't grow with the project size: they're
+            # served from the content cache by `load_file_contents()` when needed.
+            for f in state.files:
+                if "content" in f.__dict__ and f.content.is_loaded:
+                    self.current_session.expire(f.content, ["content"])
+
+            self.current_state = state
+            self.next_state = next_state
+            if background and self.session_manager.config.pipelined_commits:
+                self.pending_commit = asyncio.create_task(self._finish_commit(state, next_state, mirror_commit))
+            else:
+                await self._finish_commit(state, next_state, mirror_commit)
+
+            telemetry.inc("num_steps")
+            return state
+
+        except Exception as e:
+            log.error(f"Error during commit: {str(e)}")
+            log.error(traceback.format_exc())
+            raise
+
+    async def _finish_commit(
+        self,
+        state: ProjectState,
+        next_state: ProjectState,
+        mirror_commit: Optional[dict[str, Any]] = None,
+    ):
+        """
+        Commit the (already flushed) state and start a new session for the next state.
+
+        :param state: The state being committed.
+        :param next_state: The next state, not yet added to any session.
+        :param mirror_commit: Arguments for `GitMirror.commit_state()`, if the state is mirrored to git.
+        """
+        async with self.db_blocker():
+            try:
+                await self.commit_with_retry()
+            except Exception as e:
+                log.error(f"Error committing step {state.step_index}: {str(e)}")
+                raise
+            log.debug(f"Step {state.step_index} committed successfully")
 
             # Having a shorter-lived sessions is considered a good practice in SQLAlchemy,
             # so we close and recreate the session for each state. This uses db
-            # connection from a connection pool, so it is fast. Note that SQLite uses
-            # no connection pool by default because it's all in-process so it's fast anyway.
+            # connection from a connection pool, so it is fast. For SQLite, the pool
+            # keeps a single persistent connection (see `db.sqlite` config).
             self.current_session.expunge_all()
             await self.session_manager.close()
             self.current_session = await self.session_manager.start()
+            self.current_session.add(state)
+            self.current_session.add(next_state)
 
-            self.current_state = self.next_state
-            self.current_session.add(self.next_state)
-            self.next_state = await self.current_state.create_next_state()
+        # Files saved by Pythagora are already in the snapshots, this stores the imported ones
+        await self.file_system.run_io(
+            self.file_system.capture_snapshot,
+            [(f.path, f.content_id) for f in state.files],
+        )
 
-            # After the next_state becomes the current_state, we need to load
-            # the FileContent model, which was previously loaded by the load_project(),
-            # but is not populated by the `create_next_state()`
-            for f in self.current_state.files:
-                await f.awaitable_attrs.content
+        if mirror_commit is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    get_io_executor(),
+                    partial(self.git_mirror.commit_state, **mirror_commit),
+                )
+            except GitMirrorError as err:
+                # The database is the source of truth, the mirror is only a convenience
+                log.warning(f"Error mirroring step {state.step_index} to git: {err}")
+
+        if self.db_lock.contended:
+            log.debug(f"Database session lock stats: {self.db_lock.stats()}")
+        log.debug(f"File content cache stats: {content_cache.stats()}")
+        pool_stats = self.session_manager.pool_stats()
+        if pool_stats:
+            log.debug(f"Database connection pool stats: {pool_stats}")
+
+    async def _get_mirror_commit(self, state: ProjectState) -> dict[str, Any]:
+        """
+        Prepare the git mirror commit for the state being committed.
 
-            telemetry.inc("num_steps")
+        Only the files changed since the current state are included, if
+        the mirror branch is at the current state. Otherwise (eg. the first
+        step mirrored in a branch, or after a mirroring error), all the
+        files are included.
 
-            # FIXME: write a test to verify files (and file content) are preloaded
-            return self.current_state
+        :param state: The state being committed (flushed, with the file contents not yet expired).
+        :return: Arguments for `GitMirror.commit_state()`.
+        """
+        prev = self.current_state
+        branch = str(state.branch_id)
+        tip = await asyncio.get_running_loop().run_in_executor(get_io_executor(), self.git_mirror.get_tip, branch)
+        full = prev is None or prev is state or state.prev_state_id != prev.id or tip != str(prev.id)
+
+        if full:
+            files = list(state.files)
+            removed = []
+        else:
+            async with self.db_blocker():
+                prev_files = await prev.awaitable_attrs.files
+            prev_content_ids = {f.path: f.content_id for f in prev_files}
+            files = [f for f in state.files if prev_content_ids.pop(f.path, None) != f.content_id]
+            removed = list(prev_content_ids)
 
-        except Exception as e:
-            log.error(f"Error during commit: {str(e)}")
-            log.error(traceback.format_exc())
-            raise
+        async with self.db_blocker():
+            await state.load_file_contents(files)
+
+        message = f"Step {state.step_index}: {state.action}" if state.action else f"Step {state.step_index}"
+        return dict(
+            branch=branch,
+            state_id=str(state.id),
+            parent_id=str(prev.id) if prev is not None else None,
+            message=message,
+            files={**{f.path: f.content.content for f in files}, **{path: None for path in removed}},
+            full=full,
+        )
+
+    async def wait_for_commit(self):
+        """
+        Wait until the state being committed in the background (if any) is saved.
+
+        :raises Exception: The error that occurred while saving the state.
+        """
+        task = self.pending_commit
+        if task is None:
+            return
+        try:
+            # Don't abandon the write if the caller is cancelled
+            await asyncio.shield(task)
+        finally:
+            if task.done():
+                self.pending_commit = None
 
     async def rollback(self):
         """
@@ -270,6 +550,11 @@ class StateManager:
         """
         if not self.current_session:
             return
+        try:
+            await self.wait_for_commit()
+        except Exception as err:  # noqa
+            # Already logged; the state wasn't saved, so there's nothing more to abandon
+            log.warning(f"Previous state was not saved: {err}")
         await self.current_session.rollback()
         await self.session_manager.close()
         self.current_session = None
@@ -286,18 +571,11 @@ class StateManager:
 
         :param request_log: The request log to log.
         """
-        async with self.db_blocker():
-            try:
-                telemetry.record_llm_request(
-                    request_log.prompt_tokens + request_log.completion_tokens,
-                    request_log.duration,
-                    request_log.status != LLMRequestStatus.SUCCESS,
-                )
-                LLMRequest.from_request_log(self.current_state, agent, request_log)
-
-            except Exception as e:
-                if self.ui:
-                    await self.ui.send_message(f"An error occurred: {e}")
+        try:
+            await self.execute(LogLLMRequest(request_log, agent))
+        except Exception as e:
+            if self.ui:
+                await self.ui.send_message(f"An error occurred: {e}")
 
     async def log_user_input(self, question: str, response: UserInputData):
         """
@@ -312,7 +590,7 @@ class StateManager:
         :param response: The user response.
         """
         telemetry.inc("num_inputs")
-        UserInput.from_user_input(self.current_state, question, response)
+        await self.execute(LogUserInput(question, response))
 
     async def log_command_run(self, exec_log: ExecLogData):
         """
@@ -326,7 +604,7 @@ class StateManager:
         :param exec_log: The command execution log.
         """
         telemetry.inc("num_commands")
-        ExecLog.from_exec_log(self.current_state, exec_log)
+        await self.execute(LogCommandRun(exec_log))
 
     async def log_event(self, type: str, **kwargs):
         """
@@ -357,10 +635,15 @@ class StateManager:
         """
         Get a file from the current project state, by the file path.
 
+        The file content is loaded, if not already.
+
         :param path: The file path.
         :return: The file object, or None if not found.
         """
-        return self.current_state.get_file_by_path(path)
+        file = self.current_state.get_file_by_path(path)
+        if file:
+            await self.load_file_contents([file])
+        return file
 
     async def save_file(
         self,
@@ -380,28 +663,39 @@ class StateManager:
         :param metadata: Optional metadata (eg. description) to save with the file.
         :param from_template: Whether the file is part of a template.
         """
-        try:
-            original_content = self.file_system.read(path)
-        except ValueError:
-            original_content = ""
-
-        # FIXME: VFS methods should probably be async
-        self.file_system.save(path, content)
-
-        hash = self.file_system.hash_string(content)
-        async with self.db_blocker():
-            file_content = await FileContent.store(self.current_session, hash, content)
+        _, original_content = await self.execute(SaveFile(path, content, metadata))
 
-        file = self.next_state.save_file(path, file_content)
         if self.ui and not from_template:
             await self.ui.open_editor(self.file_system.get_full_path(path))
-        if metadata:
-            file.meta = metadata
 
         if not from_template:
             delta_lines = len(content.splitlines()) - len(original_content.splitlines())
             telemetry.inc("created_lines", delta_lines)
 
+    def create_overlay(self) -> OverlayVFS:
+        """
+        Create an overlay over the project file system, to stage file changes in memory.
+
+        Agents can make speculative or parallel edits in their own overlays,
+        then either apply them with `apply_overlay()` or drop them with
+        `OverlayVFS.discard()`, which costs no disk I/O.
+
+        :return: The new overlay.
+        """
+        return OverlayVFS(self.file_system)
+
+    async def apply_overlay(self, overlay: OverlayVFS) -> list[str]:
+        """
+        Write the changes staged in the overlay to the project.
+
+        The files are flushed to the file system (see `OverlayVFS.flush()`)
+        and saved to (or removed from) `next_state`.
+
+        :param overlay: Overlay created with `create_overlay()`.
+        :return: Paths of the changed files.
+        """
+        return await self.execute(ApplyOverlay(overlay))
+
     async def init_file_system(self, load_existing: bool) -> VirtualFileSystem:
         """
         Initialize file system interface for the new or loaded project.
@@ -419,6 +713,10 @@ class StateManager:
         """
         config = get_config()
 
+        if self.file_system:
+            # Stop watching the previously loaded project
+            self.file_system.close()
+
         if config.fs.type == FileSystemType.MEMORY:
             return MemoryVFS()
 
@@ -431,10 +729,19 @@ class StateManager:
                 root,
                 config.fs.ignore_paths,
                 ignore_size_threshold=config.fs.ignore_size_threshold,
+                use_gitignore=config.fs.use_gitignore,
             )
 
             try:
-                return LocalDiskVFS(root, allow_existing=load_existing, ignore_matcher=ignore_matcher)
+                return LocalDiskVFS(
+                    root,
+                    allow_existing=load_existing,
+                    ignore_matcher=ignore_matcher,
+                    stat_cache_path=self.get_stat_cache_path(),
+                    watch=config.fs.watch,
+                    mirror_size=config.fs.mirror_size,
+                    snapshot_path=self.get_snapshot_path() if config.fs.snapshots else None,
+                )
             except FileExistsError:
                 self.project.folder_name = self.project.folder_name + "-" + uuid4().hex[:7]
                 log.warning(f"Directory {root} already exists, changing project folder to {self.project.folder_name}")
@@ -452,6 +759,271 @@ class StateManager:
             raise ValueError("No project loaded")
         return os.path.join(config.fs.workspace_root, self.project.folder_name)
 
+    def get_stat_cache_path(self) -> str:
+        """
+        Get the path to the file stat cache (see `StatCache`) of the project.
+
+        The cache is stored next to the project folder, so it's never
+        mistaken for a project file.
+
+        :return: The full path to the stat cache file.
+        """
+        config = get_config()
+
+        if self.project is None:
+            raise ValueError("No project loaded")
+        return os.path.join(config.fs.workspace_root, f".{self.project.folder_name}.stat-cache.json")
+
+    def get_snapshot_path(self, folder_name: Optional[str] = None) -> str:
+        """
+        Get the path to the snapshot store of the project files (see `SnapshotStore`).
+
+        The store is kept next to the project directory, so it isn't part of the project.
+
+        :param folder_name: Project folder name (default: the loaded project's).
+        :return: The full path to the snapshot store directory.
+        """
+        config = get_config()
+
+        if folder_name is None:
+            if self.project is None:
+                raise ValueError("No project loaded")
+            folder_name = self.project.folder_name
+        return os.path.join(config.fs.workspace_root, f".{folder_name}.snapshots")
+
+    def get_git_mirror_path(self) -> str:
+        """
+        Get the path to the git mirror of the project states (see `GitMirror`).
+
+        The bare repository is kept next to the project directory, so it
+        doesn't interfere with a git repository in the project itself.
+
+        :return: The full path to the bare git repository.
+        """
+        config = get_config()
+
+        if self.project is None:
+            raise ValueError("No project loaded")
+        return os.path.join(config.fs.workspace_root, f".{self.project.folder_name}.git")
+
+    def init_git_mirror(self) -> Optional[GitMirror]:
+        """
+        Open the git mirror of the loaded project states, if enabled.
+
+        Only projects on the local disk are mirrored.
+
+        :return: The git mirror, or None if disabled or not available.
+        """
+        config = get_config()
+
+        if config.fs.type != FileSystemType.LOCAL or not config.fs.git_mirror:
+            return None
+        try:
+            return GitMirror(self.get_git_mirror_path())
+        except GitMirrorError as err:
+            log.warning(f"Can't mirror the project states to git: {err}")
+            return None
+
+    async def diff_states(
+        self,
+        from_state: ProjectState,
+        to_state: ProjectState,
+        paths: Optional[list[str]] = None,
+    ) -> str:
+        """
+        Get the unified diff of the project files between two steps.
+
+        If the git mirror has both steps, the diff is computed by git, so
+        neither state's file contents need to be loaded from the database.
+        Otherwise, the contents of the changed files are loaded and diffed.
+
+        :param from_state: The older project state.
+        :param to_state: The newer project state.
+        :param paths: Only include these files (default: all changed files).
+        :return: The diff (empty if there are no changes).
+        """
+        mirror = self.git_mirror
+        if mirror is not None:
+
+            def diff() -> Optional[str]:
+                if not (mirror.has_state(str(from_state.id)) and mirror.has_state(str(to_state.id))):
+                    return None
+                return mirror.diff(str(from_state.id), str(to_state.id), paths)
+
+            try:
+                mirror_diff = await asyncio.get_running_loop().run_in_executor(get_io_executor(), diff)
+                if mirror_diff is not None:
+                    return mirror_diff
+            except GitMirrorError as err:
+                log.warning(f"Error diffing steps {from_state.step_index} and {to_state.step_index} in git: {err}")
+
+        async with self.db_blocker():
+            old_files = {f.path: f for f in await from_state.awaitable_attrs.files}
+            new_files = {f.path: f for f in await to_state.awaitable_attrs.files}
+        changed = sorted(
+            path
+            for path in old_files.keys() | new_files.keys()
+            if (paths is None or path in paths)
+            and (
+                path not in old_files
+                or path not in new_files
+                or old_files[path].content.id != new_files[path].content.id
+            )
+        )
+
+        async with self.db_blocker():
+            await from_state.load_file_contents([old_files[path] for path in changed if path in old_files])
+            await to_state.load_file_contents([new_files[path] for path in changed if path in new_files])
+
+        lines = []
+        for path in changed:
+            old_file = old_files.get(path)
+            new_file = new_files.get(path)
+            lines.extend(
+                unified_diff(
+                    old_file.content.content.splitlines(keepends=True) if old_file else [],
+                    new_file.content.content.splitlines(keepends=True) if new_file else [],
+                    fromfile=f"a/{path}" if old_file else "/dev/null",
+                    tofile=f"b/{path}" if new_file else "/dev/null",
+                )
+            )
+        return "".join(line if line.endswith("\n") else f"{line}\n" for line in lines)
+
+    async def diff_steps(
+        self,
+        from_step: int,
+        to_step: int,
+        *,
+        project_id: Optional[UUID] = None,
+        branch_id: Optional[UUID] = None,
+    ) -> Optional[str]:
+        """
+        Get the unified diff of the project files between two steps of a branch.
+
+        The project isn't loaded (and the workspace isn't touched), only the
+        two steps are read. See `diff_states()` for details.
+
+        :param from_step: The older step index.
+        :param to_step: The newer step index.
+        :param project_id: Project ID (keyword-only, optional; uses the `main` branch).
+        :param branch_id: Branch ID (keyword-only, optional).
+        :return: The diff, or None if the branch or either of the steps doesn't exist.
+        """
+        session = await self.session_manager.start()
+        try:
+            branch = None
+            if branch_id is not None:
+                branch = await Branch.get_by_id(session, branch_id)
+            elif project_id is not None:
+                project = await Project.get_by_id(session, project_id)
+                if project is not None:
+                    branch = await project.get_branch()
+            else:
+                raise ValueError("Project or branch ID must be provided.")
+            if branch is None:
+                return None
+
+            from_state = await branch.get_state_at_step(from_step)
+            to_state = await branch.get_state_at_step(to_step)
+            if from_state is None or to_state is None:
+                return None
+
+            self.project = await branch.awaitable_attrs.project
+            self.git_mirror = self.init_git_mirror()
+            return await self.diff_states(from_state, to_state)
+        finally:
+            self.project = None
+            self.git_mirror = None
+            await self.session_manager.close()
+
+    def get_snapshot_store(self, folder_name: str) -> SnapshotStore:
+        """
+        Get the snapshot store of the project files, shared with the file system if it's the loaded project.
+
+        :param folder_name: Project folder name.
+        :return: The snapshot store.
+        """
+        path = self.get_snapshot_path(folder_name)
+        snapshots = getattr(self.file_system, "snapshots", None)
+        if snapshots is not None and snapshots.path == path:
+            return snapshots
+        return SnapshotStore(path)
+
+    async def find_workspace_changes(
+        self,
+        known_paths: Iterable[str],
+        changed_paths: Optional[set[str]],
+    ) -> tuple[list[str], list[str]]:
+        """
+        Find the workspace files that may differ from the known files.
+
+        If the file system tracks the changes (see `VirtualFileSystem.get_changed_paths()`),
+        only the changed paths are checked. Otherwise, the whole workspace is listed.
+
+        :param known_paths: Paths of the files in the project state.
+        :param changed_paths: Paths changed since the last sync, or None if unknown.
+        :return: Tuple with the list of workspace files to compare with the known files,
+            and the list of known files that are no longer in the workspace.
+        """
+        if changed_paths is None:
+            files_in_workspace = await self.file_system.alist()
+            existing = set(files_in_workspace)
+            return files_in_workspace, [path for path in known_paths if path not in existing]
+
+        known_paths = set(known_paths)
+        candidates = []
+        removed = set()
+        for path in sorted(changed_paths):
+            if self.file_system.exists(path):
+                candidates.append(path)
+            elif path in known_paths:
+                removed.add(path)
+            else:
+                # Removed (or moved) directory
+                prefix = path + "/"
+                removed.update(p for p in known_paths if p.startswith(prefix) and not self.file_system.exists(p))
+        return candidates, sorted(removed)
+
+    async def filter_changed_files(self, candidates: list[str], known_files: dict[str, File]) -> list[str]:
+        """
+        Find the new and modified files among the candidates.
+
+        Comparing hashes avoids loading the saved file contents, and the VFS
+        doesn't need to read the files that haven't changed. The files are
+        hashed in the I/O thread pool. Files that can't be read (eg. binary
+        files) are skipped.
+
+        :param candidates: Paths of the workspace files to check.
+        :param known_files: Files in the project state, by path.
+        :return: Paths of the new and modified files.
+        """
+        known = [path for path in candidates if path in known_files]
+        hashes = dict(zip(known, await self.file_system.ahash_many(known, return_exceptions=True)))
+
+        changed = []
+        for path in candidates:
+            hash = hashes.get(path)
+            if isinstance(hash, Exception):
+                log.warning(f"Skipping file {path}: {hash}")
+            elif hash is None or hash != known_files[path].content_id:
+                changed.append(path)
+        return changed
+
+    async def read_files(self, paths: list[str]) -> dict[str, str]:
+        """
+        Read the files in the I/O thread pool, skipping the ones that can't be read.
+
+        :param paths: Paths of the files to read.
+        :return: File contents, by path.
+        """
+        contents = {}
+        for path, content in zip(paths, await self.file_system.aread_many(paths, return_exceptions=True)):
+            if isinstance(content, Exception):
+                log.warning(f"Skipping file {path}: {content}")
+            else:
+                contents[path] = content
+        return contents
+
     async def import_files(self) -> tuple[list[File], list[File]]:
         """
         Scan the file system, import new/modified files, delete removed files.
@@ -462,55 +1034,75 @@ class StateManager:
         :return: Tuple with the list of imported files and the list of removed files.
         """
         known_files = {file.path: file for file in self.current_state.files}
-        files_in_workspace = set()
+        changed_paths = self.file_system.get_changed_paths()
+        candidates, removed_paths = await self.find_workspace_changes(known_files, changed_paths)
         imported_files = []
         removed_files = []
 
-        for path in self.file_system.list():
-            files_in_workspace.add(path)
-            content = self.file_system.read(path)
-            saved_file = known_files.get(path)
-
-            if saved_file and saved_file.content.content == content:
-                continue
-
-            # TODO: unify this with self.save_file() / refactor that whole bit
+        changed = await self.filter_changed_files(candidates, known_files)
+        for path, content in (await self.read_files(changed)).items():
             hash = self.file_system.hash_string(content)
+            # TODO: unify this with self.save_file() / refactor that whole bit
             log.debug(f"Importing file {path} (hash={hash}, size={len(content)} bytes)")
-            file_content = await FileContent.store(self.current_session, hash, content)
+            async with self.db_blocker():
+                file_content = await FileContent.store(self.current_session, hash, content)
             file = self.next_state.save_file(path, file_content, external=True)
             imported_files.append(file)
 
-        for path, file in known_files.items():
-            if path not in files_in_workspace:
-                log.debug(f"File {path} was removed from workspace, deleting from project")
-                next_state_file = self.next_state.get_file_by_path(path)
-                self.next_state.files.remove(next_state_file)
-                removed_files.append(file.path)
+        for path in removed_paths:
+            log.debug(f"File {path} was removed from workspace, deleting from project")
+            next_state_file = self.next_state.get_file_by_path(path)
+            self.next_state.files.remove(next_state_file)
+            removed_files.append(path)
 
+        self.file_system.mark_synced(changed_paths)
+        self.file_system.save_cache()
         return imported_files, removed_files
 
-    async def restore_files(self) -> list[File]:
+    async def restore_files(self, dry_run: bool = False) -> RestoreReport:
         """
         Restore files from the database to VFS.
 
+        Only the files that differ from the project state (compared by content
+        hash) are written or removed, so the restore time depends on how much
+        the workspace diverged, and the unchanged files aren't touched (which
+        would eg. trigger dev server reloads).
+
         Warning: this could overwrite user's files on disk!
 
-        :return: List of restored files.
+        :param dry_run: Only report the changes, don't change any files.
+        :return: Report of the restored (or, in a dry run, divergent) files.
         """
         known_files = {file.path: file for file in self.current_state.files}
-        files_in_workspace = self.file_system.list()
-
-        for disk_f in files_in_workspace:
-            if disk_f not in known_files:
-                self.file_system.remove(disk_f)
-
-        restored_files = []
-        for path, file in known_files.items():
-            restored_files.append(file)
-            self.file_system.save(path, file.content.content)
-
-        return restored_files
+        changed_paths = self.file_system.get_changed_paths()
+        candidates, missing_paths = await self.find_workspace_changes(known_files, changed_paths)
+
+        report = RestoreReport(created=missing_paths)
+        known = [path for path in candidates if path in known_files]
+        for path, hash in zip(known, await self.file_system.ahash_many(known, return_exceptions=True)):
+            # Files that can't be read are overwritten as well
+            if isinstance(hash, Exception) or hash != known_files[path].content_id:
+                report.modified.append(path)
+        report.removed = [path for path in candidates if path not in known_files]
+
+        if dry_run:
+            log.debug(f"Restoring files would change the workspace: {report}")
+            return report
+
+        for path in report.removed:
+            self.file_system.remove(path)
+
+        to_write = [known_files[path] for path in report.created + report.modified]
+        # Only the files not in the workspace snapshots need to be loaded from the database
+        not_restored = set(await self.file_system.arestore_snapshot((file.path, file.content_id) for file in to_write))
+        to_write = [file for file in to_write if file.path in not_restored]
+        await self.load_file_contents(to_write)
+        await self.file_system.asave_many((file.path, file.content.content) for file in to_write)
+
+        self.file_system.mark_synced(changed_paths)
+        self.file_system.save_cache()
+        log.debug(f"Restored files: {report}")
+        return report
 
     async def get_modified_files(self) -> list[str]:
         """
@@ -519,21 +1111,18 @@ class StateManager:
         :return: List of paths for new or modified files.
         """
 
-        modified_files = []
-        files_in_workspace = self.file_system.list()
-        for path in files_in_workspace:
-            content = self.file_system.read(path)
-            saved_file = self.current_state.get_file_by_path(path)
-            if saved_file and saved_file.content.content == content:
-                continue
-            modified_files.append(path)
+        await self.current_state.awaitable_attrs.files
+        known_files = {f.path: f for f in self.current_state.files}
+        candidates, removed_paths = await self.find_workspace_changes(
+            known_files,
+            self.file_system.get_changed_paths(),
+        )
+        modified_files = await self.filter_changed_files(candidates, known_files)
 
         # Handle files removed from disk
-        await self.current_state.awaitable_attrs.files
-        for db_file in self.current_state.files:
-            if db_file.path not in files_in_workspace:
-                modified_files.append(db_file.path)
+        modified_files.extend(removed_paths)
 
+        self.file_system.save_cache()
         return modified_files
 
     async def get_modified_files_with_content(self) -> list[dict]:
@@ -545,41 +1134,69 @@ class StateManager:
                 and new content for new or modified files.
         """
 
-        modified_files = []
-        files_in_workspace = self.file_system.list()
+        await self.current_state.awaitable_attrs.files
+        known_files = {f.path: f for f in self.current_state.files}
+        candidates, removed_paths = await self.find_workspace_changes(
+            known_files,
+            self.file_system.get_changed_paths(),
+        )
 
-        for path in files_in_workspace:
-            content = self.file_system.read(path)
-            saved_file = self.current_state.get_file_by_path(path)
+        contents = await self.read_files(await self.filter_changed_files(candidates, known_files))
+        changed = [(path, known_files.get(path), content) for path, content in contents.items()]
 
-            # If there's a saved file, serialize its content; otherwise, set it to None
-            saved_file_content = saved_file.content.content if saved_file else None
+        # Handle files removed from disk
+        for path in removed_paths:
+            changed.append((path, self.current_state.get_file_by_path(path), ""))  # Empty string as the file is removed
+        self.file_system.save_cache()
 
-            if saved_file_content == content:
-                continue
+        # Only the old contents of the changed files are needed
+        await self.load_file_contents([f for _, f, _ in changed if f])
 
+        modified_files = []
+        for path, saved_file, content in changed:
             modified_files.append(
                 {
                     "path": path,
-                    "file_old": saved_file_content,  # Serialized content
+                    # If there's a saved file, serialize its content; otherwise, set it to None
+                    "file_old": saved_file.content.content if saved_file else None,
                     "file_new": content,
                 }
             )
 
-        # Handle files removed from disk
-        await self.current_state.awaitable_attrs.files
-        for db_file in self.current_state.files:
-            if db_file.path not in files_in_workspace:
-                modified_files.append(
-                    {
-                        "path": db_file.path,
-                        "file_old": db_file.content.content,  # Serialized content
-                        "file_new": "",  # Empty string as the file is removed
-                    }
-                )
-
         return modified_files
 
+    async def load_file_contents(self, files: Optional[list[File]] = None):
+        """
+        Load the contents of the files in the current state.
+
+        File contents are loaded on demand (see `FileContent.load()`), so this
+        must be called before accessing `file.content.content`, eg. before
+        rendering prompts that include the file contents.
+
+        :param files: Files to load the contents for (default: all files in the current state).
+        """
+        if files is None and "files" in self.current_state.__dict__:
+            files = self.current_state.files
+        if files is not None and all("content" in f.__dict__ for f in files):
+            # If all the contents are cached, there's no need to wait for the database
+            # session (eg. while the previous state is being committed in the background)
+            if not FileContent.load_cached([f.content for f in files]):
+                return
+
+        async with self.db_blocker():
+            await self.current_state.load_file_contents(files)
+
+    async def load_relevant_file_contents(self):
+        """
+        Load the contents of the files included in the agent prompts.
+
+        The prompts (see `partials/files_list.prompt`) include the relevant
+        and modified files of the current state, or all the files if there
+        are no relevant files.
+        """
+        state = self.current_state
+        await self.load_file_contents(state.relevant_file_objects if state.relevant_files else None)
+
     def workspace_is_empty(self) -> bool:
         """
         Returns whether the workspace has any files in them or is empty.
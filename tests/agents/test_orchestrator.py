@@ -56,6 +56,7 @@ async def test_import_if_new_files(agentcontext):
 
     assert len(sm.current_state.files) == 1
     assert sm.current_state.files[0].path == "foo.txt"
+    await sm.load_file_contents()
     assert sm.current_state.files[0].content.content == "bar"
 
 
@@ -77,6 +78,7 @@ async def test_import_if_modified_files(agentcontext):
 
     assert len(sm.current_state.files) == 1
     assert sm.current_state.files[0].path == "test.txt"
+    await sm.load_file_contents()
     assert sm.current_state.files[0].content.content == "bar"
 
 
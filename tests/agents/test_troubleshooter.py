@@ -2,6 +2,7 @@ import pytest
 
 from core.agents.troubleshooter import RouteFilePaths, Troubleshooter
 from core.db.models import File, FileContent
+from core.state.actor import UpdateState
 
 
 @pytest.mark.asyncio
@@ -29,3 +30,26 @@ async def test_route_files_are_included_in_the_prompt(agentcontext):
     user_msg_contents = [msg["content"] for msg in second_llm_call[0][0] if msg["role"] == "user"]
     assert "File 1 content" in user_msg_contents[1]  # Prompt at [1] has the route file contents
     assert "File 2 content" not in user_msg_contents[1]
+
+
+@pytest.mark.asyncio
+async def test_route_files_outside_relevant_files_are_loaded(agentcontext):
+    sm, _, ui, mock_get_llm = agentcontext
+
+    await sm.commit()
+    await sm.save_file("a.txt", "Relevant file content")
+    await sm.save_file("routes.js", "Route file content")
+    await sm.execute(UpdateState("tasks", [{"description": "Some task", "status": "todo", "instructions": "Test"}]))
+    await sm.execute(UpdateState("relevant_files", ["a.txt"]))
+    await sm.execute(UpdateState("modified_files", {}))
+    await sm.commit()
+
+    await sm.load_relevant_file_contents()
+    assert not sm.current_state.get_file_by_path("routes.js").content.is_loaded
+
+    ts = Troubleshooter(sm, ui)
+    ts.get_llm = mock_get_llm(side_effect=[RouteFilePaths(files=["routes.js"]), ""])
+    await ts.get_user_instructions()
+    second_llm_call = ts.get_llm().call_args_list[1]
+    user_msg_contents = [msg["content"] for msg in second_llm_call[0][0] if msg["role"] == "user"]
+    assert "Route file content" in user_msg_contents[1]
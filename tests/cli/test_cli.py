@@ -6,6 +6,8 @@ from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 
 from core.cli.helpers import (
+    LIST_PAGE_SIZE,
+    export_project,
     init,
     list_projects,
     list_projects_json,
@@ -14,10 +16,12 @@ from core.cli.helpers import (
     parse_arguments,
     parse_llm_endpoint,
     parse_llm_key,
+    parse_step_range,
     show_config,
 )
 from core.cli.main import async_main
 from core.config import Config, LLMProvider, loader
+from core.db.archive import ArchiveError
 
 
 def write_test_config(tmp_path):
@@ -49,6 +53,13 @@ def test_parse_arguments(mock_ArgumentParser):
         "--list-json",
         "--project",
         "--delete",
+        "--compact",
+        "--keep-steps",
+        "--export",
+        "--archive",
+        "--export-logs",
+        "--import-archive",
+        "--diff-steps",
         "--branch",
         "--step",
         "--llm-endpoint",
@@ -97,6 +108,23 @@ def test_parse_llm_key(value, expected):
         assert parsed_args == expected
 
 
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("1:5", (1, 5)),
+        ("1", ArgumentTypeError),
+        ("1:", ArgumentTypeError),
+        ("a:b", ArgumentTypeError),
+    ],
+)
+def test_parse_step_range(value, expected):
+    if isinstance(expected, tuple):
+        assert parse_step_range(value) == expected
+    else:
+        with pytest.raises(expected):
+            parse_step_range(value)
+
+
 @patch("core.cli.helpers.import_from_dotenv")
 def test_load_config_not_found(mock_import_from_dotenv, tmp_path, capsys):
     config_file = tmp_path / "config.json"
@@ -168,11 +196,7 @@ async def test_list_projects_json(mock_StateManager, capsys):
 
     branch = MagicMock(
         id=MagicMock(hex="1234"),
-        states=[
-            MagicMock(step_index=1, action="foo", created_at=datetime(2021, 1, 1)),
-            MagicMock(step_index=2, action=None, created_at=datetime(2021, 1, 2)),
-            MagicMock(step_index=3, action="baz", created_at=datetime(2021, 1, 3)),
-        ],
+        head=MagicMock(step_index=3, updated_at=datetime(2021, 1, 3)),
     )
     branch.name = "branch1"
 
@@ -182,10 +206,12 @@ async def test_list_projects_json(mock_StateManager, capsys):
     )
     project.name = "project1"
     sm.list_projects = AsyncMock(return_value=[project])
+    sm.list_branch_steps = AsyncMock(return_value={branch.id: [(1, "foo"), (2, None), (3, "baz")]})
     await list_projects_json(None)
 
     mock_StateManager.assert_called_once_with(None)
-    sm.list_projects.assert_awaited_once_with()
+    sm.list_projects.assert_awaited_once_with(after=None, limit=LIST_PAGE_SIZE)
+    sm.list_branch_steps.assert_awaited_once_with([branch.id])
 
     data = json.loads(capsys.readouterr().out)
 
@@ -214,13 +240,7 @@ async def test_list_projects_json(mock_StateManager, capsys):
 async def test_list_projects(mock_StateManager, capsys):
     sm = mock_StateManager.return_value
 
-    branch = MagicMock(
-        id="1234",
-        states=[
-            MagicMock(step_index=1),
-            MagicMock(step_index=2),
-        ],
-    )
+    branch = MagicMock(id="1234", head=MagicMock(step_index=2))
     branch.name = "branch1"
 
     project = MagicMock(
@@ -232,12 +252,30 @@ async def test_list_projects(mock_StateManager, capsys):
     await list_projects(None)
 
     mock_StateManager.assert_called_once_with(None)
-    sm.list_projects.assert_awaited_once_with()
+    sm.list_projects.assert_awaited_once_with(after=None, limit=LIST_PAGE_SIZE)
 
     data = capsys.readouterr().out
 
     assert "* project1 (abcd)" in data
-    assert "- branch1 (1234)" in data
+    assert "- branch1 (1234) - last step: 2" in data
+
+
+@pytest.mark.asyncio
+@patch("core.cli.helpers.LIST_PAGE_SIZE", 2)
+@patch("core.cli.helpers.StateManager")
+async def test_list_projects_pages(mock_StateManager, capsys):
+    sm = mock_StateManager.return_value
+
+    projects = []
+    for name in ["a", "b", "c"]:
+        project = MagicMock(id=name * 4, branches=[])
+        project.name = name
+        projects.append(project)
+    sm.list_projects = AsyncMock(side_effect=[projects[:2], projects[2:]])
+    await list_projects(None)
+
+    assert sm.list_projects.await_args_list[1].kwargs == {"after": ("b", "bbbb"), "limit": 2}
+    assert "Available projects (3):" in capsys.readouterr().out
 
 
 @pytest.mark.asyncio
@@ -265,6 +303,19 @@ async def test_load_project(args, kwargs, retval, capsys):
         assert "not found" in data
 
 
+@pytest.mark.asyncio
+@patch("core.cli.helpers.ProjectExporter")
+@patch("core.cli.helpers.Project")
+async def test_export_project_error(mock_Project, mock_ProjectExporter, capsys):
+    mock_Project.get_by_id = AsyncMock(return_value=MagicMock(folder_name="test"))
+    mock_ProjectExporter.return_value.export = AsyncMock(side_effect=ArchiveError("Can't create archive"))
+
+    success = await export_project(MagicMock(), "abc", "missing/test.zip")
+
+    assert success is False
+    assert "Can't create archive" in capsys.readouterr().err
+
+
 def test_init(tmp_path):
     config_file = write_test_config(tmp_path)
 
@@ -289,6 +340,12 @@ def test_init(tmp_path):
         (["--project", "ca7a0cc9-767f-472a-aefb-0c8d3377c9bc"], False, False),
         (["--branch", "ca7a0cc9-767f-472a-aefb-0c8d3377c9bc"], False, False),
         (["--step", "123"], False, False),
+        (["--compact", "ca7a0cc9-767f-472a-aefb-0c8d3377c9bc"], False, False),
+        (["--compact", "ca7a0cc9-767f-472a-aefb-0c8d3377c9bc", "--keep-steps", "10"], False, False),
+        (["--export", "ca7a0cc9-767f-472a-aefb-0c8d3377c9bc"], False, False),
+        (["--import-archive", "does-not-exist.zip"], False, False),
+        (["--diff-steps", "1:2"], False, False),
+        (["--diff-steps", "1:2", "--project", "ca7a0cc9-767f-472a-aefb-0c8d3377c9bc"], False, False),
         ([], True, True),
     ],
 )
@@ -94,6 +94,13 @@ def test_unsupported_provider():
     assert "agent.default.provider" in str(einfo.value)
 
 
+def test_negative_mirror_size():
+    with pytest.raises(ValidationError) as einfo:
+        ConfigLoader.from_json(json.dumps({"fs": {"mirror_size": -1}}))
+
+    assert "fs.mirror_size" in str(einfo.value)
+
+
 def test_load_from_file_with_comments():
     config_path = join(dirname(__file__), "testconfig.json")
 
@@ -0,0 +1,148 @@
+from uuid import uuid4
+from zipfile import ZipFile
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+from core.config import DBConfig
+from core.db.archive import ArchiveError, ProjectExporter, ProjectImporter
+from core.db.models import Base, Branch, BranchHead, FileContent, Project, ProjectState, UserInput
+from core.db.session import SessionManager
+from core.ui.base import UserInput as UserInputData
+
+from .factories import create_project_state
+
+
+async def create_project(session) -> ProjectState:
+    state = create_project_state()
+    session.add(state)
+    await session.commit()
+
+    for i in range(3):
+        state = await state.create_next_state()
+        state.tasks = state.tasks + [{"description": f"task {i}"}]
+        content = await FileContent.store(session, f"hash-{i}", f"content {i}")
+        state.save_file(f"file{i}.txt", content)
+        # The same content in two files is stored only once
+        state.save_file(f"copy{i}.txt", content)
+        UserInput.from_user_input(state, "question?", UserInputData(text=f"answer {i}"))
+        await session.commit()
+
+    return state
+
+
+@pytest_asyncio.fixture
+async def target_db(tmp_path):
+    manager = SessionManager(DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/target.db"))
+    async with manager.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with manager as session:
+        yield session
+
+
+@pytest.mark.asyncio
+async def test_export_import_roundtrip(testdb, target_db, tmp_path):
+    state = await create_project(testdb)
+    project_id = state.branch.project_id
+    archive = tmp_path / "project.zip"
+
+    counts = await ProjectExporter(testdb, project_id).export(archive)
+    assert counts["project_states"] == 4
+    assert counts["files"] == 2 + 4 + 6
+    assert counts["file_contents"] == 3
+    assert "user_inputs" not in counts
+
+    with ZipFile(archive) as zf:
+        assert sorted(name for name in zf.namelist() if name.startswith("contents/")) == [
+            "contents/hash-0",
+            "contents/hash-1",
+            "contents/hash-2",
+        ]
+
+    assert await ProjectImporter(target_db).import_archive(archive) == project_id
+
+    project = await Project.get_by_id(target_db, project_id)
+    branch = await project.get_branch()
+    last_state = await branch.get_last_state()
+    await last_state.load_file_contents()
+    assert last_state.step_index == 4
+    assert last_state.tasks == state.tasks
+    assert {f.path: f.content.content for f in last_state.files} == {
+        "file0.txt": "content 0",
+        "copy0.txt": "content 0",
+        "file1.txt": "content 1",
+        "copy1.txt": "content 1",
+        "file2.txt": "content 2",
+        "copy2.txt": "content 2",
+    }
+
+    head = (await target_db.execute(select(BranchHead).where(BranchHead.branch_id == branch.id))).scalar_one()
+    assert head.step_index == 4
+    assert (await target_db.execute(select(func.count()).select_from(UserInput))).scalar_one() == 0
+
+    with pytest.raises(ArchiveError, match="already exists"):
+        await ProjectImporter(target_db).import_archive(archive)
+
+
+@pytest.mark.asyncio
+async def test_export_import_with_logs(testdb, target_db, tmp_path):
+    state = await create_project(testdb)
+    archive = tmp_path / "project.zip"
+
+    counts = await ProjectExporter(testdb, state.branch.project_id, include_logs=True).export(archive)
+    assert counts["user_inputs"] == 3
+
+    await ProjectImporter(target_db).import_archive(archive)
+    answers = (await target_db.execute(select(UserInput.answer_text).order_by(UserInput.id))).scalars().all()
+    assert answers == ["answer 0", "answer 1", "answer 2"]
+
+
+@pytest.mark.asyncio
+async def test_export_missing_project(testdb, tmp_path):
+    with pytest.raises(ArchiveError, match="not found"):
+        await ProjectExporter(testdb, uuid4()).export(tmp_path / "project.zip")
+    assert not (tmp_path / "project.zip").exists()
+
+
+@pytest.mark.asyncio
+async def test_export_archive_cant_be_created(testdb, tmp_path):
+    state = await create_project(testdb)
+    exporter = ProjectExporter(testdb, state.branch.project_id)
+
+    with pytest.raises(ArchiveError, match="Can't create archive"):
+        await exporter.export(tmp_path / "missing" / "project.zip")
+
+    # The path is a directory
+    with pytest.raises(ArchiveError, match="Can't create archive"):
+        await exporter.export(tmp_path)
+    assert tmp_path.is_dir()
+
+
+@pytest.mark.asyncio
+async def test_import_invalid_archive(testdb, tmp_path):
+    archive = tmp_path / "project.zip"
+    with ZipFile(archive, "w") as zf:
+        zf.writestr("something.txt", "hello")
+
+    with pytest.raises(ArchiveError, match="not a project archive"):
+        await ProjectImporter(testdb).import_archive(archive)
+
+
+@pytest.mark.asyncio
+async def test_export_import_forked_branches(testdb, target_db, tmp_path):
+    state = await create_project(testdb)
+    fork = await state.branch.fork(2)
+    fork_state = await (await fork.get_last_state()).create_next_state(branch=fork)
+    await testdb.commit()
+    # Parent branches are imported before the forks, whatever the export order
+    nested = await fork.fork(3)
+    await testdb.commit()
+
+    archive = tmp_path / "project.zip"
+    await ProjectExporter(testdb, state.branch.project_id).export(archive)
+    await ProjectImporter(target_db).import_archive(archive)
+
+    imported = await Branch.get_by_id(target_db, nested.id)
+    assert imported.parent_id == fork.id
+    assert (await imported.get_last_state()).id == fork_state.id
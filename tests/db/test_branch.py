@@ -1,8 +1,10 @@
 from uuid import uuid4
 
 import pytest
+from sqlalchemy import func, select
 
-from core.db.models import Branch, Project
+from core.db.models import Branch, File, FileContent, Project, ProjectState, UserInput
+from core.db.models.project_state import TaskStatus
 
 from .factories import create_project_state
 
@@ -66,3 +68,262 @@ async def test_get_last_state_no_session():
 
     with pytest.raises(ValueError):
         await branch.get_last_state()
+
+
+async def _create_history(testdb, n_states):
+    state = create_project_state()
+    state.files.append(File(path="common.txt", content=FileContent(id="common", content="common")))
+    testdb.add(state)
+    await testdb.commit()
+
+    states = [state]
+    for _ in range(n_states - 1):
+        state = await state.create_next_state()
+        await testdb.commit()
+        states.append(state)
+
+    return states
+
+
+@pytest.mark.asyncio
+async def test_compact_keeps_first_and_last_states(testdb):
+    states = await _create_history(testdb, 10)
+    branch = states[0].branch
+
+    n_squashed = await branch.compact(3)
+    await testdb.commit()
+
+    assert n_squashed == 6
+    result = await testdb.execute(
+        select(ProjectState.step_index, ProjectState.prev_state_id)
+        .where(ProjectState.branch_id == branch.id)
+        .order_by(ProjectState.step_index)
+    )
+    rows = result.all()
+    assert [r.step_index for r in rows] == [1, 8, 9, 10]
+    assert rows[0].prev_state_id is None
+    assert rows[1].prev_state_id == states[0].id
+    assert rows[2].prev_state_id == states[7].id
+    assert rows[3].prev_state_id == states[8].id
+
+    # Common content is still used by the remaining states
+    assert (await testdb.execute(select(FileContent).where(FileContent.id == "common"))).scalar_one_or_none()
+
+
+@pytest.mark.asyncio
+async def test_compact_nothing_to_squash(testdb):
+    states = await _create_history(testdb, 4)
+    assert await states[0].branch.compact(3) == 0
+
+
+@pytest.mark.asyncio
+async def test_compact_keeps_task_boundaries(testdb):
+    state = create_project_state()
+    state.tasks = [{"description": "a", "status": "todo"}, {"description": "b", "status": "todo"}]
+    testdb.add(state)
+    await testdb.commit()
+
+    states = [state]
+    for i in range(7):
+        state = await state.create_next_state()
+        if i == 2:
+            state.tasks[0]["status"] = TaskStatus.DONE
+        await testdb.commit()
+        states.append(state)
+
+    branch = states[0].branch
+    await branch.compact(1)
+    await testdb.commit()
+
+    result = await testdb.execute(
+        select(ProjectState.step_index).where(ProjectState.branch_id == branch.id).order_by(ProjectState.step_index)
+    )
+    assert result.scalars().all() == [1, 4, 8]
+
+    await branch.compact(1, keep_task_boundaries=False)
+    await testdb.commit()
+
+    result = await testdb.execute(
+        select(ProjectState.step_index).where(ProjectState.branch_id == branch.id).order_by(ProjectState.step_index)
+    )
+    assert result.scalars().all() == [1, 8]
+
+
+@pytest.mark.asyncio
+async def test_compact_deletes_orphaned_contents_and_logs(testdb):
+    states = await _create_history(testdb, 2)
+
+    # A temporary file that only exists in the (to be squashed) third state
+    state = await states[-1].create_next_state()
+    state.files.append(File(path="tmp.txt", content=FileContent(id="tmp", content="tmp")))
+    await testdb.commit()
+    states.append(state)
+
+    state = await state.create_next_state()
+    state.files = [f for f in state.files if f.path != "tmp.txt"]
+    await testdb.commit()
+    states.append(state)
+
+    branch = states[0].branch
+    testdb.add(
+        UserInput(
+            branch=branch,
+            project_state=states[2],
+            question="q",
+            answer_text="a",
+            answer_button=None,
+            cancelled=False,
+        )
+    )
+    await testdb.commit()
+
+    assert await branch.compact(1) == 2
+    await testdb.commit()
+
+    result = await testdb.execute(select(FileContent.id))
+    assert result.scalars().all() == ["common"]
+    assert (await testdb.execute(select(func.count()).select_from(UserInput))).scalar_one() == 0
+
+
+@pytest.mark.asyncio
+async def test_compact_keeps_logs(testdb):
+    states = await _create_history(testdb, 6)
+    branch = states[0].branch
+    testdb.add(
+        UserInput(
+            branch=branch,
+            project_state=states[2],
+            question="q",
+            answer_text="a",
+            answer_button=None,
+            cancelled=False,
+        )
+    )
+    await testdb.commit()
+
+    await branch.compact(2, keep_logs=True)
+    await testdb.commit()
+
+    ui = (await testdb.execute(select(UserInput))).scalar_one()
+    assert ui.branch_id == branch.id
+    assert ui.project_state_id is None
+
+
+@pytest.mark.asyncio
+async def test_compact_stores_relinked_states_as_snapshots(testdb):
+    state = create_project_state()
+    testdb.add(state)
+    await testdb.commit()
+    branch = state.branch
+
+    for i in range(6):
+        state = await state.create_next_state()
+        state.steps = state.steps + [{"id": i}]
+        await testdb.commit()
+
+    await branch.compact(2, keep_task_boundaries=False)
+    await testdb.commit()
+
+    result = await testdb.execute(
+        select(ProjectState.step_index, ProjectState.delta.is_(None))
+        .where(ProjectState.branch_id == branch.id)
+        .order_by(ProjectState.step_index)
+    )
+    assert result.all() == [(1, True), (6, True), (7, False)]
+
+    testdb.expunge_all()
+    branch = await Branch.get_by_id(testdb, branch.id)
+    last_state = await branch.get_last_state()
+    assert last_state.steps == [{"id": i} for i in range(6)]
+
+
+@pytest.mark.asyncio
+async def test_fork_shares_parent_states(testdb):
+    states = await _create_history(testdb, 5)
+    for i, state in enumerate(states):
+        state.tasks = [{"description": f"task {i}"}]
+    await testdb.commit()
+    parent = states[0].branch
+
+    fork = await parent.fork(3)
+    await testdb.commit()
+
+    assert fork.name == "main@3"
+    assert fork.parent_id == parent.id
+    assert fork.fork_step_index == 3
+    assert await fork.get_last_step_index() == 3
+
+    # No states are copied: the fork reads the shared ones from the parent
+    result = await testdb.execute(select(func.count()).where(ProjectState.branch_id == fork.id))
+    assert result.scalar_one() == 0
+    last_state = await fork.get_last_state()
+    assert last_state.id == states[2].id
+    assert (await fork.get_state_at_step(2)).id == states[1].id
+    assert await fork.get_state_at_step(4) is None
+
+    # The parent branch is intact
+    assert await parent.get_last_step_index() == 5
+    assert (await parent.get_last_state()).id == states[4].id
+
+    new_state = await last_state.create_next_state(branch=fork)
+    new_state.tasks = new_state.tasks + [{"description": "forked"}]
+    await testdb.commit()
+
+    assert new_state.branch_id == fork.id
+    assert new_state.step_index == 4
+    assert new_state.prev_state_id is None
+    assert new_state.delta is None
+    assert await fork.get_last_step_index() == 4
+
+    steps = await Branch.get_steps(testdb, [parent.id, fork.id])
+    assert [step for step, _ in steps[parent.id]] == [1, 2, 3, 4, 5]
+    assert [step for step, _ in steps[fork.id]] == [1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_fork_names(testdb):
+    states = await _create_history(testdb, 3)
+    parent = states[0].branch
+
+    assert (await parent.fork(2)).name == "main@2"
+    assert (await parent.fork(2)).name == "main@2.2"
+    assert (await parent.fork(1, name="experiment")).name == "experiment"
+
+    with pytest.raises(ValueError):
+        await parent.fork(4)
+
+
+@pytest.mark.asyncio
+async def test_fork_of_fork(testdb):
+    states = await _create_history(testdb, 5)
+    fork = await states[0].branch.fork(4)
+    await testdb.commit()
+
+    fork_state = await (await fork.get_last_state()).create_next_state(branch=fork)
+    await testdb.commit()
+
+    nested = await fork.fork(2)
+    await testdb.commit()
+    assert nested.name == "main@4@2"
+    assert (await nested.get_last_state()).id == states[1].id
+    assert (await fork.get_state_at_step(5)).id == fork_state.id
+
+    steps = await Branch.get_steps(testdb, [nested.id])
+    assert [step for step, _ in steps[nested.id]] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_compact_keeps_fork_points(testdb):
+    states = await _create_history(testdb, 10)
+    branch = states[0].branch
+    fork = await branch.fork(4)
+    await testdb.commit()
+
+    assert await branch.compact(3) == 5
+    await testdb.commit()
+
+    result = await testdb.execute(
+        select(ProjectState.step_index).where(ProjectState.branch_id == branch.id).order_by(ProjectState.step_index)
+    )
+    assert result.scalars().all() == [1, 4, 8, 9, 10]
+    assert (await fork.get_last_state()).id == states[3].id
@@ -0,0 +1,53 @@
+from core.db.content_cache import ContentCache
+
+
+def test_content_cache_get_put():
+    cache = ContentCache(max_size=100)
+
+    assert cache.get("a") is None
+    cache.put("a", "hello")
+    assert cache.get("a") == "hello"
+    assert "a" in cache
+    assert len(cache) == 1
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["size"] == 5
+
+
+def test_content_cache_evicts_least_recently_used():
+    cache = ContentCache(max_size=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+
+    # Touch "a" so that "b" is the least recently used
+    cache.get("a")
+    cache.put("c", "cccc")
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.size == 8
+    assert cache.evictions == 1
+
+
+def test_content_cache_skips_oversized_content():
+    cache = ContentCache(max_size=3)
+    cache.put("a", "aaaa")
+    assert "a" not in cache
+    assert cache.size == 0
+
+
+def test_content_cache_resize():
+    cache = ContentCache(max_size=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+
+    cache.resize(5)
+    assert "a" not in cache
+    assert "b" in cache
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
@@ -1,9 +1,22 @@
+import json
+import shutil
+import sqlite3
+import subprocess
+import sys
+from os.path import dirname, join
+from unittest.mock import patch
+
 import pytest
-from sqlalchemy import func, select
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import func, select, text
+from sqlalchemy.pool import StaticPool
 
 from core.config import DBConfig
 from core.db.models import Project, ProjectState
-from core.db.setup import run_migrations
+from core.db.session import SessionManager
+from core.db.setup import HEAD_REVISION, get_schema_revision, run_migrations
 
 from .factories import create_project_state
 
@@ -13,6 +26,145 @@ def test_migrations(tmp_path):
     run_migrations(db_cfg)
 
 
+def test_head_revision_matches_migrations():
+    alembic_cfg = Config(join(dirname(dirname(dirname(__file__))), "core", "db", "alembic.ini"))
+    assert ScriptDirectory.from_config(alembic_cfg).get_current_head() == HEAD_REVISION
+
+
+def test_get_schema_revision(tmp_path):
+    assert get_schema_revision(f"sqlite:///{tmp_path}/missing.db") is None
+    assert get_schema_revision("sqlite:///:memory:") is None
+
+    sqlite3.connect(tmp_path / "empty.db").close()
+    assert get_schema_revision(f"sqlite:///{tmp_path}/empty.db") is None
+
+    run_migrations(DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/test.db"))
+    assert get_schema_revision(f"sqlite:///{tmp_path}/test.db") == HEAD_REVISION
+
+    # Paths with characters that have a special meaning in URIs
+    special_dir = tmp_path / "my #1 project 100%"
+    special_dir.mkdir()
+    shutil.copy(tmp_path / "test.db", special_dir / "test.db")
+    assert get_schema_revision(f"sqlite:///{special_dir}/test.db") == HEAD_REVISION
+
+
+@patch("alembic.command.upgrade")
+def test_run_migrations_skips_alembic_when_up_to_date(mock_upgrade, tmp_path):
+    db_cfg = DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/test.db")
+    with sqlite3.connect(tmp_path / "test.db") as conn:
+        conn.execute("CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)")
+        conn.execute("INSERT INTO alembic_version VALUES ('3968d770fb0c')")
+
+    run_migrations(db_cfg)
+    mock_upgrade.assert_called_once()
+
+    mock_upgrade.reset_mock()
+    with sqlite3.connect(tmp_path / "test.db") as conn:
+        conn.execute("UPDATE alembic_version SET version_num = ?", (HEAD_REVISION,))
+
+    run_migrations(db_cfg)
+    mock_upgrade.assert_not_called()
+
+
+def test_startup_with_up_to_date_schema_doesnt_load_alembic(tmp_path):
+    run_migrations(DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/test.db"))
+
+    code = (
+        "import sys, time\n"
+        "from core.config import DBConfig\n"
+        "from core.db.setup import run_migrations\n"
+        "start = time.perf_counter()\n"
+        f"run_migrations(DBConfig(url='sqlite+aiosqlite:///{tmp_path}/test.db'))\n"
+        "print('alembic' in sys.modules, time.perf_counter() - start)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=dirname(dirname(dirname(__file__))),
+        check=True,
+    )
+    alembic_loaded, elapsed = result.stdout.split()
+    assert alembic_loaded == "False"
+    assert float(elapsed) < 1.0
+
+
+@pytest.mark.asyncio
+async def test_downgrade_materializes_state_patches(tmp_path):
+    db_cfg = DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/test.db")
+    run_migrations(db_cfg)
+
+    async with SessionManager(db_cfg) as session:
+        state = create_project_state()
+        session.add(state)
+        await session.commit()
+        for i in range(3):
+            state = await state.create_next_state()
+            state.tasks = state.tasks + [{"description": f"task {i}"}]
+            await session.commit()
+
+    alembic_cfg = Config(join(dirname(dirname(dirname(__file__))), "core", "db", "alembic.ini"))
+    alembic_cfg.set_main_option("sqlalchemy.url", f"sqlite:///{tmp_path}/test.db")
+    alembic_cfg.set_main_option("pythagora_runtime", "true")
+    command.downgrade(alembic_cfg, "101d22e8e2e2")
+
+    with sqlite3.connect(tmp_path / "test.db") as conn:
+        rows = conn.execute("SELECT tasks FROM project_states ORDER BY step_index").fetchall()
+    assert [len(json.loads(row[0])) for row in rows] == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_upgrade_populates_branch_heads(tmp_path):
+    db_cfg = DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/test.db")
+    run_migrations(db_cfg)
+
+    async with SessionManager(db_cfg) as session:
+        state = create_project_state()
+        session.add(state)
+        await session.commit()
+        state = await state.create_next_state()
+        await session.commit()
+
+    alembic_cfg = Config(join(dirname(dirname(dirname(__file__))), "core", "db", "alembic.ini"))
+    alembic_cfg.set_main_option("sqlalchemy.url", f"sqlite:///{tmp_path}/test.db")
+    alembic_cfg.set_main_option("pythagora_runtime", "true")
+    command.downgrade(alembic_cfg, "3968d770fb0c")
+    command.upgrade(alembic_cfg, "head")
+
+    with sqlite3.connect(tmp_path / "test.db") as conn:
+        rows = conn.execute("SELECT branch_id, state_id, step_index FROM branch_heads").fetchall()
+    assert rows == [(state.branch_id.hex, state.id.hex, 2)]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_connection_settings(tmp_path):
+    db_cfg = DBConfig(
+        url=f"sqlite+aiosqlite:///{tmp_path}/test.db",
+        sqlite={"synchronous": "FULL", "cache_size": -1024, "busy_timeout": 1234},
+    )
+    manager = SessionManager(db_cfg)
+    assert isinstance(manager.engine.pool, StaticPool)
+
+    async with manager as session:
+        pragmas = {
+            name: (await session.execute(text(f"PRAGMA {name}"))).scalar_one()
+            for name in ["synchronous", "cache_size", "busy_timeout", "temp_store", "journal_mode"]
+        }
+    assert pragmas == {
+        "synchronous": 2,
+        "cache_size": -1024,
+        "busy_timeout": 1234,
+        "temp_store": 2,
+        "journal_mode": "wal",
+    }
+
+
+def test_sqlite_connection_per_session(tmp_path):
+    db_cfg = DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/test.db", sqlite={"persistent_connection": False})
+    manager = SessionManager(db_cfg)
+    assert not isinstance(manager.engine.pool, StaticPool)
+
+
 @pytest.mark.asyncio
 async def test_select_empty(testdb):
     q = await testdb.execute(select(func.count()).select_from(Project))
@@ -0,0 +1,42 @@
+from copy import deepcopy
+
+import pytest
+
+from core.db.json_patch import apply_patch, make_patch
+
+
+@pytest.mark.parametrize(
+    ("old", "new"),
+    [
+        ([], []),
+        ([], [{"a": 1}]),
+        ([{"a": 1}, {"b": 2}], [{"a": 1}]),
+        ([{"status": "todo"}], [{"status": "done"}]),
+        ({"a/b": "x", "c~d": "y"}, {"a/b": "z"}),
+        ({"a": [1, 2, 3]}, {"a": [1, 5], "b": None}),
+        (None, ["file.py"]),
+        (["file.py"], None),
+        ([1, 2, 3], [0, 1, 2, 3]),
+    ],
+)
+def test_make_and_apply_patch(old, new):
+    patch = make_patch(old, new)
+    assert apply_patch(deepcopy(old), patch) == new
+
+
+def test_make_patch_is_minimal():
+    tasks = [{"description": f"task {i}", "status": "todo"} for i in range(100)]
+    new_tasks = deepcopy(tasks)
+    new_tasks[42]["status"] = "done"
+
+    assert make_patch(tasks, new_tasks) == [{"op": "replace", "path": "/42/status", "value": "done"}]
+    assert make_patch(tasks, tasks) == []
+
+
+def test_apply_patch_copies_values():
+    value = {"a": [1]}
+    patch = make_patch([], [value])
+
+    doc = apply_patch([], patch)
+    doc[0]["a"].append(2)
+    assert value == {"a": [1]}
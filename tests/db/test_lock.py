@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from core.db.lock import SessionLock
+
+
+@pytest.mark.asyncio
+async def test_session_lock_uncontended():
+    lock = SessionLock()
+
+    async with lock():
+        assert lock.locked()
+
+    assert not lock.locked()
+    stats = lock.stats()
+    assert stats["acquisitions"] == 1
+    assert stats["contended"] == 0
+    assert stats["max_queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_session_lock_serializes_in_fifo_order():
+    lock = SessionLock()
+    order = []
+
+    async def worker(n):
+        async with lock():
+            order.append(n)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[worker(n) for n in range(5)])
+
+    assert order == [0, 1, 2, 3, 4]
+    stats = lock.stats()
+    assert stats["acquisitions"] == 5
+    assert stats["contended"] == 4
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 4
+    assert stats["max_wait_time"] > 0
+
+
+@pytest.mark.asyncio
+async def test_session_lock_released_on_error():
+    lock = SessionLock()
+
+    with pytest.raises(ValueError):
+        async with lock():
+            raise ValueError("boom")
+
+    assert not lock.locked()
+
+
+def test_session_lock_created_outside_event_loop():
+    # The lock can be created before the event loop that uses it
+    lock = SessionLock()
+    assert not lock.locked()
+
+    async def use_lock():
+        async with lock():
+            assert lock.locked()
+
+    asyncio.run(use_lock())
+    assert lock.stats()["acquisitions"] == 1
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core.config import DBConfig
+from core.db.pool import MeteredQueuePool, PoolMetrics
+from core.db.session import SessionManager
+
+
+def test_pool_metrics():
+    metrics = PoolMetrics()
+    metrics.record(0.1)
+    metrics.record(0.3)
+    metrics.record(0.5, timed_out=True)
+
+    stats = metrics.stats()
+    assert stats["checkouts"] == 2
+    assert stats["timeouts"] == 1
+    assert stats["max_wait"] == 0.5
+    assert stats["avg_wait"] == pytest.approx(0.3)
+
+    metrics.reset()
+    assert metrics.stats()["checkouts"] == 0
+
+
+@pytest.mark.asyncio
+async def test_metered_pool_records_checkout_wait(tmp_path):
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path}/test.db",
+        poolclass=MeteredQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    metrics = engine.pool.metrics
+
+    async def hold_connection(delay):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await asyncio.sleep(delay)
+
+    # The second checkout has to wait for the first connection to be returned
+    await asyncio.gather(hold_connection(0.05), hold_connection(0))
+    assert metrics.checkouts == 2
+    assert metrics.max_wait >= 0.04
+
+    results = await asyncio.gather(hold_connection(0.3), hold_connection(0), return_exceptions=True)
+    assert isinstance(results[1], exc.TimeoutError)
+    assert metrics.timeouts == 1
+
+    # The metrics survive the pool being recreated
+    await engine.dispose()
+    assert engine.pool.metrics is metrics
+    await engine.dispose()
+
+
+def test_pool_stats_not_available_for_sqlite():
+    manager = SessionManager(DBConfig(url="sqlite+aiosqlite:///:memory:"))
+    assert manager.pool_stats() is None
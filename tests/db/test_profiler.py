@@ -0,0 +1,109 @@
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql.asyncpg import AsyncAdapt_asyncpg_cursor
+from sqlalchemy.dialects.sqlite.aiosqlite import AsyncAdapt_aiosqlite_cursor
+
+from core.config import DBConfig
+from core.db.models import Base, Project
+from core.db.profiler import QueryProfiler, fingerprint
+from core.db.session import ADAPTER_ROWS_ATTR, SessionManager
+
+
+@pytest.mark.parametrize(
+    ("statement", "expected"),
+    [
+        ("SELECT * FROM t WHERE id = ?", "SELECT * FROM t WHERE id = ?"),
+        ("SELECT *\n  FROM t\n  WHERE name = 'x''y' AND n = 42", "SELECT * FROM t WHERE name = ? AND n = ?"),
+        ("SELECT * FROM t WHERE id = $1 AND x = $2", "SELECT * FROM t WHERE id = ? AND x = ?"),
+        ("SELECT * FROM t WHERE id IN (?, ?, ?)", "SELECT * FROM t WHERE id IN (?, ...)"),
+        ("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)", "INSERT INTO t (a, b) VALUES (?, ?), ..."),
+        ("SELECT anon_1.id FROM t1 AS anon_1 LIMIT 10", "SELECT anon_1.id FROM t1 AS anon_1 LIMIT ?"),
+    ],
+)
+def test_fingerprint(statement, expected):
+    assert fingerprint(statement) == expected
+
+
+def test_profiler_aggregates_statements():
+    profiler = QueryProfiler(enabled=True)
+    for i in range(1, 11):
+        profiler.record(f"SELECT * FROM t WHERE id IN ({', '.join(['?'] * i)})", i / 1000, rows=i)
+    profiler.record("DELETE FROM t", 0.001, rows=3)
+
+    stats = profiler.stats()
+    assert len(stats) == 2
+    select_stats = stats[0]
+    assert select_stats["statement"] == "SELECT * FROM t WHERE id IN (?, ...)"
+    assert select_stats["count"] == 10
+    assert select_stats["total_time"] == pytest.approx(0.055)
+    assert select_stats["p50"] == pytest.approx(0.006)
+    assert select_stats["p95"] == pytest.approx(0.010)
+    assert select_stats["max_time"] == pytest.approx(0.010)
+    assert select_stats["rows"] == 55
+
+    assert profiler.stats(top=1) == [select_stats]
+
+    report = profiler.report(top=1)
+    assert "11 SQL statements (2 distinct)" in report
+    assert "SELECT * FROM t WHERE id IN (?, ...)" in report
+    assert "DELETE FROM t" not in report
+
+    profiler.reset()
+    assert profiler.stats() == []
+
+
+@pytest.mark.parametrize("cursor_class", [AsyncAdapt_aiosqlite_cursor, AsyncAdapt_asyncpg_cursor])
+def test_async_adapter_cursors_buffer_rows(cursor_class):
+    # The profiler counts the returned rows in the (private) row buffer of the adapter cursors
+    assert ADAPTER_ROWS_ATTR in cursor_class.__slots__
+
+
+@pytest.mark.asyncio
+async def test_session_manager_profiler(tmp_path):
+    manager = SessionManager(DBConfig(url=f"sqlite+aiosqlite:///{tmp_path}/test.db"))
+    async with manager.engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    # Disabled by default
+    async with manager as session:
+        await session.execute(select(Project))
+    assert manager.profiler.stats() == []
+
+    # Can be enabled at runtime
+    manager.profiler.enable()
+    async with manager as session:
+        session.add_all([Project(name="a"), Project(name="b")])
+        await session.commit()
+        await session.execute(select(Project))
+        await session.execute(select(Project))
+
+    stats = {s["statement"].split()[0]: s for s in manager.profiler.stats()}
+    assert stats["SELECT"]["count"] == 2
+    assert stats["SELECT"]["rows"] == 4
+    assert stats["INSERT"]["rows"] == 2
+
+    with patch("core.db.profiler.log") as mock_log:
+        manager.log_profile()
+    assert "SELECT projects.id" in mock_log.info.call_args[0][0]
+
+    await manager.engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_session_manager_profiler_session_report(tmp_path):
+    config = DBConfig(
+        url=f"sqlite+aiosqlite:///{tmp_path}/test.db",
+        profiler={"enabled": True, "report": "session"},
+    )
+    manager = SessionManager(config)
+
+    with patch("core.db.profiler.log") as mock_log:
+        async with manager as session:
+            await session.execute(select(1))
+        mock_log.info.assert_called_once()
+        # The statistics are reset after each session
+        assert manager.profiler.stats() == []
+
+    await manager.engine.dispose()
@@ -84,6 +84,46 @@ async def test_get_all_projects(testdb):
     assert state2.branch.project in projects
 
 
+@pytest.mark.asyncio
+async def test_get_projects_keyset_pagination(testdb):
+    for name in ["delta", "alpha", "charlie", "bravo", "echo"]:
+        testdb.add(create_project_state(project_name=name))
+    testdb.add(Project(name="no states"))
+    await testdb.commit()
+
+    page1 = await Project.get_projects(testdb, limit=2)
+    assert [p.name for p in page1] == ["alpha", "bravo"]
+
+    page2 = await Project.get_projects(testdb, after=(page1[-1].name, page1[-1].id), limit=2)
+    assert [p.name for p in page2] == ["charlie", "delta"]
+
+    page3 = await Project.get_projects(testdb, after=(page2[-1].name, page2[-1].id), limit=2)
+    assert [p.name for p in page3] == ["echo"]
+
+
+@pytest.mark.asyncio
+async def test_get_projects_name_filter(testdb):
+    for name in ["My App", "Other", "my other app"]:
+        testdb.add(create_project_state(project_name=name))
+    await testdb.commit()
+
+    projects = await Project.get_projects(testdb, name="app")
+    assert [p.name for p in projects] == ["My App", "my other app"]
+
+
+@pytest.mark.asyncio
+async def test_get_projects_loads_branch_heads(testdb):
+    state = create_project_state()
+    testdb.add(state)
+    await testdb.commit()
+    await state.create_next_state()
+    await testdb.commit()
+
+    projects = await Project.get_projects(testdb)
+    [branch] = projects[0].branches
+    assert branch.head.step_index == 2
+
+
 @pytest.mark.asyncio
 async def test_default_folder_name(testdb):
     project = Project(name="test project")
@@ -1,7 +1,8 @@
 import pytest
 from sqlalchemy import select
 
-from core.db.models import Branch, File, FileContent, Project, ProjectState
+from core.db.content_cache import content_cache
+from core.db.models import Branch, BranchHead, File, FileContent, Project, ProjectState
 from core.db.models.project_state import IterationStatus
 
 from .factories import create_project_state
@@ -44,9 +45,36 @@ async def test_get_by_id_preloads_branch_project_files(testdb):
     # this will crash because they can't be lazy-loaded without an await.
     assert s.branch.id == state.branch.id
     assert s.branch.project.id == state.branch.project.id
+    assert s.files[0].content_id == "test"
+
+    # File contents are not loaded until explicitly requested
+    assert not s.files[0].content.is_loaded
+    await s.load_file_contents()
     assert s.files[0].content.content == "hello world"
 
 
+@pytest.mark.asyncio
+async def test_load_file_contents_uses_cache(testdb):
+    state = create_project_state()
+    state.files.append(File(path="a.txt", content=FileContent(id="a", content="a")))
+    state.files.append(File(path="b.txt", content=FileContent(id="b", content="b")))
+    testdb.add(state)
+    await testdb.commit()
+    testdb.expunge_all()
+
+    content_cache.clear()
+    content_cache.put("a", "cached a")
+
+    s = (await testdb.execute(select(ProjectState).where(ProjectState.id == state.id))).scalar_one()
+    await s.load_file_contents()
+
+    # "a" was served from the cache (hence the different content), "b" was loaded and cached
+    assert s.get_file_by_path("a.txt").content.content == "cached a"
+    assert s.get_file_by_path("b.txt").content.content == "b"
+    assert content_cache.get("b") == "b"
+    content_cache.clear()
+
+
 @pytest.mark.asyncio
 async def test_create_next_state_clones_files(testdb):
     f = File(path="test.txt", content=FileContent(id="test", content="hello world"))
@@ -119,6 +147,31 @@ async def test_deleting_state_removes_child_objects(testdb):
     assert f is None
 
 
+@pytest.mark.asyncio
+async def test_branch_head_follows_latest_state(testdb):
+    state = create_project_state()
+    testdb.add(state)
+    await testdb.commit()
+    branch_id, project_id = state.branch_id, state.branch.project_id
+
+    async def get_head():
+        query = select(BranchHead).where(BranchHead.branch_id == branch_id).execution_options(populate_existing=True)
+        head = (await testdb.execute(query)).scalar_one()
+        return head.state_id, head.step_index, head.project_id
+
+    assert await get_head() == (state.id, 1, project_id)
+
+    next_state = await state.create_next_state()
+    await testdb.commit()
+    last_state = await next_state.create_next_state()
+    await testdb.commit()
+    assert await get_head() == (last_state.id, 3, project_id)
+
+    await state.delete_after()
+    await testdb.commit()
+    assert await get_head() == (state.id, 1, project_id)
+
+
 @pytest.mark.asyncio
 async def test_completing_unfinished_steps(testdb):
     state = create_project_state()
@@ -219,3 +272,103 @@ async def test_completing_unfinished_epics(testdb):
     await testdb.refresh(state)
 
     assert state.current_epic is None
+
+
+@pytest.mark.asyncio
+async def test_next_state_stored_as_patch(testdb):
+    state = create_project_state()
+    state.tasks = [{"description": f"task {i}", "status": "todo"} for i in range(10)]
+    testdb.add(state)
+    await testdb.commit()
+
+    next_state = await state.create_next_state()
+    next_state.tasks[3]["status"] = "done"
+    next_state.steps = [{"type": "command"}]
+    await testdb.commit()
+
+    # In-memory values are preserved
+    assert next_state.tasks[3]["status"] == "done"
+    assert next_state.steps == [{"type": "command"}]
+    assert next_state.epics == []
+
+    result = await testdb.execute(
+        select(ProjectState.delta, ProjectState.tasks).where(ProjectState.id == next_state.id)
+    )
+    delta, tasks = result.one()
+    assert tasks is None
+    assert delta == {
+        "tasks": [{"op": "replace", "path": "/3/status", "value": "done"}],
+        "steps": [{"op": "add", "path": "/0", "value": {"type": "command"}}],
+    }
+
+
+@pytest.mark.asyncio
+async def test_next_state_updated_after_autoflush(testdb):
+    state = create_project_state()
+    testdb.add(state)
+    await testdb.commit()
+
+    next_state = await state.create_next_state()
+    await testdb.flush()
+    next_state.epics = [{"name": "Initial"}]
+    await testdb.commit()
+
+    result = await testdb.execute(select(ProjectState.delta).where(ProjectState.id == next_state.id))
+    assert result.scalar_one() == {"epics": [{"op": "add", "path": "/0", "value": {"name": "Initial"}}]}
+
+
+@pytest.mark.asyncio
+async def test_materialize_state(testdb, monkeypatch):
+    monkeypatch.setattr("core.db.models.project_state.SNAPSHOT_INTERVAL", 3)
+
+    state = create_project_state()
+    testdb.add(state)
+    await testdb.commit()
+    branch = state.branch
+
+    for i in range(6):
+        state = await state.create_next_state()
+        state.tasks = state.tasks + [{"description": f"task {i}"}]
+        await testdb.commit()
+
+    result = await testdb.execute(
+        select(ProjectState.delta.is_(None))
+        .where(ProjectState.branch_id == branch.id)
+        .order_by(ProjectState.step_index)
+    )
+    assert result.scalars().all() == [True, False, False, True, False, False, True]
+
+    for step_index in range(1, 8):
+        testdb.expunge_all()
+        branch = await testdb.get(Branch, branch.id)
+        s = await branch.get_state_at_step(step_index)
+        assert [t["description"] for t in s.tasks] == [f"task {i}" for i in range(step_index - 1)]
+        assert s.steps == []
+
+
+@pytest.mark.asyncio
+async def test_get_file_by_path_index(testdb):
+    state = create_project_state()
+    state.files.append(File(path="a.txt", content=FileContent(id="a", content="a")))
+    testdb.add(state)
+    await testdb.commit()
+
+    next_state = await state.create_next_state()
+    a = next_state.get_file_by_path("a.txt")
+    assert a is next_state.files[0]
+    assert next_state.get_file_by_path("missing.txt") is None
+
+    # Index is kept up to date when adding and removing files
+    b = next_state.save_file("b.txt", FileContent(id="b", content="b"))
+    assert next_state.get_file_by_path("b.txt") is b
+    next_state.files.remove(a)
+    assert next_state.get_file_by_path("a.txt") is None
+
+    next_state.files = [f for f in next_state.files if f.path != "b.txt"]
+    assert next_state.get_file_by_path("b.txt") is None
+
+    # Files loaded from the database are indexed as well
+    await testdb.commit()
+    testdb.expunge_all()
+    s = (await testdb.execute(select(ProjectState).where(ProjectState.id == state.id))).scalar_one()
+    assert s.get_file_by_path("a.txt").path == "a.txt"
@@ -0,0 +1,111 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+
+from core.config import DBConfig
+from core.db.setup import run_migrations
+
+ZERO_ID = "00000000000000000000000000000000"
+
+# Queries run by ORM cascades, orphan cleanup and project listing, with
+# the index the query planner is expected to use for each of them
+# in SQLite and PostgreSQL.
+QUERIES = [
+    # FileContent.delete_orphans()
+    (
+        "SELECT 1 FROM file_contents WHERE file_contents.id IN ('a', 'b') "
+        "AND NOT EXISTS (SELECT * FROM files WHERE files.content_id = file_contents.id)",
+        "ix_files_content_id",
+        "ix_files_content_id",
+    ),
+    # Specification.delete_orphans()
+    (
+        "SELECT 1 FROM specifications WHERE specifications.id IN (1, 2) "
+        "AND NOT EXISTS (SELECT * FROM project_states WHERE project_states.specification_id = specifications.id)",
+        "ix_project_states_specification_id",
+        "ix_project_states_specification_id",
+    ),
+    # ON DELETE SET NULL when deleting project states (ProjectState.delete_after(), Branch.compact())
+    (
+        f"SELECT id FROM llm_requests WHERE project_state_id = '{ZERO_ID}'",
+        "ix_llm_requests_project_state_id",
+        "ix_llm_requests_project_state_id",
+    ),
+    (
+        f"SELECT id FROM user_inputs WHERE project_state_id = '{ZERO_ID}'",
+        "ix_user_inputs_project_state_id",
+        "ix_user_inputs_project_state_id",
+    ),
+    (
+        f"SELECT id FROM exec_logs WHERE project_state_id = '{ZERO_ID}'",
+        "ix_exec_logs_project_state_id",
+        "ix_exec_logs_project_state_id",
+    ),
+    # ON DELETE CASCADE when deleting branches (Project.delete_by_id())
+    (
+        f"SELECT id FROM llm_requests WHERE branch_id = '{ZERO_ID}'",
+        "ix_llm_requests_branch_id",
+        "ix_llm_requests_branch_id",
+    ),
+    (
+        f"SELECT id FROM user_inputs WHERE branch_id = '{ZERO_ID}'",
+        "ix_user_inputs_branch_id",
+        "ix_user_inputs_branch_id",
+    ),
+    (
+        f"SELECT id FROM exec_logs WHERE branch_id = '{ZERO_ID}'",
+        "ix_exec_logs_branch_id",
+        "ix_exec_logs_branch_id",
+    ),
+    # Project.get_branch(), Project.get_all_projects()
+    (
+        f"SELECT id FROM branches WHERE project_id = '{ZERO_ID}'",
+        "ix_branches_project_id",
+        "ix_branches_project_id",
+    ),
+    # Project.get_projects()
+    (
+        f"SELECT id FROM projects WHERE (name, id) > ('test', '{ZERO_ID}') ORDER BY name, id LIMIT 10",
+        "ix_projects_name_id",
+        "ix_projects_name_id",
+    ),
+    (
+        f"SELECT branch_id FROM branch_heads WHERE project_id = '{ZERO_ID}'",
+        "ix_branch_heads_project_id",
+        "ix_branch_heads_project_id",
+    ),
+    # ProjectState.delete_after(), Branch.get_last_state()
+    (
+        f"SELECT id FROM project_states WHERE branch_id = '{ZERO_ID}' AND step_index > 1",
+        "sqlite_autoindex_project_states",
+        "uq_project_states_branch_id",
+    ),
+    # Loading files of a project state
+    (
+        f"SELECT id FROM files WHERE project_state_id = '{ZERO_ID}'",
+        "sqlite_autoindex_files",
+        "uq_files_project_state_id",
+    ),
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(("query", "index", "_pg_index"), QUERIES)
+async def test_sqlite_query_plan_uses_index(testdb, query, index, _pg_index):
+    result = await testdb.execute(text(f"EXPLAIN QUERY PLAN {query}"))
+    plan = "\n".join(row[-1] for row in result.all())
+
+    assert index in plan, plan
+
+
+def test_migrations_create_indexes(tmp_path):
+    db_path = tmp_path / "test.db"
+    run_migrations(DBConfig(url=f"sqlite+aiosqlite:///{db_path}"))
+
+    with sqlite3.connect(db_path) as conn:
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    for _query, index, _pg_index in QUERIES:
+        if not index.startswith("sqlite_autoindex"):
+            assert index in indexes
@@ -1,10 +1,11 @@
+import os
 from io import StringIO
 from os.path import join
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from core.disk.ignore import IgnoreMatcher
+from core.disk.ignore import BINARY_CHECK_SIZE, GitignoreRules, IgnoreMatcher
 
 
 @pytest.mark.parametrize(
@@ -70,3 +71,109 @@ def test_ignore_binary(_mock_open, _mock_isfile):
     )
     matcher = IgnoreMatcher("/tmp", [])
     assert matcher.ignore("test.py") is True
+
+
+@pytest.mark.parametrize(
+    ("path", "is_dir", "expected"),
+    [
+        ("build", True, True),
+        ("build", False, False),
+        ("src/build", True, True),
+        ("dist", True, True),
+        ("src/dist", True, False),
+        ("src/dist.py", False, False),
+    ],
+)
+def test_ignore_anchored_and_directory_patterns(path, is_dir, expected):
+    matcher = IgnoreMatcher("/tmp", ["build/", "/dist"])
+    assert matcher._is_in_ignore_list(path, is_dir=lambda: is_dir) == expected
+
+
+@pytest.mark.parametrize(
+    ("path", "is_dir", "expected"),
+    [
+        ("debug.log", False, True),
+        ("logs/debug.log", False, True),
+        ("important.log", False, False),
+        ("build", True, True),
+        ("build", False, False),
+        ("src/build/out.js", False, True),
+        ("docs/api/index.html", False, True),
+        ("src/docs/api/index.html", False, False),
+        ("a/b/c/generated.py", False, True),
+        ("a/generated.py", False, True),
+        ("b/generated.py", False, False),
+        ("#notacomment", False, True),
+        ("main.py", False, False),
+    ],
+)
+def test_gitignore_rules(path, is_dir, expected):
+    rules = GitignoreRules(
+        [
+            "# comment\n",
+            "\n",
+            "*.log\n",
+            "!important.log\n",
+            "build/\n",
+            "/docs/api/\n",
+            "a/**/generated.py\n",
+            "\\#notacomment\n",
+        ]
+    )
+    assert bool(rules.match(path, lambda: is_dir)) == expected
+
+
+def test_gitignore_files(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.disk.ignore.GITIGNORE_CHECK_INTERVAL", 0)
+    (tmp_path / ".gitignore").write_text("*.tmp\ncache/\n")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / ".gitignore").write_text("!keep.tmp\n/local.txt\n")
+
+    matcher = IgnoreMatcher(str(tmp_path), [], use_gitignore=True)
+    assert matcher._is_in_ignore_list("a.tmp") is True
+    assert matcher._is_in_ignore_list("sub/keep.tmp") is False
+    assert matcher._is_in_ignore_list("sub/other.tmp") is True
+    assert matcher._is_in_ignore_list("sub/local.txt") is True
+    assert matcher._is_in_ignore_list("local.txt") is False
+    assert matcher._is_in_ignore_list("sub/deeper/local.txt") is False
+
+    (tmp_path / "cache").mkdir()
+    assert matcher._is_in_ignore_list("cache") is True
+    assert matcher._is_in_ignore_list("cache/data.json") is True
+
+    # Changes to the .gitignore files are picked up
+    (tmp_path / ".gitignore").write_text("*.tmp\n")
+    assert matcher._is_in_ignore_list("cache") is False
+
+    assert IgnoreMatcher(str(tmp_path), [])._is_in_ignore_list("a.tmp") is False
+
+
+def test_ignore_with_stat(tmp_path):
+    (tmp_path / "text.txt").write_text("hello")
+    (tmp_path / "binary.bin").write_bytes(b"hello\0world")
+    (tmp_path / "large.txt").write_text("x" * 101)
+    # A multi-byte character cut in half by the binary check is fine
+    (tmp_path / "unicode.txt").write_bytes(b"x" * (BINARY_CHECK_SIZE - 1) + "€".encode("utf-8"))
+    (tmp_path / "dir").mkdir()
+
+    matcher = IgnoreMatcher(str(tmp_path), [], ignore_size_threshold=100)
+    assert matcher.ignore("text.txt", os.stat(tmp_path / "text.txt")) is False
+    assert matcher.ignore("binary.bin", os.stat(tmp_path / "binary.bin")) is True
+    assert matcher.ignore("large.txt", os.stat(tmp_path / "large.txt")) is True
+    assert matcher.ignore("dir", os.stat(tmp_path / "dir")) is False
+    matcher.ignore_size_threshold = None
+    assert matcher.ignore("unicode.txt", os.stat(tmp_path / "unicode.txt")) is False
+
+    # The binary check is cached until the file changes
+    with patch("builtins.open", side_effect=AssertionError("file was read")):
+        assert matcher.ignore("text.txt", os.stat(tmp_path / "text.txt")) is False
+        assert matcher.ignore("binary.bin", os.stat(tmp_path / "binary.bin")) is True
+
+    (tmp_path / "text.txt").write_bytes(b"\xff\xfe binary now")
+    assert matcher.ignore("text.txt", os.stat(tmp_path / "text.txt")) is True
+
+    (tmp_path / "binary.bin").write_text("text now, and longer")
+    assert matcher.ignore("binary.bin", os.stat(tmp_path / "binary.bin")) is False
+
+    matcher.mark_binary("binary.bin")
+    assert matcher.ignore("binary.bin", os.stat(tmp_path / "binary.bin")) is True
@@ -0,0 +1,65 @@
+import os
+import time
+
+from core.disk.mirror import MemoryMirror
+
+
+def stat_of(tmp_path, name: str, content: str, age: int = 60) -> os.stat_result:
+    path = tmp_path / name
+    path.write_text(content)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return os.stat(path)
+
+
+def test_mirror_get_put(tmp_path):
+    mirror = MemoryMirror(max_size=100)
+    st = stat_of(tmp_path, "a.txt", "hello")
+
+    assert mirror.get("a.txt", st) is None
+    mirror.put("a.txt", st, "hello")
+    assert mirror.get("a.txt", st) == "hello"
+    assert (mirror.hits, mirror.misses) == (1, 1)
+    assert mirror.hit_rate == 0.5
+
+    # Changed files are not served from memory
+    st = stat_of(tmp_path, "a.txt", "hello, changed")
+    assert mirror.get("a.txt", st) is None
+
+    mirror.remove("a.txt")
+    assert len(mirror) == 0
+    assert mirror.size == 0
+
+
+def test_mirror_size_limits(tmp_path):
+    mirror = MemoryMirror(max_size=30, max_file_size=20)
+    stats = {name: stat_of(tmp_path, name, name) for name in ["a", "b", "c", "d"]}
+
+    mirror.put("a", stats["a"], "x" * 10)
+    mirror.put("b", stats["b"], "x" * 10)
+    mirror.put("c", stats["c"], "x" * 10)
+    # Least recently used files are evicted first
+    assert mirror.get("a", stats["a"]) is not None
+    mirror.put("d", stats["d"], "x" * 10)
+    assert sorted(mirror.entries) == ["a", "c", "d"]
+    assert mirror.size == 30
+    assert mirror.evictions == 1
+
+    # Files too large are not cached
+    mirror.put("a", stats["a"], "x" * 21)
+    assert mirror.get("a", stats["a"]) is None
+    assert mirror.size == 20
+
+    mirror.retain(["c"])
+    assert list(mirror.entries) == ["c"]
+    assert mirror.size == 10
+
+
+def test_mirror_skips_recently_modified_files(tmp_path):
+    mirror = MemoryMirror(max_size=100)
+
+    # A same-size change within the same timestamp tick wouldn't change the stat information
+    st = stat_of(tmp_path, "a.txt", "hello", age=0)
+    mirror.put("a.txt", st, "hello")
+    assert mirror.get("a.txt", st) is None
+    assert mirror.size == 0
@@ -0,0 +1,83 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from core.disk.snapshots import SnapshotStore
+from core.disk.vfs import LocalDiskVFS
+
+
+def write(path, content: str) -> os.stat_result:
+    path.write_text(content)
+    return os.stat(path)
+
+
+@pytest.mark.parametrize("use_reflinks", [True, False])
+def test_snapshot_store(tmp_path, use_reflinks):
+    store = SnapshotStore(str(tmp_path / "store"))
+    store.use_reflinks = use_reflinks
+    st = write(tmp_path / "a.txt", "hello")
+
+    assert "abcd" not in store
+    assert store.add("abcd", str(tmp_path / "a.txt"), st)
+    assert "abcd" in store
+    # Already stored contents are not stored again
+    assert store.add("abcd", str(tmp_path / "missing.txt"), st)
+    assert store.cloned + store.copied == 1
+
+    store.checkout("abcd", str(tmp_path / "b.txt"))
+    assert (tmp_path / "b.txt").read_text() == "hello"
+    with pytest.raises(KeyError):
+        store.checkout("ef01", str(tmp_path / "c.txt"))
+
+    # The stored contents are found on disk
+    assert SnapshotStore(str(tmp_path / "store")).hashes == {"abcd"}
+
+    assert store.prune(["ef01"]) == 1
+    assert len(store) == 0
+    assert not os.path.exists(tmp_path / "store" / "ab" / "cd")
+
+
+def test_snapshot_store_skips_changed_files(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    st = write(tmp_path / "a.txt", "hello")
+    write(tmp_path / "a.txt", "changed in the meantime")
+
+    assert not store.add("abcd", str(tmp_path / "a.txt"), st)
+    assert "abcd" not in store
+    assert os.listdir(tmp_path / "store" / "ab") == []
+
+
+def test_snapshot_store_falls_back_to_copy(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    st = write(tmp_path / "a.txt", "hello")
+    with patch("core.disk.snapshots.reflink", return_value=False):
+        assert store.add("abcd", str(tmp_path / "a.txt"), st)
+    assert (store.cloned, store.copied) == (0, 1)
+    assert store.use_reflinks is False
+
+
+def test_local_disk_vfs_snapshots(tmp_path):
+    vfs = LocalDiskVFS(str(tmp_path / "project"), snapshot_path=str(tmp_path / "store"))
+    vfs.save("saved.txt", "saved by pythagora")
+    write(tmp_path / "project" / "external.txt", "imported")
+    saved_hash = vfs.hash_string("saved by pythagora")
+    external_hash = vfs.hash_string("imported")
+
+    # Saved files are stored right away, other files when the state is committed
+    assert saved_hash in vfs.snapshots
+    assert vfs.capture_snapshot([("saved.txt", saved_hash), ("external.txt", external_hash)]) == 1
+    assert vfs.capture_snapshot([("external.txt", "stale hash")]) == 0
+
+    vfs.save("saved.txt", "changed")
+    os.remove(tmp_path / "project" / "external.txt")
+    with patch.object(vfs, "read", side_effect=AssertionError("file was read")):
+        missing = vfs.restore_snapshot(
+            [("saved.txt", saved_hash), ("external.txt", external_hash), ("other.txt", "unknown")]
+        )
+    assert missing == ["other.txt"]
+    assert vfs.read("saved.txt") == "saved by pythagora"
+    assert vfs.read("external.txt") == "imported"
+    assert vfs.hash("saved.txt") == saved_hash
+
+    assert LocalDiskVFS(str(tmp_path / "other")).restore_snapshot([("a.txt", saved_hash)]) == ["a.txt"]
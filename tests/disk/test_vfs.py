@@ -1,7 +1,19 @@
+import os
+import time
 from os.path import exists, join
+from unittest.mock import patch
 
-from core.disk.ignore import IgnoreMatcher
-from core.disk.vfs import LocalDiskVFS, MemoryVFS
+import pytest
+
+from core.disk.ignore import BINARY_CHECK_SIZE, IgnoreMatcher
+from core.disk.vfs import TEMP_SUFFIX, LocalDiskVFS, MemoryVFS, OverlayVFS
+
+
+def write_old_file(path, content: str, age: int = 60):
+    with open(path, "w") as f:
+        f.write(content)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
 
 
 def test_memory_vfs():
@@ -86,3 +98,254 @@ def test_local_disk_vfs_with_matcher(tmp_path):
 
     vfs.remove("test.log")
     assert exists(join(tmp_path, "test.log"))
+
+
+def test_local_disk_vfs_hash_cache(tmp_path):
+    vfs = LocalDiskVFS(tmp_path)
+    write_old_file(join(tmp_path, "test.txt"), "hello world")
+
+    assert vfs.hash("test.txt") == vfs.hash_string("hello world")
+    assert vfs.stat_cache.misses == 1
+
+    # Unchanged files aren't read again
+    with patch.object(vfs, "read", side_effect=AssertionError("file was read")):
+        assert vfs.hash("test.txt") == vfs.hash_string("hello world")
+    assert vfs.stat_cache.hits == 1
+
+    write_old_file(join(tmp_path, "test.txt"), "hello there", age=30)
+    assert vfs.hash("test.txt") == vfs.hash_string("hello there")
+
+    # Recently modified files are always read, as a change might not be visible in the mtime
+    vfs.save("test.txt", "hello again")
+    assert vfs.hash("test.txt") == vfs.hash_string("hello again")
+    assert vfs.stat_cache.hits == 1
+
+    vfs.remove("test.txt")
+    assert len(vfs.stat_cache) == 0
+
+
+def test_local_disk_vfs_hash_cache_persisted(tmp_path):
+    root = join(tmp_path, "project")
+    cache_path = join(tmp_path, "cache.json")
+    vfs = LocalDiskVFS(root, stat_cache_path=cache_path)
+    write_old_file(join(root, "a.txt"), "a")
+    write_old_file(join(root, "b.txt"), "b")
+    for path in vfs.list():
+        vfs.hash(path)
+    vfs.save_cache()
+
+    os.remove(join(root, "b.txt"))
+    vfs = LocalDiskVFS(root, stat_cache_path=cache_path)
+    assert len(vfs.stat_cache) == 2
+    with patch.object(vfs, "read", side_effect=AssertionError("file was read")):
+        assert [vfs.hash(path) for path in vfs.list()] == [vfs.hash_string("a")]
+
+    # Removed files are forgotten
+    assert len(vfs.stat_cache) == 1
+    vfs.save_cache()
+    assert len(LocalDiskVFS(root, stat_cache_path=cache_path).stat_cache) == 1
+
+
+def test_local_disk_vfs_invalid_hash_cache(tmp_path):
+    root = join(tmp_path, "project")
+    cache_path = join(tmp_path, "cache.json")
+    with open(cache_path, "w") as f:
+        f.write("not json")
+
+    vfs = LocalDiskVFS(root, stat_cache_path=cache_path)
+    write_old_file(join(root, "a.txt"), "a")
+    assert vfs.hash("a.txt") == vfs.hash_string("a")
+    vfs.save_cache()
+    assert len(LocalDiskVFS(root, stat_cache_path=cache_path).stat_cache) == 1
+
+
+def test_local_disk_vfs_list_skips_binary_and_special_files(tmp_path):
+    vfs = LocalDiskVFS(tmp_path, ignore_matcher=IgnoreMatcher(tmp_path, ["ignored"]))
+    vfs.save("src/main.py", "print('hello')")
+    vfs.save("ignored/file.txt", "ignored")
+    with open(join(tmp_path, "image.png"), "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n\0\0")
+    os.symlink(join(tmp_path, "src"), join(tmp_path, "linked-dir"))
+    os.symlink(join(tmp_path, "missing"), join(tmp_path, "broken-link"))
+
+    assert vfs.list() == ["src/main.py"]
+
+    # Invalid UTF-8 after the start of the file is only found when the file is read
+    with open(join(tmp_path, "latin1.txt"), "wb") as f:
+        f.write(b"x" * BINARY_CHECK_SIZE + "caf\xe9".encode("latin-1"))
+    assert vfs.list() == ["latin1.txt", "src/main.py"]
+    with pytest.raises(ValueError):
+        vfs.read("latin1.txt")
+    assert vfs.list() == ["src/main.py"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fs_type", ["memory", "local"])
+async def test_async_methods(fs_type, tmp_path):
+    vfs = MemoryVFS() if fs_type == "memory" else LocalDiskVFS(tmp_path)
+    files = [(f"dir{i % 3}/file{i}.txt", f"content {i}") for i in range(100)]
+
+    await vfs.asave_many(files)
+    await vfs.asave("single.txt", "single")
+    assert await vfs.aread("single.txt") == "single"
+    assert await vfs.alist("dir1") == sorted(path for path, _ in files if path.startswith("dir1/"))
+
+    paths = [path for path, _ in files]
+    assert await vfs.aread_many(paths) == [content for _, content in files]
+    assert await vfs.ahash_many(paths) == [vfs.hash_string(content) for _, content in files]
+
+    with pytest.raises(ValueError):
+        await vfs.aread_many(["single.txt", "missing.txt"])
+    single, missing = await vfs.aread_many(["single.txt", "missing.txt"], return_exceptions=True)
+    assert single == "single"
+    assert isinstance(missing, ValueError)
+
+
+def test_local_disk_vfs_atomic_save(tmp_path):
+    vfs = LocalDiskVFS(tmp_path)
+    vfs.save("script.sh", "echo hello")
+    os.chmod(join(tmp_path, "script.sh"), 0o755)
+    os.symlink(join(tmp_path, "script.sh"), join(tmp_path, "link.sh"))
+
+    vfs.save("script.sh", "echo hello again")
+    assert os.stat(join(tmp_path, "script.sh")).st_mode & 0o777 == 0o755
+
+    # Symlinks are followed
+    vfs.save("link.sh", "echo from link")
+    assert os.path.islink(join(tmp_path, "link.sh"))
+    assert vfs.read("script.sh") == "echo from link"
+
+    # Temporary files are cleaned up on errors, and never listed
+    with patch("os.replace", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            vfs.save("script.sh", "echo lost")
+    assert sorted(os.listdir(tmp_path)) == ["link.sh", "script.sh"]
+    assert vfs.read("script.sh") == "echo from link"
+
+    with open(join(tmp_path, f".script.sh.1234{TEMP_SUFFIX}"), "w") as f:
+        f.write("partial")
+    assert vfs.list() == ["link.sh", "script.sh"]
+
+
+@patch("core.disk.mirror.RACY_INTERVAL_NS", 0)
+def test_local_disk_vfs_mirror(tmp_path):
+    vfs = LocalDiskVFS(tmp_path, mirror_size=1000)
+    vfs.save("test.txt", "hello world")
+
+    # Saved files are cached (write-through)
+    with patch("builtins.open", side_effect=AssertionError("file was read")):
+        assert vfs.read("test.txt") == "hello world"
+    assert vfs.mirror.hits == 1
+
+    # External changes are picked up
+    with open(join(tmp_path, "test.txt"), "w") as f:
+        f.write("changed outside")
+    assert vfs.read("test.txt") == "changed outside"
+    assert vfs.read("test.txt") == "changed outside"
+    assert (vfs.mirror.hits, vfs.mirror.misses) == (2, 1)
+
+    vfs.remove("test.txt")
+    assert len(vfs.mirror) == 0
+    with pytest.raises(ValueError):
+        vfs.read("test.txt")
+
+    assert LocalDiskVFS(tmp_path).mirror is None
+
+
+def test_local_disk_vfs_mirror_racy_change(tmp_path):
+    vfs = LocalDiskVFS(tmp_path, mirror_size=1000)
+    vfs.save("test.txt", "hello world")
+    st = os.stat(join(tmp_path, "test.txt"))
+
+    # A same-size external change within the same timestamp tick, on a file system
+    # with coarse timestamps, doesn't change the stat information
+    with open(join(tmp_path, "test.txt"), "w") as f:
+        f.write("HELLO WORLD")
+    with patch("os.stat", return_value=st):
+        assert vfs.read("test.txt") == "HELLO WORLD"
+
+
+def test_overlay_vfs(tmp_path):
+    base = LocalDiskVFS(str(tmp_path))
+    base.save("a.txt", "a")
+    base.save("b.txt", "b")
+
+    overlay = OverlayVFS(base)
+    overlay.save("a.txt", "changed")
+    overlay.save("c.txt", "new")
+    overlay.remove("b.txt")
+
+    assert overlay.read("a.txt") == "changed"
+    assert overlay.hash("a.txt") == base.hash_string("changed")
+    assert overlay.list() == ["a.txt", "c.txt"]
+    assert not overlay.exists("b.txt")
+    with pytest.raises(ValueError):
+        overlay.read("b.txt")
+
+    # Nothing is written until the changes are flushed
+    assert base.list() == ["a.txt", "b.txt"]
+    assert base.read("a.txt") == "a"
+
+    # Overlays are isolated from each other
+    other = OverlayVFS(base)
+    assert other.read("a.txt") == "a"
+    assert other.list() == ["a.txt", "b.txt"]
+
+    # Nested overlays are flushed to the parent overlay
+    nested = overlay.overlay()
+    nested.save("d.txt", "nested")
+    assert nested.flush() == ["d.txt"]
+    assert overlay.read("d.txt") == "nested"
+    assert not base.exists("d.txt")
+
+    assert overlay.flush() == ["a.txt", "b.txt", "c.txt", "d.txt"]
+    assert overlay.changes == {}
+    assert base.list() == ["a.txt", "c.txt", "d.txt"]
+    assert open(join(tmp_path, "a.txt")).read() == "changed"
+
+
+def test_overlay_vfs_discard(tmp_path):
+    base = LocalDiskVFS(str(tmp_path))
+    base.save("a.txt", "a")
+
+    overlay = OverlayVFS(base)
+    with patch.object(base, "save") as mock_save, patch.object(base, "remove") as mock_remove:
+        overlay.save("a.txt", "rejected")
+        overlay.save("b.txt", "rejected")
+        overlay.remove("a.txt")
+        overlay.discard()
+
+    mock_save.assert_not_called()
+    mock_remove.assert_not_called()
+    assert overlay.read("a.txt") == "a"
+    assert overlay.list() == ["a.txt"]
+
+
+def test_overlay_vfs_flush_restores_on_error(tmp_path):
+    base = LocalDiskVFS(str(tmp_path))
+    base.save("a.txt", "a")
+    base.save("b.txt", "b")
+
+    overlay = OverlayVFS(base)
+    overlay.save("a.txt", "changed")
+    overlay.save("b.txt", "changed")
+    overlay.remove("c.txt")
+    overlay.save("new.txt", "new")
+
+    save = base.save
+
+    def failing_save(path: str, content: str):
+        if path == "new.txt":
+            raise OSError("disk full")
+        save(path, content)
+
+    with patch.object(base, "save", side_effect=failing_save):
+        with pytest.raises(OSError):
+            overlay.flush()
+
+    assert base.list() == ["a.txt", "b.txt"]
+    assert base.read("a.txt") == "a"
+    assert base.read("b.txt") == "b"
+    # The changes are kept, so the flush can be retried
+    assert overlay.flush() == ["a.txt", "b.txt", "new.txt"]
+    assert base.read("new.txt") == "new"
@@ -0,0 +1,147 @@
+import os
+import shutil
+import sys
+from os.path import join
+
+import pytest
+
+from core.disk.ignore import IgnoreMatcher
+from core.disk.vfs import LocalDiskVFS
+from core.disk.watcher import IN_Q_OVERFLOW, InotifyWatcher, PollingWatcher, create_watcher
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only available on Linux")
+
+
+def write(root, path: str, content: str):
+    full_path = join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+        f.write(content)
+
+
+@pytest.fixture(params=[pytest.param("inotify", marks=linux_only), "polling"])
+def vfs(request, tmp_path):
+    root = str(tmp_path / "project")
+    write(root, "a.txt", "a")
+    write(root, "src/b.txt", "b")
+    write(root, "node_modules/c.js", "c")
+
+    vfs = LocalDiskVFS(root, ignore_matcher=IgnoreMatcher(root, ["node_modules"]))
+    if request.param == "inotify":
+        vfs.watcher = InotifyWatcher(root, vfs.ignore_matcher)
+    else:
+        vfs.watcher = PollingWatcher(root, vfs._get_file_list)
+    yield vfs
+    vfs.close()
+
+
+def test_changes_unknown_until_synced(vfs):
+    assert vfs.get_changed_paths() is None
+    vfs.mark_synced()
+    assert vfs.get_changed_paths() == set()
+
+
+def test_file_changes(vfs):
+    vfs.get_changed_paths()
+    vfs.mark_synced()
+
+    write(vfs.root, "a.txt", "changed")
+    write(vfs.root, "src/new.txt", "new")
+    os.remove(join(vfs.root, "src/b.txt"))
+
+    changed = vfs.get_changed_paths()
+    assert changed == {"a.txt", "src/new.txt", "src/b.txt"}
+    assert [path for path in sorted(changed) if vfs.exists(path)] == ["a.txt", "src/new.txt"]
+
+    # The changes are reported until they're synchronized
+    assert vfs.get_changed_paths() == changed
+    vfs.mark_synced(["a.txt"])
+    assert vfs.get_changed_paths() == {"src/new.txt", "src/b.txt"}
+
+
+def test_own_writes_are_not_reported(vfs):
+    vfs.get_changed_paths()
+    vfs.mark_synced()
+
+    vfs.save("a.txt", "saved by pythagora")
+    vfs.save("src/d.txt", "new file by pythagora")
+    vfs.remove("src/b.txt")
+    assert vfs.get_changed_paths() == set()
+
+    # External changes after our own write are still reported
+    vfs.save("a.txt", "saved again")
+    write(vfs.root, "a.txt", "changed outside")
+    assert vfs.get_changed_paths() == {"a.txt"}
+
+
+def test_directory_changes(vfs):
+    vfs.get_changed_paths()
+    vfs.mark_synced()
+
+    write(vfs.root, "lib/x/y.txt", "y")
+    write(vfs.root, "node_modules/d.js", "ignored")
+    changed = vfs.get_changed_paths()
+    assert "lib/x/y.txt" in changed
+    assert "node_modules/d.js" not in changed
+    vfs.mark_synced(changed)
+
+    # Files created in new directories are watched too
+    write(vfs.root, "lib/x/z.txt", "z")
+    assert vfs.get_changed_paths() == {"lib/x/z.txt"}
+    vfs.mark_synced()
+
+    shutil.move(join(vfs.root, "lib"), join(vfs.root, "..", "moved-out"))
+    changed = vfs.get_changed_paths()
+    # The watcher may report either the directory or the files in it
+    assert changed & {"lib", "lib/x/y.txt"}
+    assert not any(vfs.exists(path) for path in changed)
+
+
+def test_changes_during_sync_are_kept(vfs):
+    # The workspace is scanned after the changes are requested
+    assert vfs.get_changed_paths() is None
+    write(vfs.root, "a.txt", "changed during the scan")
+    vfs.mark_synced()
+    assert vfs.get_changed_paths() == {"a.txt"}
+
+    write(vfs.root, "a.txt", "changed again")
+    write(vfs.root, "src/b.txt", "changed")
+    changed = vfs.get_changed_paths()
+    assert changed == {"a.txt", "src/b.txt"}
+    write(vfs.root, "a.txt", "changed during the sync")
+    vfs.mark_synced(changed)
+    assert vfs.get_changed_paths() == {"a.txt"}
+
+
+@linux_only
+def test_changes_after_overflow(tmp_path):
+    root = str(tmp_path)
+    watcher = InotifyWatcher(root, IgnoreMatcher(root, []))
+    watcher.get_changed_paths()
+    watcher.mark_synced()
+
+    watcher._handle_event(-1, IN_Q_OVERFLOW, "")
+    write(root, "a.txt", "a")
+    assert watcher.get_changed_paths() is None
+    write(root, "b.txt", "changed during the scan")
+    watcher.mark_synced()
+    assert watcher.get_changed_paths() == {"b.txt"}
+    watcher.close()
+
+
+@linux_only
+def test_create_watcher(tmp_path):
+    watcher = create_watcher(str(tmp_path), IgnoreMatcher(str(tmp_path), []), lambda: [])
+    assert isinstance(watcher, InotifyWatcher)
+    watcher.close()
+
+
+def test_local_disk_vfs_watch_option(tmp_path):
+    vfs = LocalDiskVFS(str(tmp_path))
+    assert vfs.watcher is None
+    assert vfs.get_changed_paths() is None
+
+    vfs = LocalDiskVFS(str(tmp_path), watch=True)
+    assert vfs.watcher is not None
+    vfs.close()
+    assert vfs.watcher is None
@@ -0,0 +1,45 @@
+from os import getenv
+
+import pytest
+from sqlalchemy import text
+
+from core.config import DBConfig
+from core.db.session import SessionManager
+from core.db.setup import run_migrations
+from tests.db.test_query_plans import QUERIES
+
+run_integration_tests = getenv("INTEGRATION_TESTS", "").lower()
+if run_integration_tests not in ["true", "yes", "1", "on"]:
+    pytest.skip("Skipping integration tests", allow_module_level=True)
+
+if not getenv("POSTGRES_TEST_URL"):
+    pytest.skip(
+        "Skipping PostgreSQL integration tests: POSTGRES_TEST_URL is not set",
+        allow_module_level=True,
+    )
+
+
+@pytest.fixture(scope="module")
+def pg_config():
+    """
+    Bring the PostgreSQL test database (POSTGRES_TEST_URL) schema up to date.
+
+    The URL must use the postgresql+asyncpg:// scheme and point to a
+    throwaway database.
+    """
+    config = DBConfig(url=getenv("POSTGRES_TEST_URL"))
+    run_migrations(config)
+    return config
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(("query", "_sqlite_index", "index"), QUERIES)
+async def test_postgres_query_plan_uses_index(pg_config, query, _sqlite_index, index):
+    async with SessionManager(pg_config) as session:
+        # On an empty test database, sequential scans are always cheaper,
+        # so we need to force the planner to consider the indexes.
+        await session.execute(text("SET enable_seqscan = off"))
+        result = await session.execute(text(f"EXPLAIN {query}"))
+        plan = "\n".join(row[0] for row in result.all())
+
+    assert index in plan, plan
@@ -0,0 +1,103 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from core.state.actor import CompleteStep, CompleteTask, SaveFile, SetAction, UpdateState, UpdateTask
+from core.state.state_manager import StateManager
+
+
+async def create_state_manager(testmanager) -> StateManager:
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    return sm
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_parallel_commands(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = await create_state_manager(testmanager)
+    sm.next_state.steps = [{"type": "save_file", "save_file": {"path": f"file{i}.txt"}} for i in range(10)]
+
+    async def agent(i: int):
+        await sm.save_file(f"file{i}.txt", f"content {i}")
+        await sm.execute(CompleteStep())
+
+    await asyncio.gather(*[agent(i) for i in range(10)])
+
+    assert sorted(f.path for f in sm.next_state.files) == sorted(f"file{i}.txt" for i in range(10))
+    assert sm.next_state.unfinished_steps == []
+    assert sm.file_system.read("file3.txt") == "content 3"
+
+    state = await sm.commit()
+    assert len(state.files) == 10
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_command_error(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = await create_state_manager(testmanager)
+
+    # There are no steps to complete
+    results = await asyncio.gather(
+        sm.execute(CompleteStep()),
+        sm.execute(SetAction("Doing things")),
+        return_exceptions=True,
+    )
+
+    assert isinstance(results[0], ValueError)
+    assert results[1] is None
+    assert sm.next_state.action == "Doing things"
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_commands_wait_for_database_session(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = await create_state_manager(testmanager)
+
+    async with sm.db_blocker():
+        save = asyncio.create_task(sm.execute(SaveFile("a.txt", "a")))
+        cancelled = asyncio.create_task(sm.execute(SaveFile("b.txt", "b")))
+        await asyncio.sleep(0.01)
+        # The first command is waiting for the session, the second one is queued
+        assert sm.actor.pending == 1
+        assert sm.next_state.files == []
+
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+
+    file, original_content = await save
+    assert file.path == "a.txt"
+    assert original_content == ""
+
+    # The command was dropped, as its caller was cancelled before it started
+    await asyncio.sleep(0.01)
+    assert sm.actor.pending == 0
+    assert [f.path for f in sm.next_state.files] == ["a.txt"]
+    assert sm.file_system.list() == ["a.txt"]
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_update_commands(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = await create_state_manager(testmanager)
+    tasks = [{"id": f"t{i}", "description": f"Task {i}", "status": "todo"} for i in range(2)]
+
+    await sm.execute(UpdateState("tasks", tasks))
+    await sm.execute(UpdateTask({"instructions": "Do it"}))
+    await sm.execute(UpdateTask({"description": "Second task"}, index=1))
+    await sm.execute(CompleteTask())
+    state = await sm.commit()
+
+    assert state.tasks[0]["instructions"] == "Do it"
+    assert state.tasks[0]["status"] == "done"
+    assert state.tasks[1]["description"] == "Second task"
+    assert sm.next_state.current_task["id"] == "t1"
+
+    with pytest.raises(ValueError):
+        await sm.execute(UpdateState("files", []))
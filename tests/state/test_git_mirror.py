@@ -0,0 +1,59 @@
+import shutil
+import subprocess
+
+import pytest
+
+from core.state.git_mirror import GitMirror, GitMirrorError
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def test_commit_states(tmp_path):
+    mirror = GitMirror(str(tmp_path / "project.git"))
+    assert mirror.get_tip("main") is None
+
+    mirror.commit_state("main", "s1", None, "Step 1: Create", {"a.txt": "a", "src/b.txt": "b"}, full=True)
+    mirror.commit_state("main", "s2", "s1", "Step 2: Edit", {"a.txt": "changed", "src/b.txt": None, "c.txt": "c"})
+    mirror.commit_state("main", "s3", "s2", "Step 3: No changes", {})
+
+    assert mirror.get_tip("main") == "s3"
+    assert mirror.has_state("s2")
+    assert not mirror.has_state("s4")
+    assert mirror.changed_files("s1", "s2") == [("M", "a.txt"), ("A", "c.txt"), ("D", "src/b.txt")]
+    assert mirror.changed_files("s2", "s3") == []
+
+    diff = mirror.diff("s1", "s3", ["a.txt"])
+    assert "-a\n" in diff and "+changed\n" in diff
+    assert "c.txt" not in diff
+
+    log = subprocess.run(
+        ["git", "--git-dir", mirror.path, "log", "--format=%s", "main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert log.splitlines() == ["Step 3: No changes", "Step 2: Edit", "Step 1: Create"]
+
+    # The branch tip is read from the repository when reopened
+    assert GitMirror(mirror.path).get_tip("main") == "s3"
+
+
+def test_commit_state_requires_parent_at_tip(tmp_path):
+    mirror = GitMirror(str(tmp_path / "project.git"))
+    mirror.commit_state("main", "s1", None, "Step 1", {"a.txt": "a"}, full=True)
+
+    with pytest.raises(GitMirrorError):
+        mirror.commit_state("main", "s3", "s2", "Step 3", {"a.txt": "b"})
+
+    # A full snapshot replaces all the files
+    mirror.commit_state("main", "s3", "s2", "Step 3", {"b.txt": "b"}, full=True)
+    assert mirror.changed_files("s1", "s3") == [("D", "a.txt"), ("A", "b.txt")]
+
+
+def test_unusual_paths(tmp_path):
+    mirror = GitMirror(str(tmp_path / "project.git"))
+    paths = ["with space.txt", '"quoted".txt', "ünïcode.txt"]
+    mirror.commit_state("main", "s1", None, "Step 1", {}, full=True)
+    mirror.commit_state("main", "s2", "s1", "Step 2", {path: path for path in paths})
+
+    assert sorted(path for _, path in mirror.changed_files("s1", "s2")) == sorted(paths)
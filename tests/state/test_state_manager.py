@@ -1,10 +1,18 @@
+import asyncio
 import os
+import shutil
+import time
 from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
 
 import pytest
+from sqlalchemy import select
 
-from core.config import FileSystemConfig
-from core.state.state_manager import StateManager
+from core.config import FileSystemConfig, RetentionConfig
+from core.db.models import Branch, ProjectState
+from core.disk.vfs import MemoryVFS, OverlayVFS
+from core.state.actor import UpdateState
+from core.state.state_manager import RestoreReport, StateManager
 
 
 @pytest.mark.asyncio
@@ -161,6 +169,52 @@ async def test_save_file(mock_get_config, testmanager):
     assert file.content.content == "Hello, world!"
 
 
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_commit_unloads_file_contents(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+
+    await sm.save_file("test.txt", "Hello, world!")
+    await sm.commit()
+
+    # The next state shares the content objects with the current state,
+    # and the contents are loaded on demand
+    file = sm.current_state.get_file_by_path("test.txt")
+    assert not file.content.is_loaded
+    assert sm.next_state.get_file_by_path("test.txt").content is file.content
+
+    await sm.load_file_contents()
+    assert file.content.content == "Hello, world!"
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_load_relevant_file_contents(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+
+    await sm.save_file("a.txt", "a")
+    await sm.save_file("b.txt", "b")
+    await sm.execute(UpdateState("relevant_files", ["a.txt"]))
+    await sm.execute(UpdateState("modified_files", {}))
+    await sm.commit()
+
+    await sm.load_relevant_file_contents()
+    assert sm.current_state.get_file_by_path("a.txt").content.content == "a"
+    assert not sm.current_state.get_file_by_path("b.txt").content.is_loaded
+
+    # Without relevant files, the prompts include all the files
+    await sm.execute(UpdateState("relevant_files", []))
+    await sm.commit()
+    await sm.load_relevant_file_contents()
+    assert sm.current_state.get_file_by_path("b.txt").content.content == "b"
+
+
 @pytest.mark.asyncio
 @patch("core.state.state_manager.get_config")
 async def test_importing_changed_files_to_db(mock_get_config, tmpdir, testmanager):
@@ -193,6 +247,71 @@ async def test_importing_changed_files_to_db(mock_get_config, tmpdir, testmanage
         assert "file3.txt" in db_files
 
 
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_import_files_reads_only_changed_files(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir))
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    for i in range(3):
+        await sm.save_file(f"file{i}.txt", f"this is the content {i}")
+    await sm.commit()
+
+    # Files changed in the last few seconds are always read, so make them older
+    mtime = time.time() - 60
+    for path in sm.file_system.list():
+        os.utime(sm.file_system.get_full_path(path), (mtime, mtime))
+    assert await sm.get_modified_files() == []
+    assert os.path.exists(os.path.join(tmpdir, ".test.stat-cache.json"))
+
+    with open(os.path.join(tmpdir, "test", "file1.txt"), "a") as f:
+        f.write("modified")
+
+    with patch.object(sm.file_system, "read", wraps=sm.file_system.read) as mock_read:
+        imported, removed = await sm.import_files()
+
+    assert [f.path for f in imported] == ["file1.txt"]
+    # Only the changed file is read
+    assert {call.args[0] for call in mock_read.call_args_list} == {"file1.txt"}
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_import_files_with_watcher(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir), watch=True)
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    await sm.save_file("file1.txt", "this is the content 1")
+    await sm.save_file("dir/file2.txt", "this is the content 2")
+    await sm.commit()
+
+    # The first import scans the whole workspace
+    assert await sm.import_files() == ([], [])
+
+    with open(os.path.join(tmpdir, "test", "file1.txt"), "a") as f:
+        f.write("modified")
+    with open(os.path.join(tmpdir, "test", "file3.txt"), "w") as f:
+        f.write("new file")
+    os.remove(os.path.join(tmpdir, "test", "dir", "file2.txt"))
+
+    # After that, only the changes reported by the watcher are checked
+    with patch.object(sm.file_system, "list", side_effect=AssertionError("workspace was listed")):
+        assert sorted(await sm.get_modified_files()) == ["dir/file2.txt", "file1.txt", "file3.txt"]
+        imported, removed = await sm.import_files()
+        assert sorted(f.path for f in imported) == ["file1.txt", "file3.txt"]
+        assert removed == ["dir/file2.txt"]
+        await sm.commit()
+
+        # Pythagora's own changes are not imported
+        await sm.save_file("file1.txt", "changed by pythagora")
+        await sm.commit()
+        assert await sm.import_files() == ([], [])
+
+    sm.file_system.close()
+
+
 @pytest.mark.asyncio
 @patch("core.state.state_manager.get_config")
 async def test_restoring_files_from_db(mock_get_config, tmpdir, testmanager):
@@ -220,3 +339,383 @@ async def test_restoring_files_from_db(mock_get_config, tmpdir, testmanager):
         assert open(os.path.join(tmpdir, "test1", "file1.txt")).read() == "this is the content 1"
         assert open(os.path.join(tmpdir, "test1", "file2.txt")).read() == "this is the content 2"
         assert open(os.path.join(tmpdir, "test1", "file3.txt")).read() == "this is the content 3"
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_restore_files_writes_only_divergent_files(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir))
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    for i in range(4):
+        await sm.save_file(f"file{i}.txt", f"this is the content {i}")
+    await sm.commit()
+
+    root = os.path.join(tmpdir, "test")
+    mtime = time.time() - 60
+    for path in sm.file_system.list():
+        os.utime(os.path.join(root, path), (mtime, mtime))
+
+    os.remove(os.path.join(root, "file0.txt"))
+    with open(os.path.join(root, "file1.txt"), "a") as f:
+        f.write("modified")
+    with open(os.path.join(root, "unknown.txt"), "w") as f:
+        f.write("not in the project")
+
+    report = await sm.restore_files(dry_run=True)
+    assert report == RestoreReport(created=["file0.txt"], modified=["file1.txt"], removed=["unknown.txt"])
+    assert os.path.exists(os.path.join(root, "unknown.txt"))
+
+    report = await sm.restore_files()
+    assert str(report) == "1 created, 1 modified, 1 removed"
+    assert sorted(sm.file_system.list()) == ["file0.txt", "file1.txt", "file2.txt", "file3.txt"]
+    assert open(os.path.join(root, "file1.txt")).read() == "this is the content 1"
+    # Unchanged files are not touched
+    assert os.path.getmtime(os.path.join(root, "file2.txt")) == mtime
+
+    assert not await sm.restore_files()
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_restore_files_from_snapshots(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir), snapshots=True)
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    await sm.save_file("file1.txt", "this is the content 1")
+    with open(os.path.join(tmpdir, "test", "file2.txt"), "w") as f:
+        f.write("imported file")
+    await sm.import_files()
+    await sm.commit()
+    assert len(sm.file_system.snapshots) == 2
+
+    os.remove(os.path.join(tmpdir, "test", "file1.txt"))
+    os.remove(os.path.join(tmpdir, "test", "file2.txt"))
+    with patch.object(sm, "load_file_contents", wraps=sm.load_file_contents) as mock_load:
+        report = await sm.restore_files()
+
+    assert sorted(report.created) == ["file1.txt", "file2.txt"]
+    # The contents were not loaded from the database
+    mock_load.assert_called_once_with([])
+    assert open(os.path.join(tmpdir, "test", "file2.txt")).read() == "imported file"
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_apply_overlay(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir))
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    await sm.save_file("file1.txt", "one")
+    await sm.save_file("file2.txt", "two")
+    await sm.commit()
+
+    rejected = sm.create_overlay()
+    rejected.save("file1.txt", "rejected")
+    rejected.discard()
+
+    overlay = sm.create_overlay()
+    overlay.save("file1.txt", "accepted")
+    overlay.save("file3.txt", "three")
+    overlay.remove("file2.txt")
+    assert open(os.path.join(tmpdir, "test", "file1.txt")).read() == "one"
+
+    assert await sm.apply_overlay(overlay) == ["file1.txt", "file2.txt", "file3.txt"]
+    assert sm.file_system.list() == ["file1.txt", "file3.txt"]
+    assert open(os.path.join(tmpdir, "test", "file1.txt")).read() == "accepted"
+    assert sorted(f.path for f in sm.next_state.files) == ["file1.txt", "file3.txt"]
+    assert sm.next_state.get_file_by_path("file1.txt").content.content == "accepted"
+
+    with pytest.raises(ValueError):
+        await sm.apply_overlay(OverlayVFS(MemoryVFS()))
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+@patch("core.state.state_manager.get_config")
+async def test_git_mirror(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir), git_mirror=True)
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    await sm.save_file("file1.txt", "one")
+    await sm.save_file("file2.txt", "two")
+    first = await sm.commit()
+    await sm.save_file("file1.txt", "one, changed")
+    sm.next_state.action = "Change file1"
+    second = await sm.commit()
+
+    assert sm.git_mirror.changed_files(str(first.id), str(second.id)) == [("M", "file1.txt")]
+    diff = await sm.diff_states(first, second)
+    assert "-one\n" in diff and "+one, changed\n" in diff
+    assert sm.git_mirror.get_tip(str(second.branch_id)) == str(second.id)
+
+    # Mirroring continues from the branch tip after reloading the project
+    await sm.load_project(branch_id=second.branch_id)
+    await sm.save_file("file2.txt", "two, changed")
+    third = await sm.commit()
+    assert sm.git_mirror.changed_files(str(first.id), str(third.id)) == [("M", "file1.txt"), ("M", "file2.txt")]
+
+    # The next state isn't mirrored yet, so it's diffed from the database
+    await sm.save_file("file2.txt", "two, changed again")
+    diff = await sm.diff_states(third, sm.next_state)
+    assert "--- a/file2.txt\n+++ b/file2.txt\n" in diff and "+two, changed again\n" in diff
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+@patch("core.state.state_manager.get_config")
+async def test_diff_steps_uses_git_mirror(mock_get_config, tmpdir, testmanager):
+    mock_get_config.return_value.fs = FileSystemConfig(workspace_root=str(tmpdir), git_mirror=True)
+    sm = StateManager(testmanager)
+    project = await sm.create_project("test")
+    await sm.commit()
+    await sm.save_file("file1.txt", "one")
+    first = await sm.commit()
+    await sm.save_file("file1.txt", "one, changed")
+    await sm.save_file("file2.txt", "two")
+    second = await sm.commit()
+    await sm.wait_for_commit()
+
+    with patch.object(ProjectState, "load_file_contents") as mock_load:
+        diff = await StateManager(testmanager).diff_steps(first.step_index, second.step_index, project_id=project.id)
+
+    mock_load.assert_not_called()
+    assert "diff --git a/file1.txt b/file1.txt\n" in diff
+    assert "-one\n" in diff and "+one, changed\n" in diff
+    assert "+two\n" in diff
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_diff_steps_without_git_mirror(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    project = await sm.create_project("test")
+    await sm.commit()
+    await sm.save_file("file1.txt", "one\n")
+    await sm.save_file("file2.txt", "two")
+    first = await sm.commit()
+    await sm.save_file("file1.txt", "one\nmore\n")
+    sm.next_state.files.remove(sm.next_state.get_file_by_path("file2.txt"))
+    second = await sm.commit()
+    await sm.wait_for_commit()
+
+    diff = await StateManager(testmanager).diff_steps(first.step_index, second.step_index, project_id=project.id)
+    assert diff == (
+        "--- a/file1.txt\n+++ b/file1.txt\n@@ -1 +1,2 @@\n one\n+more\n"
+        "--- a/file2.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-two\n"
+    )
+    assert await StateManager(testmanager).diff_steps(first.step_index, 100, project_id=project.id) is None
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_saved_files_are_stored_in_patched_states(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+
+    expected = {}
+    for i in range(5):
+        await sm.save_file(f"file{i}.txt", f"content {i}")
+        state = await sm.commit()
+        expected[state.step_index] = (list(state.relevant_files), dict(state.modified_files))
+    branch_id = state.branch_id
+
+    async with testmanager as session:
+        for step_index, (relevant_files, modified_files) in expected.items():
+            session.expunge_all()
+            branch = await session.get(Branch, branch_id)
+            state = await branch.get_state_at_step(step_index)
+            assert state.delta is not None
+            assert state.relevant_files == relevant_files
+            assert state.modified_files == modified_files
+    assert relevant_files == [f"file{i}.txt" for i in range(5)]
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_compact_project(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    project = await sm.create_project("test")
+    project_id = project.id
+    await sm.commit()
+
+    for i in range(5):
+        await sm.save_file("test.txt", f"version {i}")
+        await sm.commit()
+    await sm.rollback()
+
+    n_squashed = await sm.compact_project(project_id, RetentionConfig(keep_last_steps=2))
+    assert n_squashed == 3
+
+    project_state = await sm.load_project(project_id=project_id)
+    assert project_state.step_index == 6
+    file = await sm.get_file_by_path("test.txt")
+    assert file.content.content == "version 4"
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_compact_nonexistent_project(mock_get_config, testmanager):
+    sm = StateManager(testmanager)
+    assert await sm.compact_project(uuid4(), RetentionConfig(keep_last_steps=2)) is None
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_load_project_applies_retention_policy(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    project = await sm.create_project("test")
+    project_id = project.id
+    for _ in range(5):
+        await sm.commit()
+
+    testmanager.config.retention = RetentionConfig(keep_last_steps=2)
+    project_state = await sm.load_project(project_id=project_id)
+    assert project_state.step_index == 5
+
+    async with testmanager as session:
+        result = await session.execute(select(ProjectState.step_index).order_by(ProjectState.step_index))
+        assert result.scalars().all() == [1, 4, 5, 6]
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_load_earlier_step_forks_branch(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    project = await sm.create_project("test")
+    main_id = sm.branch.id
+    await sm.commit()
+    for i in range(3):
+        sm.next_state.tasks = [{"description": f"task {i}"}]
+        await sm.commit()
+
+    project_state = await sm.load_project(project_id=project.id, step_index=2)
+
+    assert project_state.step_index == 2
+    assert project_state.branch_id == main_id
+    assert sm.branch.id != main_id
+    assert sm.branch.name == "main@2"
+    assert sm.next_state.branch_id == sm.branch.id
+    assert sm.next_state.step_index == 3
+
+    fork_id = sm.branch.id
+    await sm.commit()
+
+    # The original branch is intact
+    project_state = await sm.load_project(branch_id=main_id)
+    assert project_state.step_index == 4
+    assert project_state.tasks == [{"description": "task 2"}]
+
+    project_state = await sm.load_project(branch_id=fork_id)
+    assert project_state.step_index == 3
+    assert project_state.branch_id == fork_id
+    assert project_state.tasks == [{"description": "task 0"}]
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_commit_in_background(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+
+    sm.next_state.tasks = [{"description": "task 1"}]
+    state = await sm.commit(background=True)
+    assert sm.pending_commit is not None
+    assert sm.current_state is state
+    assert sm.next_state.prev_state_id == state.id
+
+    # The next state can be worked on while the commit is in progress
+    sm.next_state.tasks = sm.next_state.tasks + [{"description": "task 2"}]
+    await sm.save_file("test.txt", "Hello, world!")
+
+    next_state = await sm.commit(background=True)
+    await sm.wait_for_commit()
+    state_id, next_state_id, step_index = state.id, next_state.id, next_state.step_index
+
+    async with testmanager.SessionClass() as session:
+        result = await session.execute(
+            select(ProjectState.step_index, ProjectState.prev_state_id).where(ProjectState.id == next_state_id)
+        )
+        assert result.one() == (step_index, state_id)
+
+    project_state = await sm.load_project(branch_id=sm.branch.id)
+    assert project_state.id == next_state_id
+    assert project_state.tasks == [{"description": "task 1"}, {"description": "task 2"}]
+    assert project_state.get_file_by_path("test.txt") is not None
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_commit_in_background_error(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+
+    sm.commit_with_retry = AsyncMock(side_effect=RuntimeError("disk full"))
+    await sm.commit(background=True)
+
+    # The error is raised before the next commit
+    with pytest.raises(RuntimeError, match="disk full"):
+        await sm.commit()
+    assert sm.pending_commit is None
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_commit_pipelining_disabled(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    testmanager.config.pipelined_commits = False
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+
+    await sm.commit(background=True)
+    assert sm.pending_commit is None
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_commit_doesnt_reattach_previous_states(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+
+    states = []
+    for i in range(5):
+        await sm.save_file(f"file{i}.txt", f"content {i}")
+        states.append(await sm.commit())
+
+    assert states[-1] in sm.current_session
+    assert not any(state in sm.current_session for state in states[:-1])
+
+
+@pytest.mark.asyncio
+@patch("core.state.state_manager.get_config")
+async def test_load_cached_file_contents_during_commit(mock_get_config, testmanager):
+    mock_get_config.return_value.fs.type = "memory"
+    sm = StateManager(testmanager)
+    await sm.create_project("test")
+    await sm.commit()
+    await sm.save_file("test.txt", "Hello, world!")
+    await sm.commit()
+
+    file = sm.current_state.get_file_by_path("test.txt")
+    assert not file.content.is_loaded
+
+    # Cached contents are loaded without waiting for the database session
+    async with sm.db_blocker():
+        await asyncio.wait_for(sm.load_file_contents(), timeout=1)
+    assert file.content.content == "Hello, world!"